@@ -2,4 +2,4 @@
 
 sudo apt-get install python python-dev libpthread-stubs0-dev libpcap-dev
 
-sudo pip install -U cherrypy scapy psutil enum34 netifaces Adafruit-CharLCD
+sudo pip install -U cherrypy scapy psutil enum34 netifaces Adafruit-CharLCD numpy
@@ -4,6 +4,8 @@
 #include <math.h>
 #include <netinet/tcp.h>
 #include <pcap.h>
+#include <poll.h>
+#include <stddef.h>
 #include <pthread.h>
 #include <stdint.h>
 #include <stdio.h>
@@ -36,15 +38,43 @@
 /* Filter that pcap applies to any incoming packets. */
 #define PCAP_FILTER "port 4321"
 
-/* The file to save all incoming packets to. */
+/* The file to save all incoming packets to. When it is rotated, it becomes
+ * PCAP_FILE.1, the one before that PCAP_FILE.2, and so on. */
 #define PCAP_FILE "received_packets.pcap"
 
+/* Captured packets go through a ring of CAPTURE_RING_SIZE bytes (a power of
+ * two) to the thread that writes them to PCAP_FILE, so the capture thread
+ * never waits on the disk. If the ring is full, packets are left out of the
+ * file (and still counted everywhere else). */
+#define CAPTURE_RING_SIZE (8 * 1024 * 1024)
+
+/* The writer waits for at least CAPTURE_BATCH_SIZE bytes to write at once,
+ * ending on a multiple of CAPTURE_ALIGN bytes into the file, so an SD card
+ * sees whole pages written instead of the same one over and over. Whatever
+ * is left is written once it has waited CAPTURE_FLUSH_MS. */
+#define CAPTURE_BATCH_SIZE (256 * 1024)
+#define CAPTURE_ALIGN 4096
+#define CAPTURE_FLUSH_MS 500
+
+/* How long the writer sleeps when there is nothing to write. */
+#define CAPTURE_POLL_NSEC 10000000
+
+/* The defaults for the -C, -G and -W options, see usage. */
+#define CAPTURE_MAX_MEGABYTES 100
+#define CAPTURE_MAX_SECONDS 0
+#define CAPTURE_KEEP_FILES 10
+
 /* The size of the buffer that holds incoming packets. */
 #define PCAP_BUFFER_SIZE 2097152
 
-/* The buffer that will be used to hold the packet that the UI sends over,
- * must be big enough to gurantee that it does not overflow (obviously). */
-#define UI_BUFFER_SIZE 2048
+/* The largest packet that can be held, big enough for jumbo frames (9000
+ * byte MTU) with plenty to spare. */
+#define MAX_PACKET_SIZE 65535
+
+/* How many bytes of each SEASIDE message's data are printed as it comes
+ * in. Messages can be megabytes, and printing all of them would hold up the
+ * connection. */
+#define LOG_DATA_BYTES 16
 
 #define NANOSECONDS_PER_SECOND 1000000000
 
@@ -60,16 +90,280 @@
 #define SEASIDE_START_SEQUENCE  9
 #define SEASIDE_STOP_SEQUENCE   10
 #define SEASIDE_RESPONSE        11
+#define SEASIDE_SUBSCRIBE_STATS 12
+#define SEASIDE_STATS           13
+#define SEASIDE_SET_MUTATORS    14
+#define SEASIDE_START_REPLAY    15
+#define SEASIDE_STOP_REPLAY     16
+#define SEASIDE_SET_RATE        17
+#define SEASIDE_SEND_BURST      18
+#define SEASIDE_GET_TX_STATS    19
+#define SEASIDE_GET_GAPS        20
+#define SEASIDE_GET_RX_RATES    21
+#define SEASIDE_GET_PACKETS     22
+#define SEASIDE_GET_FLOWS       23
+
+/* Packets are counted per flow (see flow_key) in a hash table of
+ * FLOW_TABLE_SIZE (a power of two) flows. A flow is looked for in up to
+ * FLOW_MAX_PROBE slots from where it hashes to; a new one takes the first
+ * of those that is empty or has been idle for FLOW_IDLE_SEC, or else the
+ * one that has been idle the longest. */
+#define FLOW_TABLE_SIZE 4096
+#define FLOW_MAX_PROBE 16
+#define FLOW_IDLE_SEC 60
+
+/* The flows a SEASIDE_GET_FLOWS returns by default, and at most. */
+#define FLOW_DEFAULT_TOP 10
+#define FLOW_MAX_TOP 64
+
+/* What a SEASIDE_GET_FLOWS orders the flows by. */
+#define FLOW_ORDER_BYTES 0
+#define FLOW_ORDER_PACKETS 1
+
+#define ETHERTYPE_VLAN 0x8100
+#define ETHERTYPE_QINQ 0x88a8
+#define ETHERTYPE_IPV4 0x0800
+#define ETHERTYPE_IPV6 0x86dd
+#define IP_PROTOCOL_TCP 6
+#define IP_PROTOCOL_UDP 17
+#define IP_PROTOCOL_SCTP 132
+
+/* The last PACKET_RING_SLOTS (a power of two) packets received are kept for
+ * SEASIDE_GET_PACKET(S), each cut down to its first PACKET_RING_SNAPLEN
+ * bytes, which is all of any packet short of a jumbo frame (the pcap file
+ * still gets all of it, and so does SEASIDE_GET_PACKET, see big_packet). */
+#define PACKET_RING_SLOTS 1024
+#define PACKET_RING_SNAPLEN 2048
+
+/* The most data a response to SEASIDE_GET_PACKETS holds, which is also the
+ * size of the buffer each UI connection builds it in. */
+#define PACKETS_MAX_RESPONSE (256 * 1024)
+
+/* The received packets and bytes are counted in slots of RATE_SLOT_NSEC
+ * nanoseconds, in a ring of RATE_SLOTS (a power of two) of them, so the rate
+ * can be measured over any window up to RATE_SLOTS - 1 slots (16 seconds),
+ * to within a slot. SEASIDE_GET_BANDWIDTH and the statistics pushes measure
+ * it over RATE_WINDOW_MS, and a SEASIDE_GET_RX_RATES with no windows over
+ * each of RATE_DEFAULT_WINDOWS_MS. */
+#define RATE_SLOT_NSEC 1000000
+#define RATE_SLOTS 16384
+#define RATE_WINDOW_MS 1000
+#define RATE_DEFAULT_WINDOWS_MS {100, 1000, 10000}
+
+/* The most windows a single SEASIDE_GET_RX_RATES can ask for. */
+#define RATE_MAX_WINDOWS 16
+
+/* The gaps between the arrivals of packets are counted in a log-linear
+ * histogram: gaps shorter than 2 * GAP_SUB_BUCKETS nanoseconds get a bucket
+ * each, and every doubling from there on is split into GAP_SUB_BUCKETS
+ * buckets, so no bucket is wider than 1 / GAP_SUB_BUCKETS of the gaps in it
+ * (12.5%). The last bucket ends at 2^GAP_MAX_BITS nanoseconds (34 seconds),
+ * and also holds any longer gaps. */
+#define GAP_SUB_BITS 3
+#define GAP_SUB_BUCKETS (1 << GAP_SUB_BITS)
+#define GAP_MAX_BITS 35
+#define GAP_BUCKETS ((GAP_MAX_BITS - GAP_SUB_BITS + 1) * GAP_SUB_BUCKETS)
+
+/* The shortest interval between two statistics pushes that a UI connection
+ * can subscribe to, in milliseconds. */
+#define MIN_STATS_INTERVAL 10
+
+/* Set on the type of a message that carries a request ID. The four byte ID
+ * follows the three byte header (it is not counted in the size), and is
+ * echoed back in the header of the response, so the UI side can have
+ * several requests in flight on the same connection. */
+#define SEASIDE_TAGGED 0x80
+
+/* The size of the header at the start of every SEASIDE message: one byte
+ * of type, and two bytes of size. */
+#define SEASIDE_HEADER_SIZE 3
+
+/* A size of SEASIDE_EXTENDED in the header means that the data is too big
+ * for two bytes. Its real size follows the header as four bytes (before the
+ * request ID, if tagged), and is not counted in the size either. */
+#define SEASIDE_EXTENDED UINT16_MAX
+
+/* The most data a single SEASIDE message may carry, so that a corrupted
+ * size can't make a UI connection allocate unbounded memory. */
+#define SEASIDE_MAX_SIZE (16 * 1024 * 1024)
 
 /* Struct to hold the info that we receive from the UI side. The type
  * refers to the type of data that it holds (see above defines), and the size
- * member is the size of the data that it receives. */
+ * member is the size of the data that it receives. If tagged is set, id holds
+ * the request ID that should be echoed in the response. */
 typedef struct {
     uint8_t type;
-    uint16_t size;
+    uint32_t size;
+    uint8_t tagged;
+    uint32_t id;
     uint8_t *data;
 } __attribute__((packed)) SEASIDE;
 
+/* The size of the buffer that each UI connection starts out reading into. It
+ * is big enough for any message without an extended size; the buffer grows
+ * for bigger ones, so a message's data can always be used right where it was
+ * received. */
+#define SEASIDE_STREAM_SIZE \
+    (SEASIDE_HEADER_SIZE + 2 * sizeof(uint32_t) + UINT16_MAX)
+
+/* Buffered reader for the stream of SEASIDE messages on a UI connection.
+ * Bytes between start and end have been received, but not parsed yet, and
+ * capacity is the size of buf. */
+typedef struct {
+    int fd;
+    size_t start;
+    size_t end;
+    size_t capacity;
+    uint8_t *buf;
+} seaside_stream;
+
+/* The statistics record that is pushed to UI connections that subscribed
+ * with SEASIDE_SUBSCRIBE_STATS. The timestamp is CLOCK_MONOTONIC in
+ * nanoseconds, bandwidth is in bits/s, and packets is the number of packets
+ * received so far. */
+typedef struct {
+    uint64_t timestamp;
+    uint64_t bandwidth;
+    uint64_t packets;
+} __attribute__((packed)) seaside_stats;
+
+/* The counters at the start of a slot of the received rate (see
+ * RATE_SLOT_NSEC): the number of the slot (CLOCK_MONOTONIC over
+ * RATE_SLOT_NSEC), and the packets and bytes received before it. */
+typedef struct {
+    uint64_t number;
+    uint64_t packets;
+    uint64_t bytes;
+} rate_slot;
+
+/* A packet in the ring of the last ones received: its sequence number (the
+ * number of packets received up to and including it), pcap's timestamp in
+ * nanoseconds, its length on the wire, and the part of it that is kept.
+ * Only the capture thread writes to a slot, and it makes version odd while
+ * it does, so readers can tell if the packet changed under them. */
+typedef struct {
+    volatile uint32_t version;
+    uint64_t seq;
+    uint64_t timestamp;
+    uint32_t len;
+    uint32_t caplen;
+    uint8_t data[PACKET_RING_SNAPLEN];
+} ring_packet;
+
+/* The data of a SEASIDE_GET_PACKETS message: the sequence number of the
+ * last packet the UI side already has (0 for none), and the most packets to
+ * return. Either can be left off, for 0 and no limit. */
+typedef struct {
+    uint64_t since;
+    uint32_t max;
+} __attribute__((packed)) seaside_packets_request;
+
+/* The response to a SEASIDE_GET_PACKETS message starts with the sequence
+ * number of the last packet received (the number of packets received), and
+ * the number of packets in the response. Each packet follows, oldest first,
+ * as a seaside_packet_header (the same as a ring_packet's) and its caplen
+ * bytes of data. */
+typedef struct {
+    uint64_t last;
+    uint32_t count;
+} __attribute__((packed)) seaside_packets_header;
+
+typedef struct {
+    uint64_t seq;
+    uint64_t timestamp;
+    uint32_t len;
+    uint32_t caplen;
+} __attribute__((packed)) seaside_packet_header;
+
+/* One window of the response to a SEASIDE_GET_RX_RATES message: the window
+ * in milliseconds (as asked for, or shortened to the longest there is), and
+ * the bits/s and packets/s received over it. */
+typedef struct {
+    uint32_t window_ms;
+    uint64_t bps;
+    uint64_t pps;
+} __attribute__((packed)) seaside_rx_rate;
+
+/* The response to a SEASIDE_GET_GAPS message, all in nanoseconds: the
+ * number of gaps between packets measured since startup (or the last
+ * reset), the shortest, longest and mean gap, their 50th, 99th and 99.9th
+ * percentiles (to within the width of their bucket), and the count in each
+ * bucket of the histogram (see GAP_SUB_BITS). */
+typedef struct {
+    uint64_t count;
+    uint64_t min;
+    uint64_t max;
+    uint64_t mean;
+    uint64_t p50;
+    uint64_t p99;
+    uint64_t p999;
+    uint64_t buckets[GAP_BUCKETS];
+} __attribute__((packed)) seaside_gaps;
+
+/* What packets are told apart into flows by: the outer VLAN ID (0 if
+ * untagged), the ethertype after any VLAN tags, and for IP, the protocol,
+ * the source and destination addresses (IPv4 ones in the first four bytes),
+ * and the ports for TCP, UDP and SCTP. Everything that isn't there is 0, so
+ * keys can be compared with memcmp. */
+typedef struct {
+    uint16_t vlan;
+    uint16_t ethertype;
+    uint16_t protocol;
+    uint16_t src_port;
+    uint16_t dst_port;
+    uint8_t src[16];
+    uint8_t dst[16];
+} flow_key;
+
+/* A flow in the table: the packets and bytes (on the wire) received in it,
+ * pcap's timestamps of its first and last packet and the longest gap
+ * between two of them, in nanoseconds. used is 0 for a slot no flow has
+ * ever had. */
+typedef struct {
+    flow_key key;
+    int used;
+    uint64_t packets;
+    uint64_t bytes;
+    uint64_t first;
+    uint64_t last;
+    uint64_t max_gap;
+} flow_entry;
+
+/* The data of a SEASIDE_GET_FLOWS message, either of which can be left off:
+ * what to order the flows by (one of the FLOW_ORDER_ defines), and how many
+ * of the top flows to return. */
+typedef struct {
+    uint8_t order;
+    uint16_t count;
+} __attribute__((packed)) seaside_flows_request;
+
+/* A flow in the response to a SEASIDE_GET_FLOWS message. */
+typedef struct {
+    uint16_t vlan;
+    uint16_t ethertype;
+    uint16_t protocol;
+    uint16_t src_port;
+    uint16_t dst_port;
+    uint8_t src[16];
+    uint8_t dst[16];
+    uint64_t packets;
+    uint64_t bytes;
+    uint64_t first;
+    uint64_t last;
+    uint64_t max_gap;
+} __attribute__((packed)) seaside_flow;
+
+/* The response to a SEASIDE_GET_FLOWS message: the number of flows with a
+ * packet in the last FLOW_IDLE_SEC, the number of flows that have been
+ * evicted from the table to make room for new ones, and the number of flows
+ * that follow, from the top down. */
+typedef struct {
+    uint64_t active;
+    uint64_t evicted;
+    uint32_t count;
+    seaside_flow flows[FLOW_MAX_TOP];
+} __attribute__((packed)) seaside_flows;
+
 /* Singleton file, used to ensure only once instance of this program
  * is running at a time. */
 static int singleton_file;
@@ -90,30 +384,92 @@ static pthread_t ui_listen_thread;
 /* pcap handle for the listener that we'll create. */
 static pcap_t *handle;
 
-/* packet and packet length, to send to the receiving Pi. */
-static uint8_t packet[UI_BUFFER_SIZE] = {'\0'};
-static size_t packet_len = 0;
-
-/* Mutex to ensure no two threads attempt to modify packet or packet_len
- * at the same time. */
+/* The ring of the last packets received, and the sequence number of the
+ * last one put in it (0 until there is one). Only the capture thread
+ * changes them, packet_ring_last with the __sync builtins. */
+static ring_packet packet_ring[PACKET_RING_SLOTS];
+static volatile uint64_t packet_ring_last = 0;
+
+/* The whole of the last packet received that was too big for the ring, and
+ * its sequence number (0 if there is none), so SEASIDE_GET_PACKET still
+ * returns all of a jumbo frame. Guarded by packet_mutex, and set before the
+ * packet is put in the ring. */
+static uint8_t big_packet[MAX_PACKET_SIZE];
+static uint32_t big_packet_caplen = 0;
+static uint64_t big_packet_seq = 0;
+
+/* Mutex to ensure no two threads attempt to modify the gap histogram, the
+ * flow table or big_packet at the same time. */
 static pthread_mutex_t packet_mutex;
 
-/* Variable to hold the bandwidth calculation (bits/s). */
-static unsigned long long bandwidth = 0;
+/* The table of flows, and the number of them evicted so far. Only touched
+ * with packet_mutex held. */
+static flow_entry flow_table[FLOW_TABLE_SIZE];
+static uint64_t flows_evicted = 0;
 
 /* Variable to hold how many packets we have received. Used for diagnostic
  * purposes on the UI side. */
 static volatile uint32_t num_packets_received = 0;
 
-/* Timespecs for received packets. Used to calculate bandwidth. */
-static struct timespec cur_time;
-static struct timespec packet_received_time;
-static struct timespec prev_packet_received_time;
-static struct timespec elapsed_time;
+/* The packets and bytes (as they were on the wire) received since startup,
+ * and the ring of their values at the start of each slot (see
+ * RATE_SLOT_NSEC), up to the slot numbered rate_last_slot. Only the capture
+ * thread writes them, without taking packet_mutex, so it never waits for a
+ * reader: it makes rate_seq odd while it does, and readers try again if it
+ * was odd or changed while they read. */
+static uint64_t rate_packets = 0;
+static uint64_t rate_bytes = 0;
+static rate_slot rate_slots[RATE_SLOTS];
+static uint64_t rate_last_slot = 0;
+static volatile unsigned int rate_seq = 0;
+
+/* The histogram of the gaps between packet arrivals, and the count, sum,
+ * shortest and longest of them, for SEASIDE_GET_GAPS. The gaps are measured
+ * between the timestamps pcap gives the packets (when the kernel received
+ * them, so how long they waited in pcap's buffer doesn't matter), which are
+ * in units of tstamp_nsec nanoseconds. last_arrival is 0 until the first
+ * packet after startup or a reset. Only touched with packet_mutex held. */
+static uint64_t gap_buckets[GAP_BUCKETS];
+static uint64_t gap_count = 0;
+static uint64_t gap_sum = 0;
+static uint64_t gap_min = UINT64_MAX;
+static uint64_t gap_max = 0;
+static uint64_t last_arrival = 0;
+static uint64_t tstamp_nsec = 1000;
 
 /* File descriptor to the pcap file where we save all incoming packets. */
 static int pcap_file_fd;
 
+/* The ring of packets on their way to the pcap file, each one a pcap record
+ * header and then the packet, as they go in the file. capture_head is where
+ * the capture thread puts the next one, and capture_tail is where the
+ * writer thread takes the next bytes from; both only ever go up (wrapping
+ * around with size_t), and are only changed by their own thread. */
+static uint8_t capture_ring[CAPTURE_RING_SIZE]
+    __attribute__((aligned(CAPTURE_ALIGN)));
+static volatile size_t capture_head = 0;
+static volatile size_t capture_tail = 0;
+
+/* The number of packets left out of the pcap file because the ring was
+ * full. Only changed with the __sync builtins. */
+static volatile uint64_t capture_dropped = 0;
+
+/* Set to have the writer thread write out what is left, and stop. */
+static volatile int capture_stopping = 0;
+
+/* The writer thread, and its state: how big the current pcap file is, and
+ * when (CLOCK_MONOTONIC seconds) it was created. */
+static pthread_t capture_thread;
+static uint64_t capture_file_size;
+static time_t capture_opened;
+
+/* Start a new pcap file once the current one would grow past
+ * capture_max_bytes, or is capture_max_seconds old (0 for no limit), and
+ * keep capture_keep_files of the old ones. Set by the command line. */
+static uint64_t capture_max_bytes = (uint64_t) CAPTURE_MAX_MEGABYTES << 20;
+static unsigned long capture_max_seconds = CAPTURE_MAX_SECONDS;
+static unsigned long capture_keep_files = CAPTURE_KEEP_FILES;
+
 /* A pcap file global header, which goes at the beginning of every pcap file.
  * Note that this is in big-endian format. */
 const uint8_t PCAP_GLOBAL_HEADER[] = {
@@ -187,6 +543,802 @@ write_helper(int fd, void *buf, size_t size)
     return 0;
 }
 
+/* Returns the bucket of the gap histogram that a gap falls in. */
+static unsigned int
+gap_bucket(uint64_t gap)
+{
+    if (gap < 2 * GAP_SUB_BUCKETS) {
+        return (unsigned int) gap;
+    }
+
+    /* The position of the highest bit, less the bits that pick the bucket
+     * within its doubling. */
+    unsigned int shift = (unsigned int) (63 - __builtin_clzll(gap))
+                         - GAP_SUB_BITS;
+    unsigned int bucket = shift * GAP_SUB_BUCKETS
+                          + (unsigned int) (gap >> shift);
+    return bucket < GAP_BUCKETS ? bucket : GAP_BUCKETS - 1;
+}
+
+/* Returns the shortest gap that falls in a bucket of the gap histogram. */
+static uint64_t
+gap_bucket_start(unsigned int bucket)
+{
+    if (bucket < 2 * GAP_SUB_BUCKETS) {
+        return bucket;
+    }
+    unsigned int shift = bucket / GAP_SUB_BUCKETS - 1;
+    return (uint64_t) (bucket % GAP_SUB_BUCKETS + GAP_SUB_BUCKETS) << shift;
+}
+
+/* Counts the gap between the last packet and one that arrived at arrival
+ * (in nanoseconds). Must be called with packet_mutex held. */
+static void
+count_gap(uint64_t arrival)
+{
+    /* Timestamps that go backwards (e.g. the clock was set) aren't gaps. */
+    if (last_arrival != 0 && arrival >= last_arrival) {
+        uint64_t gap = arrival - last_arrival;
+        ++gap_buckets[gap_bucket(gap)];
+        ++gap_count;
+        gap_sum += gap;
+        gap_min = MIN(gap_min, gap);
+        gap_max = MAX(gap_max, gap);
+    }
+    last_arrival = arrival;
+}
+
+/* Returns the gap that a fraction of the gaps are no longer than, from the
+ * histogram: interpolated within its bucket, and within the shortest and
+ * longest gap. Must be called with packet_mutex held, and gap_count > 0. */
+static uint64_t
+gap_percentile(double fraction)
+{
+    double exact_rank = ceil(fraction * (double) gap_count);
+    uint64_t rank = (uint64_t) exact_rank;
+    uint64_t seen = 0;
+    unsigned int bucket = 0;
+
+    if (rank == 0) {
+        rank = 1;
+    }
+    while (bucket < GAP_BUCKETS - 1 && seen + gap_buckets[bucket] < rank) {
+        seen += gap_buckets[bucket++];
+    }
+
+    uint64_t start = gap_bucket_start(bucket);
+    uint64_t width = bucket < GAP_BUCKETS - 1
+                     ? gap_bucket_start(bucket + 1) - start : 0;
+    uint64_t gap = start;
+    if (gap_buckets[bucket] > 0) {
+        gap += (uint64_t) ((double) width * (double) (rank - seen)
+                           / (double) gap_buckets[bucket]);
+    }
+    if (gap < gap_min) {
+        gap = gap_min;
+    }
+    return gap > gap_max ? gap_max : gap;
+}
+
+/* Fills in a response to SEASIDE_GET_GAPS, and starts the histogram over if
+ * reset is set. Must be called with packet_mutex held. */
+static void
+get_gaps(seaside_gaps *gaps, int reset)
+{
+    memcpy(gaps->buckets, gap_buckets, sizeof(gap_buckets));
+    gaps->count = gap_count;
+    if (gap_count > 0) {
+        gaps->min = gap_min;
+        gaps->max = gap_max;
+        gaps->mean = gap_sum / gap_count;
+        gaps->p50 = gap_percentile(0.5);
+        gaps->p99 = gap_percentile(0.99);
+        gaps->p999 = gap_percentile(0.999);
+    } else {
+        gaps->min = gaps->max = gaps->mean = 0;
+        gaps->p50 = gaps->p99 = gaps->p999 = 0;
+    }
+
+    if (reset) {
+        memset(gap_buckets, 0, sizeof(gap_buckets));
+        gap_count = 0;
+        gap_sum = 0;
+        gap_min = UINT64_MAX;
+        gap_max = 0;
+        last_arrival = 0;
+    }
+}
+
+/* Copies size bytes into the capture ring, starting at position pos. */
+static void
+capture_ring_write(size_t pos, const void *data, size_t size)
+{
+    size_t offset = pos & (CAPTURE_RING_SIZE - 1);
+    size_t first = MIN(size, CAPTURE_RING_SIZE - offset);
+    memcpy(capture_ring + offset, data, first);
+    memcpy(capture_ring, (const uint8_t *) data + first, size - first);
+}
+
+/* Copies size bytes out of the capture ring, starting at position pos. */
+static void
+capture_ring_read(void *data, size_t pos, size_t size)
+{
+    size_t offset = pos & (CAPTURE_RING_SIZE - 1);
+    size_t first = MIN(size, CAPTURE_RING_SIZE - offset);
+    memcpy(data, capture_ring + offset, first);
+    memcpy((uint8_t *) data + first, capture_ring, size - first);
+}
+
+/* Puts a packet in the capture ring for the writer thread, or leaves it out
+ * of the pcap file if the ring is full. Only called from the capture
+ * thread, and never blocks. */
+static void
+capture_packet(const struct pcap_pkthdr *pkthdr, const u_char *data)
+{
+    /* The pcap record header, in the same byte order as the file's. The
+     * timestamp is the one pcap gave the packet, in the file's units. */
+    uint32_t header[4];
+    size_t size = sizeof(header) + pkthdr->caplen;
+    size_t head = capture_head;
+
+    if (size > CAPTURE_RING_SIZE - (head - capture_tail)) {
+        (void) __sync_add_and_fetch(&capture_dropped, 1);
+        return;
+    }
+
+    header[0] = htonl((uint32_t) pkthdr->ts.tv_sec);
+    header[1] = htonl((uint32_t) pkthdr->ts.tv_usec);
+    header[2] = htonl(pkthdr->caplen);
+    header[3] = htonl(pkthdr->len);
+    capture_ring_write(head, header, sizeof(header));
+    capture_ring_write(head + sizeof(header), data, pkthdr->caplen);
+
+    /* The record has to be all there before the writer can see it. */
+    __sync_synchronize();
+    capture_head = head + size;
+}
+
+/* Creates a new pcap file to record incoming packets in, and writes in the
+ * global header. Its timestamps are in nanoseconds if pcap's are. */
+static int
+open_capture_file(void)
+{
+    uint8_t global_header[sizeof(PCAP_GLOBAL_HEADER)];
+    struct timespec now;
+
+    if ((pcap_file_fd = open(PCAP_FILE, O_WRONLY | O_APPEND | O_CREAT | O_TRUNC,
+                            S_IRUSR | S_IWUSR | S_IRGRP | S_IWGRP | S_IROTH))
+                      == -1) {
+        printf("Error in creating file %s\n", PCAP_FILE);
+        return -1;
+    }
+
+    memcpy(global_header, PCAP_GLOBAL_HEADER, sizeof(global_header));
+    if (tstamp_nsec == 1) {
+        /* The magic number of nanosecond pcap files, 0xa1b23c4d. */
+        global_header[2] = 0x3c;
+        global_header[3] = 0x4d;
+    }
+    if (write_helper(pcap_file_fd, global_header, sizeof(global_header))) {
+        close(pcap_file_fd);
+        pcap_file_fd = -1;
+        return -1;
+    }
+
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    capture_opened = now.tv_sec;
+    capture_file_size = sizeof(global_header);
+    return 0;
+}
+
+/* Closes the current pcap file, renames it and the ones before it (dropping
+ * the oldest), and starts a new one. */
+static void
+rotate_capture_file(void)
+{
+    char from[sizeof(PCAP_FILE) + 24];
+    char to[sizeof(PCAP_FILE) + 24];
+
+    close(pcap_file_fd);
+    if (capture_keep_files == 0) {
+        unlink(PCAP_FILE);
+    } else {
+        for (unsigned long i = capture_keep_files - 1; i > 0; --i) {
+            snprintf(from, sizeof(from), "%s.%lu", PCAP_FILE, i);
+            snprintf(to, sizeof(to), "%s.%lu", PCAP_FILE, i + 1);
+            rename(from, to);
+        }
+        snprintf(to, sizeof(to), "%s.1", PCAP_FILE);
+        if (rename(PCAP_FILE, to)) {
+            perror("Couldn't rotate the pcap file");
+        }
+    }
+
+    if (open_capture_file()) {
+        /* Keep draining the ring anyway, so the capture thread isn't held
+         * up, and try again with the next rotation. */
+        pcap_file_fd = -1;
+        capture_file_size = sizeof(PCAP_GLOBAL_HEADER);
+    }
+}
+
+/* Writes size bytes from the capture ring, starting at position pos, to the
+ * pcap file. */
+static void
+capture_ring_flush(size_t pos, size_t size)
+{
+    size_t offset = pos & (CAPTURE_RING_SIZE - 1);
+    size_t first = MIN(size, CAPTURE_RING_SIZE - offset);
+
+    if (pcap_file_fd < 0
+        || write_helper(pcap_file_fd, capture_ring + offset, first)
+        || write_helper(pcap_file_fd, capture_ring, size - first)) {
+        printf("Error in writing to pcap_file\n");
+    }
+    capture_file_size += size;
+}
+
+/* The writer thread: takes the packets out of the capture ring in large
+ * batches and writes them to the pcap file, starting a new file whenever
+ * the current one gets too big or too old. Batches only end part way
+ * through a record within a file; whenever the file is rotated, everything
+ * up to the end of the last whole record before the limit goes in the old
+ * one. */
+static void *
+capture_writer(void *unused)
+{
+    size_t tail = capture_tail;
+    /* The end of the records that have been looked at so far, which can
+     * all be written to the current file. */
+    size_t records_end = tail;
+    uint64_t reported_dropped = 0;
+    int rotate = 0;
+    struct timespec now;
+    struct timespec last_write;
+    const struct timespec poll = {0, CAPTURE_POLL_NSEC};
+
+    clock_gettime(CLOCK_MONOTONIC, &last_write);
+    while (1) {
+        int stopping = capture_stopping;
+        size_t head = capture_head;
+        /* Read the records only after seeing that they are there. */
+        __sync_synchronize();
+
+        while (!rotate && head != records_end) {
+            uint32_t header[4];
+            capture_ring_read(header, records_end, sizeof(header));
+            size_t size = sizeof(header) + ntohl(header[2]);
+            uint64_t file_size = capture_file_size + (records_end - tail);
+            if (capture_max_bytes != 0 && file_size + size > capture_max_bytes
+                && file_size > sizeof(PCAP_GLOBAL_HEADER)) {
+                rotate = 1;
+                break;
+            }
+            records_end += size;
+        }
+
+        clock_gettime(CLOCK_MONOTONIC, &now);
+        struct timespec waited = timespec_sub(&now, &last_write);
+        size_t pending = records_end - tail;
+        if (capture_max_seconds != 0
+            && (unsigned long) (now.tv_sec - capture_opened)
+               >= capture_max_seconds) {
+            /* Rotating a file that has no packets would only push out one
+             * that does. */
+            if (pending == 0 && capture_file_size
+                                <= sizeof(PCAP_GLOBAL_HEADER)) {
+                capture_opened = now.tv_sec;
+            } else {
+                rotate = 1;
+            }
+        }
+
+        size_t size = 0;
+        if (rotate || stopping
+            || waited.tv_sec * 1000 + waited.tv_nsec / 1000000
+               >= CAPTURE_FLUSH_MS) {
+            size = pending;
+        } else if (pending >= CAPTURE_BATCH_SIZE) {
+            size = (size_t) ((capture_file_size + pending) / CAPTURE_ALIGN
+                             * CAPTURE_ALIGN - capture_file_size);
+        }
+        if (size > 0) {
+            capture_ring_flush(tail, size);
+            tail += size;
+            /* Done reading these bytes before the capture thread can
+             * reuse them. */
+            __sync_synchronize();
+            capture_tail = tail;
+        }
+        if (size > 0 || pending == 0) {
+            last_write = now;
+        }
+
+        if (rotate) {
+            rotate_capture_file();
+            rotate = 0;
+            continue;
+        }
+
+        uint64_t dropped = __sync_add_and_fetch(&capture_dropped, 0);
+        if (dropped != reported_dropped) {
+            fprintf(stderr, "The capture ring is full, %llu packets so far "
+                    "are missing from %s.\n", (unsigned long long) dropped,
+                    PCAP_FILE);
+            reported_dropped = dropped;
+        }
+
+        if (stopping && tail == head) {
+            break;
+        }
+        if (size < CAPTURE_BATCH_SIZE) {
+            nanosleep(&poll, NULL);
+        }
+    }
+
+    if (pcap_file_fd >= 0) {
+        close(pcap_file_fd);
+    }
+    return unused;
+}
+
+/* Counts a received packet of len bytes in the rate, starting any slots
+ * that have begun since the last one. Only called from the capture
+ * thread. */
+static void
+count_rate(uint32_t len)
+{
+    struct timespec now;
+
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    uint64_t number = ((uint64_t) now.tv_sec * NANOSECONDS_PER_SECOND
+                       + (uint64_t) now.tv_nsec) / RATE_SLOT_NSEC;
+
+    /* Slots older than the ring would be overwritten anyway. */
+    uint64_t first = rate_last_slot + 1;
+    if (number - rate_last_slot > RATE_SLOTS) {
+        first = number - RATE_SLOTS + 1;
+    }
+
+    (void) __sync_add_and_fetch(&rate_seq, 1);
+    for (uint64_t n = first; n <= number; ++n) {
+        rate_slot *slot = &rate_slots[n % RATE_SLOTS];
+        slot->number = n;
+        slot->packets = rate_packets;
+        slot->bytes = rate_bytes;
+    }
+    if (number > rate_last_slot) {
+        rate_last_slot = number;
+    }
+    rate_packets += 1;
+    rate_bytes += len;
+    (void) __sync_add_and_fetch(&rate_seq, 1);
+}
+
+/* Works out the bits/s and packets/s received over the last window_ms
+ * milliseconds, from the start of the slot that began window_ms ago, and
+ * shortens window_ms to the longest window there is if it is longer. */
+static void
+get_rx_rate(uint32_t *window_ms, uint64_t *bps, uint64_t *pps)
+{
+    struct timespec now;
+    rate_slot slot;
+    uint64_t packets;
+    uint64_t bytes;
+    unsigned int seq;
+    const uint64_t max_window_ms = (uint64_t) (RATE_SLOTS - 1)
+                                   * RATE_SLOT_NSEC / 1000000;
+
+    if (*window_ms > max_window_ms) {
+        *window_ms = (uint32_t) max_window_ms;
+    }
+
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    uint64_t now_nsec = (uint64_t) now.tv_sec * NANOSECONDS_PER_SECOND
+                        + (uint64_t) now.tv_nsec;
+    uint64_t start = (now_nsec - (uint64_t) *window_ms * 1000000)
+                     / RATE_SLOT_NSEC;
+
+    do {
+        seq = rate_seq;
+        __sync_synchronize();
+        slot = rate_slots[start % RATE_SLOTS];
+        packets = rate_packets;
+        bytes = rate_bytes;
+        __sync_synchronize();
+    } while ((seq & 1) || seq != rate_seq);
+
+    *bps = 0;
+    *pps = 0;
+    /* The slot is only started once a packet arrives in it or after it, so
+     * if it wasn't, nothing has arrived since. */
+    if (slot.number == start && now_nsec > start * RATE_SLOT_NSEC) {
+        double d_time = (double) (now_nsec - start * RATE_SLOT_NSEC)
+                        / NANOSECONDS_PER_SECOND;
+        *bps = (uint64_t) ((double) (bytes - slot.bytes) * 8 / d_time);
+        *pps = (uint64_t) ((double) (packets - slot.packets) / d_time);
+    }
+}
+
+/* Fills in the response to a SEASIDE_GET_RX_RATES message: the rate over
+ * each window in its data (as four byte numbers of milliseconds, up to
+ * RATE_MAX_WINDOWS of them), or over RATE_DEFAULT_WINDOWS_MS if there are
+ * none. Returns the number of windows. */
+static uint32_t
+get_rx_rates(const SEASIDE *request, seaside_rx_rate *rates)
+{
+    static const uint32_t default_windows[] = RATE_DEFAULT_WINDOWS_MS;
+    const uint8_t *windows = request->data;
+    uint32_t count = request->size / (uint32_t) sizeof(uint32_t);
+
+    if (count > RATE_MAX_WINDOWS) {
+        count = RATE_MAX_WINDOWS;
+    }
+    if (count == 0) {
+        windows = (const uint8_t *) default_windows;
+        count = sizeof(default_windows) / sizeof(default_windows[0]);
+    }
+
+    for (uint32_t i = 0; i < count; ++i) {
+        uint32_t window_ms;
+        uint64_t bps;
+        uint64_t pps;
+        /* The data isn't necessarily aligned. */
+        memcpy(&window_ms, windows + i * sizeof(uint32_t), sizeof(window_ms));
+        get_rx_rate(&window_ms, &bps, &pps);
+        rates[i].window_ms = window_ms;
+        rates[i].bps = bps;
+        rates[i].pps = pps;
+    }
+    return count;
+}
+
+/* Returns the bits/s received over the last RATE_WINDOW_MS. */
+static uint64_t
+get_bandwidth(void)
+{
+    uint32_t window_ms = RATE_WINDOW_MS;
+    uint64_t bps;
+    uint64_t pps;
+
+    get_rx_rate(&window_ms, &bps, &pps);
+    return bps;
+}
+
+/* Puts a received packet in the ring of the last ones. Only called from the
+ * capture thread. */
+static void
+store_packet(const struct pcap_pkthdr *pkthdr, const u_char *data)
+{
+    uint64_t seq = packet_ring_last + 1;
+    ring_packet *slot = &packet_ring[seq % PACKET_RING_SLOTS];
+
+    (void) __sync_add_and_fetch(&slot->version, 1);
+    slot->seq = seq;
+    slot->timestamp = (uint64_t) pkthdr->ts.tv_sec * NANOSECONDS_PER_SECOND
+                      + (uint64_t) pkthdr->ts.tv_usec * tstamp_nsec;
+    slot->len = pkthdr->len;
+    slot->caplen = MIN(pkthdr->caplen, PACKET_RING_SNAPLEN);
+    memcpy(slot->data, data, slot->caplen);
+    (void) __sync_add_and_fetch(&slot->version, 1);
+
+    (void) __sync_add_and_fetch(&packet_ring_last, 1);
+}
+
+/* Copies the packet numbered seq out of the ring, its header into header
+ * and its data into data (which must have room for PACKET_RING_SNAPLEN
+ * bytes). Returns -1 if it isn't there anymore, or was replaced while being
+ * copied. */
+static int
+read_packet(uint64_t seq, seaside_packet_header *header, uint8_t *data)
+{
+    ring_packet *slot = &packet_ring[seq % PACKET_RING_SLOTS];
+    uint32_t version = slot->version;
+
+    __sync_synchronize();
+    if ((version & 1) || slot->seq != seq) {
+        return -1;
+    }
+    header->seq = seq;
+    header->timestamp = slot->timestamp;
+    header->len = slot->len;
+    header->caplen = MIN(slot->caplen, PACKET_RING_SNAPLEN);
+    memcpy(data, slot->data, header->caplen);
+    __sync_synchronize();
+
+    return slot->version == version ? 0 : -1;
+}
+
+/* Copies the last packet received into data (which must have room for
+ * MAX_PACKET_SIZE bytes), and its length on the wire into len. Returns the
+ * number of bytes copied, 0 if there is no packet. */
+static uint32_t
+get_last_packet(uint8_t *data, uint32_t *len)
+{
+    seaside_packet_header header;
+    uint64_t last;
+
+    while (1) {
+        do {
+            last = __sync_add_and_fetch(&packet_ring_last, 0);
+        } while (last != 0 && read_packet(last, &header, data));
+        if (last == 0) {
+            *len = 0;
+            return 0;
+        }
+        *len = header.len;
+        if (header.caplen < PACKET_RING_SNAPLEN) {
+            return header.caplen;
+        }
+
+        /* It may have been cut down, so take the whole of it instead, if
+         * it was kept. If a newer one was, it is about to be in the ring
+         * too, so start over. */
+        pthread_mutex_lock(&packet_mutex);
+        uint64_t big_seq = big_packet_seq;
+        if (big_seq == last) {
+            header.caplen = big_packet_caplen;
+            memcpy(data, big_packet, big_packet_caplen);
+        }
+        pthread_mutex_unlock(&packet_mutex);
+        if (big_seq <= last) {
+            return header.caplen;
+        }
+    }
+}
+
+/* Builds the response to a SEASIDE_GET_PACKETS message in buf (which must
+ * be PACKETS_MAX_RESPONSE bytes): the packets after the one the request
+ * asks from, that are still in the ring, up to the most it asks for or
+ * that fit. Returns the length of the response. */
+static uint32_t
+get_packets(const SEASIDE *request, uint8_t *buf)
+{
+    seaside_packets_request query = {0, UINT32_MAX};
+    seaside_packets_header response;
+    seaside_packet_header header;
+    size_t pos = sizeof(response);
+
+    if (request->size > 0) {
+        memcpy(&query, request->data, MIN(request->size, sizeof(query)));
+    }
+
+    response.last = __sync_add_and_fetch(&packet_ring_last, 0);
+    response.count = 0;
+
+    uint64_t seq = query.since + 1;
+    if (response.last > PACKET_RING_SLOTS
+        && seq < response.last - PACKET_RING_SLOTS + 1) {
+        seq = response.last - PACKET_RING_SLOTS + 1;
+    }
+    for (; seq <= response.last && response.count < query.max; ++seq) {
+        if (pos + sizeof(header) + PACKET_RING_SNAPLEN
+            > PACKETS_MAX_RESPONSE) {
+            break;
+        }
+        /* The oldest packets can be replaced as we go; they're gone. */
+        if (read_packet(seq, &header, buf + pos + sizeof(header))) {
+            continue;
+        }
+        memcpy(buf + pos, &header, sizeof(header));
+        pos += sizeof(header) + header.caplen;
+        ++response.count;
+    }
+
+    memcpy(buf, &response, sizeof(response));
+    return (uint32_t) pos;
+}
+
+/* Reads a big-endian 16 bit number out of a packet. */
+static uint16_t
+read_u16(const u_char *data)
+{
+    return (uint16_t) (data[0] << 8 | data[1]);
+}
+
+/* Works out which flow a packet of caplen bytes belongs to. */
+static void
+parse_flow_key(const u_char *data, uint32_t caplen, flow_key *key)
+{
+    size_t pos = 14;
+    size_t l4 = 0;
+
+    memset(key, 0, sizeof(*key));
+    if (caplen < pos) {
+        return;
+    }
+
+    key->ethertype = read_u16(data + 12);
+    if ((key->ethertype == ETHERTYPE_VLAN || key->ethertype == ETHERTYPE_QINQ)
+        && caplen >= pos + 4) {
+        key->vlan = read_u16(data + pos) & 0x0fff;
+    }
+    /* Stacked tags are told apart by the outer one only. */
+    while ((key->ethertype == ETHERTYPE_VLAN
+            || key->ethertype == ETHERTYPE_QINQ)
+           && caplen >= pos + 4) {
+        key->ethertype = read_u16(data + pos + 2);
+        pos += 4;
+    }
+
+    if (key->ethertype == ETHERTYPE_IPV4 && caplen >= pos + 20) {
+        key->protocol = data[pos + 9];
+        memcpy(key->src, data + pos + 12, 4);
+        memcpy(key->dst, data + pos + 16, 4);
+        /* Only the first fragment has the ports. */
+        if ((read_u16(data + pos + 6) & 0x1fff) == 0) {
+            l4 = pos + (size_t) (data[pos] & 0x0f) * 4;
+        }
+    } else if (key->ethertype == ETHERTYPE_IPV6 && caplen >= pos + 40) {
+        /* Extension headers aren't followed, so packets that have them
+         * are told apart by the addresses only. */
+        key->protocol = data[pos + 6];
+        memcpy(key->src, data + pos + 8, 16);
+        memcpy(key->dst, data + pos + 24, 16);
+        l4 = pos + 40;
+    }
+
+    if (l4 != 0 && caplen >= l4 + 4
+        && (key->protocol == IP_PROTOCOL_TCP
+            || key->protocol == IP_PROTOCOL_UDP
+            || key->protocol == IP_PROTOCOL_SCTP)) {
+        key->src_port = read_u16(data + l4);
+        key->dst_port = read_u16(data + l4 + 2);
+    }
+}
+
+/* Hashes a flow key, with 32 bit FNV-1a. */
+static uint32_t
+hash_flow_key(const flow_key *key)
+{
+    const uint8_t *bytes = (const uint8_t *) key;
+    uint32_t hash = 2166136261u;
+
+    for (size_t i = 0; i < sizeof(*key); ++i) {
+        hash = (hash ^ bytes[i]) * 16777619u;
+    }
+    return hash;
+}
+
+/* Returns the flow in the table with the given key, adding it if it isn't
+ * there (evicting another one if it has to), at time now. Must be called
+ * with packet_mutex held. */
+static flow_entry *
+find_flow(const flow_key *key, uint64_t now)
+{
+    uint32_t hash = hash_flow_key(key);
+    flow_entry *free_entry = NULL;
+    flow_entry *oldest = NULL;
+
+    for (uint32_t i = 0; i < FLOW_MAX_PROBE; ++i) {
+        flow_entry *entry = &flow_table[(hash + i) & (FLOW_TABLE_SIZE - 1)];
+        if (!entry->used) {
+            /* No flow was ever put past here. */
+            if (free_entry == NULL) {
+                free_entry = entry;
+            }
+            break;
+        }
+        if (memcmp(&entry->key, key, sizeof(*key)) == 0) {
+            return entry;
+        }
+        if (free_entry == NULL
+            && now > entry->last
+                     + (uint64_t) FLOW_IDLE_SEC * NANOSECONDS_PER_SECOND) {
+            free_entry = entry;
+        }
+        if (oldest == NULL || entry->last < oldest->last) {
+            oldest = entry;
+        }
+    }
+
+    if (free_entry == NULL) {
+        free_entry = oldest;
+    }
+    if (free_entry->used) {
+        ++flows_evicted;
+    }
+    memset(free_entry, 0, sizeof(*free_entry));
+    free_entry->key = *key;
+    free_entry->used = 1;
+    free_entry->first = now;
+    free_entry->last = now;
+    return free_entry;
+}
+
+/* Counts a packet of len bytes (on the wire) that arrived at arrival (in
+ * nanoseconds) in its flow. Must be called with packet_mutex held. */
+static void
+count_flow(const u_char *data, uint32_t caplen, uint32_t len,
+           uint64_t arrival)
+{
+    flow_key key;
+
+    parse_flow_key(data, caplen, &key);
+    flow_entry *flow = find_flow(&key, arrival);
+    if (flow->packets > 0 && arrival > flow->last) {
+        flow->max_gap = MAX(flow->max_gap, arrival - flow->last);
+    }
+    if (arrival > flow->last) {
+        flow->last = arrival;
+    }
+    ++flow->packets;
+    flow->bytes += len;
+}
+
+/* Fills in the response to a SEASIDE_GET_FLOWS message: the top flows by
+ * bytes or packets, as the request asks. Must be called with packet_mutex
+ * held. Returns the length of the response. */
+static uint32_t
+get_flows(const SEASIDE *request, seaside_flows *response)
+{
+    seaside_flows_request query = {FLOW_ORDER_BYTES, FLOW_DEFAULT_TOP};
+    const flow_entry *top[FLOW_MAX_TOP];
+    uint32_t count = 0;
+    struct timespec now;
+
+    if (request->size > 0) {
+        memcpy(&query, request->data, MIN(request->size, sizeof(query)));
+    }
+    if (query.count > FLOW_MAX_TOP) {
+        query.count = FLOW_MAX_TOP;
+    }
+
+    clock_gettime(CLOCK_REALTIME, &now);
+    uint64_t idle_since = (uint64_t) now.tv_sec * NANOSECONDS_PER_SECOND
+                          + (uint64_t) now.tv_nsec
+                          - (uint64_t) FLOW_IDLE_SEC * NANOSECONDS_PER_SECOND;
+
+    response->active = 0;
+    for (size_t i = 0; i < FLOW_TABLE_SIZE; ++i) {
+        const flow_entry *flow = &flow_table[i];
+        if (!flow->used) {
+            continue;
+        }
+        if (flow->last >= idle_since) {
+            ++response->active;
+        }
+
+        /* Insert it into the top flows, kept in order. */
+        uint64_t value = query.order == FLOW_ORDER_PACKETS ? flow->packets
+                                                           : flow->bytes;
+        uint32_t at = count;
+        while (at > 0 && value > (query.order == FLOW_ORDER_PACKETS
+                                  ? top[at - 1]->packets
+                                  : top[at - 1]->bytes)) {
+            --at;
+        }
+        if (at >= query.count) {
+            continue;
+        }
+        if (count < query.count) {
+            ++count;
+        }
+        memmove(&top[at + 1], &top[at], (count - 1 - at) * sizeof(top[0]));
+        top[at] = flow;
+    }
+
+    response->evicted = flows_evicted;
+    response->count = count;
+    for (uint32_t i = 0; i < count; ++i) {
+        seaside_flow *out = &response->flows[i];
+        out->vlan = top[i]->key.vlan;
+        out->ethertype = top[i]->key.ethertype;
+        out->protocol = top[i]->key.protocol;
+        out->src_port = top[i]->key.src_port;
+        out->dst_port = top[i]->key.dst_port;
+        memcpy(out->src, top[i]->key.src, sizeof(out->src));
+        memcpy(out->dst, top[i]->key.dst, sizeof(out->dst));
+        out->packets = top[i]->packets;
+        out->bytes = top[i]->bytes;
+        out->first = top[i]->first;
+        out->last = top[i]->last;
+        out->max_gap = top[i]->max_gap;
+    }
+    return (uint32_t) (offsetof(seaside_flows, flows)
+                       + count * sizeof(seaside_flow));
+}
+
 /* Every time a packet is received, pcap calls this function. We use it to
  * store relevant information for later retrieval from the ui threads. */
 /* TODO: Handle situations where we only receive part of a packet. */
@@ -198,33 +1350,25 @@ callback(u_char *user,
 {
     (void) user;
 
-    /* A pcap packet header, for when we're writing the pcap_file. */
-    static uint32_t packet_header[4];
-    packet_header[2] = htonl(pkthdr->caplen);
-    packet_header[3] = htonl(pkthdr->len);
+    capture_packet(pkthdr, packet_recv);
+    count_rate(pkthdr->len);
 
-    pthread_mutex_lock(&packet_mutex);
+    uint64_t arrival = (uint64_t) pkthdr->ts.tv_sec * NANOSECONDS_PER_SECOND
+                       + (uint64_t) pkthdr->ts.tv_usec * tstamp_nsec;
 
+    pthread_mutex_lock(&packet_mutex);
+    if (pkthdr->caplen > PACKET_RING_SNAPLEN) {
+        big_packet_caplen = MIN(pkthdr->caplen, MAX_PACKET_SIZE);
+        memcpy(big_packet, packet_recv, big_packet_caplen);
+        big_packet_seq = packet_ring_last + 1;
+    }
     num_packets_received++;
-    prev_packet_received_time = packet_received_time;
-    clock_gettime(CLOCK_MONOTONIC, &packet_received_time);
-
-    packet_header[0] = htonl(packet_received_time.tv_sec);
-    packet_header[1] = htonl(packet_received_time.tv_nsec);
+    count_gap(arrival);
+    count_flow(packet_recv, pkthdr->caplen, pkthdr->len, arrival);
+    pthread_mutex_unlock(&packet_mutex);
 
     /* Stores the received packet for later diagnostic use. */
-    memcpy(packet, packet_recv, pkthdr->caplen);
-    packet_len = pkthdr->caplen;
-
-    if (write_helper(pcap_file_fd, packet_header, sizeof(packet_header))) {
-        printf("Error in writing to pcap_file\n");
-    }
-
-    if (write_helper(pcap_file_fd, packet, packet_len)) {
-        printf("Error in writing to pcap_file\n");
-    }
-
-    pthread_mutex_unlock(&packet_mutex);
+    store_packet(pkthdr, packet_recv);
 }
 
 
@@ -267,18 +1411,37 @@ initialize_socket(void)
     return 0;
 }
 
-/* Sends a response SEASIDE struct through an arbitrary file descriptor.
- * First sends the header SEASIDE struct (type and size), and then sends the
- * actual data. */
-void
-send_response(int ui_fd, void *data, uint16_t len)
+/* Sends a SEASIDE message through an arbitrary file descriptor. First sends
+ * the header (type and size, the extended size if the data doesn't fit in
+ * two bytes, and the ID of request if it was tagged), and then sends the
+ * actual data. request may be NULL for unrequested messages, such as
+ * statistics pushes. */
+static void
+send_message(int ui_fd, uint8_t type, const SEASIDE *request,
+             void *data, uint32_t len)
 {
-    char buf[3];
+    uint8_t buf[SEASIDE_HEADER_SIZE + 2 * sizeof(uint32_t)];
+    size_t header_len = SEASIDE_HEADER_SIZE;
+    uint16_t short_len =
+        (uint16_t) (len < SEASIDE_EXTENDED ? len : SEASIDE_EXTENDED);
+
+    buf[0] = type;
+    memcpy(buf + 1, &short_len, sizeof(uint16_t));
+
+    if (short_len == SEASIDE_EXTENDED) {
+        memcpy(buf + header_len, &len, sizeof(uint32_t));
+        header_len += sizeof(uint32_t);
+    }
 
-    buf[0] = SEASIDE_RESPONSE;
-    memcpy(buf + 1, &len, 2);
+    /* Echo the request ID, so the UI side knows which request this
+     * response belongs to. */
+    if (request != NULL && request->tagged) {
+        buf[0] |= SEASIDE_TAGGED;
+        memcpy(buf + header_len, &request->id, sizeof(uint32_t));
+        header_len += sizeof(uint32_t);
+    }
 
-    if (send(ui_fd, buf, 3, MSG_MORE) < 0) {
+    if (send(ui_fd, buf, header_len, MSG_MORE) < 0) {
         fprintf(stderr, "Error with send to ui_fd\n");
     }
     if (send(ui_fd, data, len, 0) < 0) {
@@ -286,6 +1449,14 @@ send_response(int ui_fd, void *data, uint16_t len)
     }
 }
 
+/* Sends the response to a request through an arbitrary file descriptor,
+ * echoing the request ID if the request had one. */
+void
+send_response(int ui_fd, const SEASIDE *request, void *data, uint32_t len)
+{
+    send_message(ui_fd, SEASIDE_RESPONSE, request, data, len);
+}
+
 /* Sets a new filter on the pcap_t. For syntax, see the man pages on
  * pcap-filter, it describes the arguments that the filter can be supplied.
  * This function can be called while pcap is listening for packets, but
@@ -331,17 +1502,35 @@ initialize_pcap(void)
         return -1;
     }
 
+    /* Capture whole jumbo frames, but never more than packet can hold. */
+    if (pcap_set_snaplen(handle, MAX_PACKET_SIZE)) {
+        fprintf(stderr, "pcap_set_snaplen() failed.\n");
+        return -1;
+    }
+
     if (pcap_set_promisc(handle, 1)) {
         fprintf(stderr, "pcap_set_promisc() couldn't set promiscuous mode.\n");
         return -1;
     }
 
+#ifdef PCAP_TSTAMP_PRECISION_NANO
+    /* Timestamp packets to the nanosecond, for the gap histogram, where
+     * libpcap and the device can. Otherwise they're in microseconds. */
+    pcap_set_tstamp_precision(handle, PCAP_TSTAMP_PRECISION_NANO);
+#endif
+
     if (pcap_activate(handle)) {
         fprintf(stderr, "pcap couldn't intialize handler.\n");
         fprintf(stderr, "pcap error is %s.\n", pcap_geterr(handle));
         return -1;
     }
 
+#ifdef PCAP_TSTAMP_PRECISION_NANO
+    if (pcap_get_tstamp_precision(handle) == PCAP_TSTAMP_PRECISION_NANO) {
+        tstamp_nsec = 1;
+    }
+#endif
+
     if (pcap_set_filter(PCAP_FILTER)) {
         fprintf(stderr, "Error in pcap_set_filter helper function.\n");
         return -1;
@@ -353,44 +1542,301 @@ initialize_pcap(void)
     return 0;
 }
 
+/* Allocates a stream for reading SEASIDE messages from a UI connection.
+ * Returns NULL if out of memory. */
+static seaside_stream *
+stream_new(int fd)
+{
+    seaside_stream *stream = malloc(sizeof(seaside_stream));
+    if (stream == NULL) {
+        return NULL;
+    }
+
+    stream->buf = malloc(SEASIDE_STREAM_SIZE);
+    if (stream->buf == NULL) {
+        free(stream);
+        return NULL;
+    }
+    stream->fd = fd;
+    stream->start = 0;
+    stream->end = 0;
+    stream->capacity = SEASIDE_STREAM_SIZE;
+    return stream;
+}
+
+static void
+stream_free(seaside_stream *stream)
+{
+    free(stream->buf);
+    free(stream);
+}
+
+/* Receives more bytes into the stream's buffer until at least size unparsed
+ * bytes are in it, moving the unparsed bytes to the front of the buffer first
+ * if they wouldn't fit otherwise, and growing the buffer if they still won't.
+ * A single recv may pull in several messages, which are then parsed without
+ * any more system calls. Returns 0 on success, and -1 if the connection was
+ * closed or broken before then. */
+static int
+stream_fill(seaside_stream *stream, size_t size)
+{
+    if (stream->end - stream->start >= size) {
+        return 0;
+    }
+
+    if (stream->start + size > stream->capacity) {
+        memmove(stream->buf, stream->buf + stream->start,
+                stream->end - stream->start);
+        stream->end -= stream->start;
+        stream->start = 0;
+    }
+
+    if (size > stream->capacity) {
+        uint8_t *buf = realloc(stream->buf, size);
+        if (buf == NULL) {
+            fprintf(stderr, "Could not grow SEASIDE stream to %zu bytes.\n",
+                    size);
+            return -1;
+        }
+        stream->buf = buf;
+        stream->capacity = size;
+    }
+
+    while (stream->end - stream->start < size) {
+        ssize_t ret = recv(stream->fd, stream->buf + stream->end,
+                           stream->capacity - stream->end, 0);
+        if (ret < 0) {
+            if (errno == EINTR || errno == EAGAIN) {
+                continue;
+            }
+            perror("Stream fill error: ");
+            return -1;
+        } else if (ret == 0) {
+            return -1;
+        }
+        stream->end += (size_t) ret;
+    }
+    return 0;
+}
+
+/* Parses the next SEASIDE message out of the stream, receiving more of it if
+ * it hasn't all arrived yet. Messages are length-delimited by the size in
+ * their header, so any number of them can be sent in one write. The header
+ * (extended size and request ID included) is parsed into message, and
+ * message->data points straight into the stream's buffer, so it is only
+ * valid until the next call. Returns 0 on success, and -1 once the
+ * connection is closed, or if the message is bigger than SEASIDE_MAX_SIZE. */
+static int
+read_seaside(seaside_stream *stream, SEASIDE *message)
+{
+    size_t header_len = SEASIDE_HEADER_SIZE;
+    uint16_t short_size;
+    uint8_t *header;
+
+    if (stream_fill(stream, SEASIDE_HEADER_SIZE)) {
+        return -1;
+    }
+    header = stream->buf + stream->start;
+
+    /* WARNING: If you ever change the layout or order of the SEASIDE
+     * struct, be sure to change this copying bit, too. */
+    message->type = (uint8_t) (header[0] & ~SEASIDE_TAGGED);
+    message->tagged = (uint8_t) (header[0] & SEASIDE_TAGGED);
+    memcpy(&short_size, header + 1, sizeof(uint16_t));
+    message->size = short_size;
+    message->id = 0;
+
+    if (short_size == SEASIDE_EXTENDED) {
+        header_len += sizeof(uint32_t);
+    }
+    if (message->tagged) {
+        header_len += sizeof(uint32_t);
+    }
+
+    /* Filling may move the buffer around, so find the header again. */
+    if (stream_fill(stream, header_len)) {
+        return -1;
+    }
+    header = stream->buf + stream->start;
+
+    if (short_size == SEASIDE_EXTENDED) {
+        memcpy(&message->size, header + SEASIDE_HEADER_SIZE,
+               sizeof(uint32_t));
+        if (message->size > SEASIDE_MAX_SIZE) {
+            fprintf(stderr, "SEASIDE message of %u bytes is too big.\n",
+                    message->size);
+            return -1;
+        }
+    }
+
+    if (stream_fill(stream, header_len + message->size)) {
+        return -1;
+    }
+    header = stream->buf + stream->start;
+
+    if (message->tagged) {
+        memcpy(&message->id, header + header_len - sizeof(uint32_t),
+               sizeof(uint32_t));
+    }
+    message->data = header + header_len;
+
+    stream->start += header_len + message->size;
+    return 0;
+}
+
+/* Pushes the current statistics to a subscribed UI connection. */
+static void
+send_stats(int ui_fd)
+{
+    seaside_stats stats;
+    struct timespec now;
+
+    stats.bandwidth = get_bandwidth();
+    stats.packets = num_packets_received;
+
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    stats.timestamp = (uint64_t) now.tv_sec * NANOSECONDS_PER_SECOND
+                      + (uint64_t) now.tv_nsec;
+
+    send_message(ui_fd, SEASIDE_STATS, NULL, &stats, sizeof(stats));
+}
+
+/* Waits until the next SEASIDE message can be read from the stream. If the
+ * connection has subscribed to statistics (interval is non-zero), pushes
+ * them every interval in the meantime, with next_stats holding the deadline
+ * of the next push. Returns 0 once a message can be read, and -1 on error. */
+static int
+wait_for_message(seaside_stream *stream, const struct timespec *interval,
+                 struct timespec *next_stats)
+{
+    struct pollfd ui_poll;
+    ui_poll.fd = stream->fd;
+    ui_poll.events = POLLIN;
+
+    /* If part of a message is already buffered, the rest is on its way, so
+     * there is no need to wait for it here. */
+    while ((interval->tv_sec || interval->tv_nsec)
+           && stream->start == stream->end) {
+        struct timespec now, left;
+        int timeout = 0;
+
+        clock_gettime(CLOCK_MONOTONIC, &now);
+        left = timespec_sub(next_stats, &now);
+        if (left.tv_sec >= 0) {
+            timeout = (int) (left.tv_sec * 1000
+                             + (left.tv_nsec + 999999) / 1000000);
+        }
+
+        int ret = poll(&ui_poll, 1, timeout);
+        if (ret > 0) {
+            return 0;
+        } else if (ret < 0) {
+            if (errno == EINTR) {
+                continue;
+            }
+            perror("poll() failed: ");
+            return -1;
+        }
+
+        send_stats(stream->fd);
+
+        /* Push on a fixed schedule, but if we fell behind, skip the missed
+         * pushes instead of sending a burst of them. */
+        *next_stats = timespec_add(next_stats, interval);
+        if (timespec_sub(next_stats, &now).tv_sec < 0) {
+            *next_stats = timespec_add(&now, interval);
+        }
+    }
+    return 0;
+}
+
+/* Subscribes a connection to statistics pushes, with the interval in
+ * milliseconds taken from the message's data. An interval of 0 (or no data)
+ * unsubscribes it. */
+static void
+subscribe_stats(const SEASIDE *message, struct timespec *interval,
+                struct timespec *next_stats)
+{
+    uint32_t interval_ms = 0;
+
+    if (message->size >= sizeof(uint32_t)) {
+        memcpy(&interval_ms, message->data, sizeof(uint32_t));
+    }
+    if (interval_ms != 0 && interval_ms < MIN_STATS_INTERVAL) {
+        interval_ms = MIN_STATS_INTERVAL;
+    }
+
+    interval->tv_sec = interval_ms / 1000;
+    interval->tv_nsec = (long) (interval_ms % 1000) * 1000000;
+
+    clock_gettime(CLOCK_MONOTONIC, next_stats);
+    *next_stats = timespec_add(next_stats, interval);
+    printf("Statistics interval: [%u] ms\n", interval_ms);
+}
+
 /* Listens to the Unix socket for the packet that we should be sending to the
  * receiving Pi. When it gathers all the information for it, such as
  * destination, data, speed, etc. it starts sending the packet. */
 static void *
 listen_packet_info(void *ui_fd_temp)
 {
-    /* Temporary variables to store any received data, before moving it
-     * to the global scope. */
-    uint8_t request[UI_BUFFER_SIZE];
-    ssize_t request_len;
-
+    /* The descriptor was allocated by accept_connections, so that it
+     * couldn't be overwritten by the next connection before we read it. */
     int ui_fd = *(int *) ui_fd_temp;
+    free(ui_fd_temp);
+
+    /* Any received requests stay in the stream's buffer until they are
+     * parsed. */
+    seaside_stream *stream = stream_new(ui_fd);
+    if (stream == NULL) {
+        fprintf(stderr, "Could not allocate a SEASIDE stream.\n");
+        close(ui_fd);
+        return (void *) NULL;
+    }
+
+    /* Where responses with packets in them are built. */
+    uint8_t *packets = malloc(PACKETS_MAX_RESPONSE);
+    if (packets == NULL) {
+        fprintf(stderr, "Could not allocate a packets buffer.\n");
+        stream_free(stream);
+        close(ui_fd);
+        return (void *) NULL;
+    }
+
+    /* How often to push statistics to this connection (zero if it hasn't
+     * subscribed), and when the next push is due. */
+    struct timespec stats_interval = {0, 0};
+    struct timespec next_stats = {0, 0};
+
     while (1) {
+        SEASIDE seaside_header;
+        seaside_gaps gaps;
+        seaside_rx_rate rates[RATE_MAX_WINDOWS];
+        seaside_flows flows;
+        uint32_t num_rates;
+        uint64_t bandwidth;
+        uint32_t len;
+        uint32_t wire_len;
+        size_t packet_size;
+
         printf("Waiting for request\n");
-        request_len = recv(ui_fd, request, UI_BUFFER_SIZE, 0);
 
-        /* EOF signal received, will close socket in orderly manner. */
-        if (request_len == 0) {
+        /* The connection was closed, will close socket in orderly manner. */
+        if (wait_for_message(stream, &stats_interval, &next_stats)
+            || read_seaside(stream, &seaside_header)) {
+            free(packets);
+            stream_free(stream);
             close(ui_fd);
             return (void *) NULL;
         }
 
-        SEASIDE seaside_header;
-
-        /* WARNING: If you ever change the layout or order of the SEASIDE
-         * struct, be sure to change this copying bit, too. */
-        memcpy(&seaside_header.type, request, sizeof(uint8_t));
-        memcpy(&seaside_header.size, (request + 1), sizeof(uint16_t));
-        seaside_header.data = request + 3;
-
-        printf("Type: [%d], size: [%d]\n",
+        printf("Type: [%d], size: [%u]\n",
             seaside_header.type, seaside_header.size);
-        for (int i = 0; i < request_len; ++i) {
-            printf("%i ", request[i]);
+        uint32_t log_bytes = MIN(seaside_header.size, LOG_DATA_BYTES);
+        for (uint32_t i = 0; i < log_bytes; ++i) {
+            printf("%i ", seaside_header.data[i]);
         }
-        printf("\n");
-
-        pthread_mutex_lock(&packet_mutex);
+        printf(seaside_header.size > LOG_DATA_BYTES ? "...\n" : "\n");
 
         switch (seaside_header.type) {
 
@@ -412,7 +1858,7 @@ listen_packet_info(void *ui_fd_temp)
 
         /* Return the number of received packets. */
         case SEASIDE_NUM_PACKETS:
-            send_response(ui_fd, &num_packets_received,
+            send_response(ui_fd, &seaside_header, &num_packets_received,
                           sizeof(num_packets_received));
             break;
 
@@ -420,51 +1866,70 @@ listen_packet_info(void *ui_fd_temp)
         case SEASIDE_SINGLE_PACKET:
             break;
 
-        /* Return the current packet. */
+        /* Return the last packet received. */
         case SEASIDE_GET_PACKET:
-            send_response(ui_fd, packet, packet_len);
+            len = get_last_packet(packets, &wire_len);
+            send_response(ui_fd, &seaside_header, packets, len);
             break;
 
-        /* Return the bandwidth calculated. */
-        /* TODO: See if we can cut down the size of this case. This is all
-         * within the mutex, so we could be potentially blocking other
-         * important processes. */
-        /* TODO: Not accurate at speeds around 1 Mbps. */
+        /* Return the bandwidth received over the last RATE_WINDOW_MS. */
         case SEASIDE_GET_BANDWIDTH:
-            /* Calculates the elapsed time, and approximates the bandwidth from the
-             * time between received packets. */
-            clock_gettime(CLOCK_MONOTONIC, &cur_time);
-
-            if (timespec_sub(&cur_time, &packet_received_time).tv_sec >= 1) {
-                /* It's been a while since we've received a packet, so we
-                 * set bandwidth to 0. */
-                bandwidth = 0;
-            } else {
-                elapsed_time = timespec_sub(&packet_received_time,
-                                            &prev_packet_received_time);
-                double d_time = elapsed_time.tv_sec
-                                + ( (double) elapsed_time.tv_nsec
-                                    / NANOSECONDS_PER_SECOND );
-    
-                bandwidth = (packet_len * 8.0) / d_time;
-                printf("Bandwidth: %llu | d_time: %Lf\n", bandwidth, d_time);
-            }
-
-            send_response(ui_fd, &bandwidth, sizeof(bandwidth));
+            bandwidth = get_bandwidth();
+            printf("Bandwidth: %llu\n", (unsigned long long) bandwidth);
+            send_response(ui_fd, &seaside_header, &bandwidth,
+                          sizeof(bandwidth));
             break;
 
-        /* Return the size of the current packet. */
+        /* Return the size of the last packet received, on the wire. */
         case SEASIDE_GET_PACKET_SIZE:
-            send_response(ui_fd, &packet_len, sizeof(packet_len));
+            (void) get_last_packet(packets, &wire_len);
+            packet_size = wire_len;
+            send_response(ui_fd, &seaside_header, &packet_size,
+                          sizeof(packet_size));
             printf("Send packet size\n");
             break;
 
+        /* Push statistics to this connection every so often. */
+        case SEASIDE_SUBSCRIBE_STATS:
+            subscribe_stats(&seaside_header, &stats_interval, &next_stats);
+            break;
+
+        /* Return the histogram of the gaps between packets, and start it
+         * over if the data says to. */
+        case SEASIDE_GET_GAPS:
+            pthread_mutex_lock(&packet_mutex);
+            get_gaps(&gaps, seaside_header.size >= 1
+                            && seaside_header.data[0] != 0);
+            pthread_mutex_unlock(&packet_mutex);
+            send_response(ui_fd, &seaside_header, &gaps, sizeof(gaps));
+            break;
+
+        /* Return the rate received over each of the windows in the data,
+         * or the default ones if there are none. */
+        case SEASIDE_GET_RX_RATES:
+            num_rates = get_rx_rates(&seaside_header, rates);
+            send_response(ui_fd, &seaside_header, rates,
+                          num_rates * (uint32_t) sizeof(rates[0]));
+            break;
+
+        /* Return the packets received since the one in the data. */
+        case SEASIDE_GET_PACKETS:
+            len = get_packets(&seaside_header, packets);
+            send_response(ui_fd, &seaside_header, packets, len);
+            break;
+
+        /* Return the top flows by bytes or packets. */
+        case SEASIDE_GET_FLOWS:
+            pthread_mutex_lock(&packet_mutex);
+            len = get_flows(&seaside_header, &flows);
+            pthread_mutex_unlock(&packet_mutex);
+            send_response(ui_fd, &seaside_header, &flows, len);
+            break;
+
         default:
             fprintf(stderr, "Invalid SEASIDE flag received.\n");
             break;
         }
-
-        pthread_mutex_unlock(&packet_mutex);
     }
     fprintf(stderr, "Error in listen_packet_info().\n");
 
@@ -485,8 +1950,25 @@ accept_connections(void *unused)
             return unused;
         }
 
+        /* Each connection thread gets its own copy of the descriptor, and
+         * is detached, since nothing ever joins it. */
+        int *ui_fd_copy = malloc(sizeof(int));
+        if (ui_fd_copy == NULL) {
+            fprintf(stderr, "Could not allocate a connection.\n");
+            close(ui_fd);
+            continue;
+        }
+        *ui_fd_copy = ui_fd;
+
         pthread_t ui_thread;
-        pthread_create(&ui_thread, NULL, listen_packet_info, (void *) &ui_fd);
+        if (pthread_create(&ui_thread, NULL, listen_packet_info,
+                           (void *) ui_fd_copy)) {
+            fprintf(stderr, "Could not create a connection thread.\n");
+            free(ui_fd_copy);
+            close(ui_fd);
+            continue;
+        }
+        pthread_detach(ui_thread);
     }
 
     return unused;
@@ -512,29 +1994,86 @@ lock_single_instance_file(void)
     return 0;
 }
 
-/* Creates a pcap file that we will use to record all incoming packets. Also
- * writes in the global header. */
+/* Creates a pcap file that we will use to record all incoming packets, and
+ * starts the thread that writes them to it. */
 int
 initialize_pcap_file(void)
 {
-    if ((pcap_file_fd = open(PCAP_FILE, O_WRONLY | O_APPEND | O_CREAT | O_TRUNC,
-                            S_IRUSR | S_IWUSR | S_IRGRP | S_IWGRP | S_IROTH))
-                      == -1) {
-        printf("Error in creating file %s\n", PCAP_FILE);
+    if (open_capture_file()) {
         return -1;
     }
 
-    if (write_helper(pcap_file_fd, PCAP_GLOBAL_HEADER, sizeof(PCAP_GLOBAL_HEADER))) {
+    if (pthread_create(&capture_thread, NULL, capture_writer, NULL)) {
+        fprintf(stderr, "Could not create the capture writer thread.\n");
         return -1;
     }
     return 0;
 }
 
+/* Parses a whole, non-negative number from the command line into value.
+ * Returns -1 if it isn't one. */
+static int
+parse_count(const char *arg, unsigned long *value)
+{
+    char *end;
+
+    errno = 0;
+    *value = strtoul(arg, &end, 10);
+    if (errno || end == arg || *end != '\0' || arg[0] == '-') {
+        return -1;
+    }
+    return 0;
+}
+
+/* Prints how to run this program. */
+static void
+usage(const char *name)
+{
+    fprintf(stderr, "Usage: %s [-C megabytes] [-G seconds] [-W files]\n"
+            "  -C  start a new %s once it would grow past this many\n"
+            "      megabytes, 0 for no limit (default %d)\n"
+            "  -G  start a new one every this many seconds, 0 for never "
+            "(default %d)\n"
+            "  -W  how many of the old ones to keep, as %s.1 (the newest)\n"
+            "      and so on (default %d)\n",
+            name, PCAP_FILE, CAPTURE_MAX_MEGABYTES, CAPTURE_MAX_SECONDS,
+            PCAP_FILE, CAPTURE_KEEP_FILES);
+}
+
 /* Initializes pcap and the socket, and then sends the packet that was
  * received from the UI program. */
 int
-main(void)
+main(int argc, char **argv)
 {
+    int opt;
+    unsigned long megabytes;
+    while ((opt = getopt(argc, argv, "C:G:W:h")) != -1) {
+        switch (opt) {
+        case 'C':
+            if (parse_count(optarg, &megabytes)) {
+                usage(argv[0]);
+                return -1;
+            }
+            capture_max_bytes = (uint64_t) megabytes << 20;
+            break;
+        case 'G':
+            if (parse_count(optarg, &capture_max_seconds)) {
+                usage(argv[0]);
+                return -1;
+            }
+            break;
+        case 'W':
+            if (parse_count(optarg, &capture_keep_files)) {
+                usage(argv[0]);
+                return -1;
+            }
+            break;
+        default:
+            usage(argv[0]);
+            return -1;
+        }
+    }
+
     if (lock_single_instance_file()) {
         printf("Error in lock_single_instance_file().\n");
         return -1;
@@ -561,6 +2100,10 @@ main(void)
 
     pcap_loop(handle, -1, callback, NULL);
 
+    /* Write out whatever is still in the capture ring. */
+    capture_stopping = 1;
+    pthread_join(capture_thread, NULL);
+
     close(socket_fd);
     pcap_close(handle);
 }
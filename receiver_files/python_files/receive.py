@@ -13,6 +13,11 @@ directory as the README, LICENSE, etc., and run it as a module, ie.
 python -m receiver_files.python_files.receive
 
 You probably also have to run it as root.
+
+By default, the display, statistics, packet and button loops each run in
+their own thread. Pass --cooperative to run them all as coroutines on a single
+event loop instead, which saves the Pi the context switches of four polling
+threads and keeps each loop ticking on schedule.
 """
 
 import fcntl
@@ -32,6 +37,7 @@ import Adafruit_CharLCD as LCD
 from shared_files import multithreaded_lcd as thread_lcd
 from shared_files import computations
 from shared_files import conversions
+from shared_files import event_loop
 from shared_files import SEASIDE
 from shared_files.SEASIDE import SEASIDE_FLAGS
 
@@ -42,8 +48,8 @@ SOCKET_ADDR = '/tmp/receive_socket'
 INTERFACE = 'eth0'
 
 # Creating the class, called Screens, which represents the different screens
-# on the LCD that can be accessed via the four directional buttons.
-Screens = Enum('Screens', 'Summary Payload Source CPU', start=0)
+# on the LCD that can be accessed via the four directional buttons and select.
+Screens = Enum('Screens', 'Summary Payload Source CPU Gaps', start=0)
 
 # Used to determine which screen should currently be shown.
 cur_screen = Screens.Summary.value
@@ -63,13 +69,34 @@ screen_output = [['', ''] for x in xrange(len(Screens))]
 lcd_lock = thread.allocate_lock()
 
 
-def display_loop():
+# How often, in seconds, each of the loops below runs.
+DISPLAY_INTERVAL = 0.7
+STATISTICS_INTERVAL = 1
+LISTEN_PACKETS_INTERVAL = 2
+INPUT_INTERVAL = 0.05
+
+# The sequence number of the last packet received from the C side, so each
+# poll only gets the packets that arrived since the one before.
+last_seq = 0
+
+# The most packets to get in one request. Only the last one is displayed,
+# but they all come in one round trip. A response holds fewer if the
+# packets are big, so each poll asks again until it has caught up.
+POLL_PACKETS = 256
+
+
+def update_display():
     """Pull in screen_output, and updates the LCD screen display."""
+    for i in xrange(2):
+        thread_lcd.lock_and_print_lcd_line(
+            lcd, lcd_lock, screen_output[cur_screen][i], i)
+
+
+def display_loop():
+    """Updates the LCD screen display forever."""
     while True:
-        for i in xrange(2):
-            thread_lcd.lock_and_print_lcd_line(
-                lcd, lcd_lock, screen_output[cur_screen][i], i)
-        time.sleep(0.7)
+        update_display()
+        time.sleep(DISPLAY_INTERVAL)
 
 
 def update_packet_info(packet, number_packets_received):
@@ -111,32 +138,89 @@ def update_packet_info(packet, number_packets_received):
         screen_output[Screens.Source.value][1] = ''
 
 
+def format_gap(nanoseconds):
+    """Formats a gap between packets in at most five characters of the LCD,
+    e.g. '125u' or '1.5m'."""
+    gap, gap_unit = conversions.convert_time_units(nanoseconds)
+    # '%.3g' would put 999.7 as '1e+03'.
+    if gap >= 100:
+        return '%d%s' % (gap, gap_unit[0])
+    return '%.3g%s' % (gap, gap_unit[0])
+
+
+def update_gaps(c_gaps):
+    """Displays the percentiles and the longest (after the M) of the gaps
+    between received packets.
+
+    Args:
+        c_gaps (str): The C side's response to GET_GAPS.
+    """
+    gaps = SEASIDE.unpack_SEASIDE_gaps(c_gaps)
+    if gaps.count == 0:
+        screen_output[Screens.Gaps.value][0] = 'No gaps yet'
+        screen_output[Screens.Gaps.value][1] = ''
+        return
+    screen_output[Screens.Gaps.value][0] = \
+        '50:%s 99:%s' % (format_gap(gaps.p50), format_gap(gaps.p99))
+    screen_output[Screens.Gaps.value][1] = \
+        '999:%s M%s' % (format_gap(gaps.p999), format_gap(gaps.max))
+
+
+def update_statistics(bandwidth):
+    """Displays the bandwidth the C side reported, and the cpu usage.
+
+    Args:
+        bandwidth (int): The bandwidth in bits per second.
+    """
+    bw, bw_unit = conversions.convert_bandwidth_units(bandwidth)
+    bandwidth_output = 'Bw:%5.1f %s' % (bw, bw_unit)
+
+    thread_lcd.lock_and_display_bandwidth_LED(
+        lcd, lcd_lock, bw, bw_unit)
+
+    screen_output[Screens.Summary.value][1] = bandwidth_output
+
+    avg_cpu_usage, per_core_cpu_usage = computations.read_cpu_usage()
+    screen_output[Screens.CPU.value][0] = \
+        'CPU Usage: %4.1f%%' % (avg_cpu_usage)
+
+    screen_output[Screens.CPU.value][1] = \
+        '%2.0f%% %2.0f%% %2.0f%% %2.0f%%' % tuple(per_core_cpu_usage)
+
+
 def update_statistics_loop():
     """Gets cpu usage and bandwidth and displays it on the LCD.
+
+    The C side pushes its statistics every STATISTICS_INTERVAL, so there is
+    no need to ask for them.
     """
-    global c_socket_lock
-    while True:
-        d_bytes = SEASIDE.request_SEASIDE(c_socket, c_socket_lock,
-                                          SEASIDE_FLAGS.GET_BANDWIDTH.value)
-        print repr(d_bytes)
-        d_bytes = struct.unpack('=Q', d_bytes)
-        d_bytes = d_bytes[0]
-        bw, bw_unit = conversions.convert_bandwidth_units(d_bytes)
-        bandwidth_output = 'Bw:%5.1f %s' % (bw, bw_unit)
+    for stats in c_client.subscribe_stats(STATISTICS_INTERVAL):
+        update_statistics(stats.bandwidth)
 
-        thread_lcd.lock_and_display_bandwidth_LED(
-            lcd, lcd_lock, bw, bw_unit)
 
-        screen_output[Screens.Summary.value][1] = bandwidth_output
+def update_received_packets(c_packets):
+    """Parses the last of the packets in a response to GET_PACKETS, and
+    displays it.
 
-        avg_cpu_usage, per_core_cpu_usage = computations.read_cpu_usage()
-        screen_output[Screens.CPU.value][0] = \
-            'CPU Usage: %4.1f%%' % (avg_cpu_usage)
+    Args:
+        c_packets (str): The C side's response to GET_PACKETS.
 
-        screen_output[Screens.CPU.value][1] = \
-            '%2.0f%% %2.0f%% %2.0f%% %2.0f%%' % tuple(per_core_cpu_usage)
+    Returns:
+        int: The sequence number of the last packet the C side has. Until
+        last_seq reaches it, there are more packets to get.
+    """
+    global packet, last_seq
 
-        time.sleep(1)
+    last, packets = SEASIDE.unpack_SEASIDE_packets(c_packets)
+    if packets:
+        last_seq = packets[-1].seq
+        # Parse packet with scapy so we can pull it apart easier.
+        packet = scapy.Ether(packets[-1].data)
+        update_packet_info(packet, last_seq)
+    else:
+        # Whatever came before last is gone from the C side's ring.
+        last_seq = max(last_seq, last)
+    return last
 
 
 def listen_packets_loop():
@@ -144,43 +228,116 @@ def listen_packets_loop():
     for any incoming packets. When we hear one, parse it with scapy and update
     the display to show information about packet.
     """
-    global packet
-    global c_socket
-
     print 'Listening for packets...'
 
     while True:
-        # Receive any packet that the C side has sent over.
-        print 'Sending request'
-        c_packet = SEASIDE.request_SEASIDE(c_socket, c_socket_lock, SEASIDE_FLAGS.GET_PACKET.value)
-
-        if c_packet != '':
-            # Parse packet with scapy so we can pull it apart easier.
-            packet = scapy.Ether(c_packet)
-    
-            num_packets_received = SEASIDE.request_SEASIDE(c_socket, c_socket_lock, SEASIDE_FLAGS.NUM_PACKETS.value)
-            num_packets_received = struct.unpack('=I', num_packets_received)
-            update_packet_info(packet, num_packets_received)
+        # Receive the packets that the C side has received since the last
+        # poll. Both requests are put in flight at once, so they share a
+        # single round trip.
+        c_packets = c_client.request_async(
+            SEASIDE_FLAGS.GET_PACKETS.value,
+            SEASIDE.PACKETS_REQUEST.pack(last_seq, POLL_PACKETS))
+        c_gaps = c_client.request_async(SEASIDE_FLAGS.GET_GAPS.value)
+        last = update_received_packets(c_packets.result())
+        # Catch up to the packets that were there at the start of the poll,
+        # not ones that arrived since, so this ends even at high rates.
+        while last_seq < last:
+            update_received_packets(c_client.request(
+                SEASIDE_FLAGS.GET_PACKETS.value,
+                SEASIDE.PACKETS_REQUEST.pack(last_seq, POLL_PACKETS)))
+        update_gaps(c_gaps.result())
+
+        time.sleep(LISTEN_PACKETS_INTERVAL)
+
+
+def check_buttons():
+    """Updates the displayed screen if a button is being pushed.
 
-        time.sleep(2)
+    Each button is associated with a different screen, and so when you
+    push a button, the screen that should be currently shown is changed.
+    """
+    global cur_screen
+    if lcd.is_pressed(LCD.UP):
+        cur_screen = Screens.Summary.value
+    elif lcd.is_pressed(LCD.DOWN):
+        cur_screen = Screens.Payload.value
+    elif lcd.is_pressed(LCD.LEFT):
+        cur_screen = Screens.Source.value
+    elif lcd.is_pressed(LCD.RIGHT):
+        cur_screen = Screens.CPU.value
+    elif lcd.is_pressed(LCD.SELECT):
+        cur_screen = Screens.Gaps.value
 
 
 def input_loop():
-    """Listens for button presses and updates the displayed screen.
+    """Listens for button presses and updates the displayed screen."""
+    while True:
+        check_buttons()
 
-    Each button is associated with a different screen, and so when you
-    push a button, the screen that should be currently shown is changed.
+
+# The cooperative versions of the loops above, which all run on a single
+# event loop (see shared_files/event_loop.py) instead of in their own threads.
+# They tick on absolute deadlines, so the time spent working doesn't stretch
+# out each cycle.
+
+def every(interval, tick):
+    """Coroutine that calls tick every interval seconds, forever.
+
+    If tick returns a coroutine, it is run to completion before the next
+    tick is scheduled.
     """
-    global cur_screen
+    deadline = time.time()
     while True:
-        if lcd.is_pressed(LCD.UP):
-            cur_screen = Screens.Summary.value
-        elif lcd.is_pressed(LCD.DOWN):
-            cur_screen = Screens.Payload.value
-        elif lcd.is_pressed(LCD.LEFT):
-            cur_screen = Screens.Source.value
-        elif lcd.is_pressed(LCD.RIGHT):
-            cur_screen = Screens.CPU.value
+        work = tick()
+        if work is not None:
+            yield work
+        deadline += interval
+        # If a tick overran, skip the ticks we missed instead of bunching
+        # them all up.
+        now = time.time()
+        if deadline < now:
+            deadline = now
+        yield event_loop.SleepUntil(deadline)
+
+
+def request_statistics_coroutine(c_socket, c_socket_lock):
+    """Coroutine that requests the bandwidth and displays the statistics."""
+    d_bytes = yield SEASIDE.request_SEASIDE_coroutine(
+        c_socket, c_socket_lock, SEASIDE_FLAGS.GET_BANDWIDTH.value)
+    update_statistics(struct.unpack('=Q', d_bytes)[0])
+
+
+def request_packet_coroutine(c_socket, c_socket_lock):
+    """Coroutine that requests the packets received since the last poll
+    and the gaps between packets, and displays them."""
+    c_packets = yield SEASIDE.request_SEASIDE_coroutine(
+        c_socket, c_socket_lock, SEASIDE_FLAGS.GET_PACKETS.value,
+        SEASIDE.PACKETS_REQUEST.pack(last_seq, POLL_PACKETS))
+    last = update_received_packets(c_packets)
+    # Catch up to the packets that were there at the start of the poll.
+    while last_seq < last:
+        c_packets = yield SEASIDE.request_SEASIDE_coroutine(
+            c_socket, c_socket_lock, SEASIDE_FLAGS.GET_PACKETS.value,
+            SEASIDE.PACKETS_REQUEST.pack(last_seq, POLL_PACKETS))
+        update_received_packets(c_packets)
+    c_gaps = yield SEASIDE.request_SEASIDE_coroutine(
+        c_socket, c_socket_lock, SEASIDE_FLAGS.GET_GAPS.value)
+    update_gaps(c_gaps)
+
+
+def main_coroutine(loop):
+    """Connects to the C side, and starts the cooperative loops."""
+    c_socket = yield event_loop.open_unix_connection(SOCKET_ADDR)
+    c_socket_lock = event_loop.Lock()
+
+    loop.spawn(every(DISPLAY_INTERVAL, update_display))
+    loop.spawn(every(STATISTICS_INTERVAL,
+                     lambda: request_statistics_coroutine(c_socket,
+                                                          c_socket_lock)))
+    loop.spawn(every(LISTEN_PACKETS_INTERVAL,
+                     lambda: request_packet_coroutine(c_socket,
+                                                      c_socket_lock)))
+    loop.spawn(every(INPUT_INTERVAL, check_buttons))
 
 
 if __name__ == '__main__':
@@ -198,21 +355,21 @@ if __name__ == '__main__':
         sys.exit(0)
     # End of lock code.
 
-    global c_socket
-    c_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
-    SOCKET_ADDR = '/tmp/receive_socket'
-    while True:
-        try:
-            c_socket.connect(SOCKET_ADDR)
-            break
-        except:
-            time.sleep(1)
-            print 'Trying to connect...'
+    cooperative = '--cooperative' in sys.argv
+
+    if not cooperative:
+        c_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        while True:
+            try:
+                c_socket.connect(SOCKET_ADDR)
+                break
+            except:
+                time.sleep(1)
+                print 'Trying to connect...'
 
-    # A lock to ensure that only one thread may use the c_socket to communicate
-    # using SEASIDE at once.
-    global c_socket_lock
-    c_socket_lock = threading.RLock()
+        # The SEASIDE client that all the threads share. Requests are tagged,
+        # so the threads never wait on each other's round trips.
+        c_client = SEASIDE.SEASIDE_Client(c_socket)
 
     # Initializes LCD and turn off LED.
     lcd = LCD.Adafruit_CharLCDPlate()
@@ -221,15 +378,21 @@ if __name__ == '__main__':
 
     screen_output[Screens.Summary.value][0] = 'Awaiting packets'
 
-    try:
-        thread.start_new_thread(display_loop, ())
-        thread.start_new_thread(update_statistics_loop, ())
-        thread.start_new_thread(input_loop, ())
-    except:
-        print 'Error: ', sys.exc_info()[0]
-
-    # Run one of the functions on the main thread, just to avoid having to
-    # create another thread, and because the main thread would need to wait
-    # for the other threads or the program would stop running as soon as it
-    # reaches the end.
-    listen_packets_loop()
+    if cooperative:
+        # Every loop runs as a coroutine on this one thread.
+        loop = event_loop.EventLoop()
+        loop.spawn(main_coroutine(loop))
+        loop.run()
+    else:
+        try:
+            thread.start_new_thread(display_loop, ())
+            thread.start_new_thread(update_statistics_loop, ())
+            thread.start_new_thread(input_loop, ())
+        except:
+            print 'Error: ', sys.exc_info()[0]
+
+        # Run one of the functions on the main thread, just to avoid having to
+        # create another thread, and because the main thread would need to
+        # wait for the other threads or the program would stop running as
+        # soon as it reaches the end.
+        listen_packets_loop()
@@ -0,0 +1,83 @@
+"""Shows the receiving side's top flows, like top.
+
+Every interval, asks the C-side for its top flows (see GET_FLOWS) and prints
+them: how many packets and bytes of each arrived, how long ago the last one
+did, and the longest gap between two of them. When the sending Pi sends
+traffic over several flows, comparing them shows which flows lost packets or
+stalled, without saving a capture of everything.
+
+Run from the project root, while the C-side is running:
+
+python -m receiver_files.python_files.top_flows --count 20 --order packets
+"""
+import argparse
+import socket
+import time
+
+from shared_files import SEASIDE
+from shared_files import conversions
+
+SOCKET_ADDR = '/tmp/receive_socket'
+
+# Names of the protocols that have ports.
+PROTOCOLS = {6: 'TCP', 17: 'UDP', 132: 'SCTP'}
+
+
+def describe(flow):
+    """Returns the flow's VLAN, protocol and endpoints, as a string."""
+    vlan = 'vlan %d ' % flow.vlan if flow.vlan else ''
+    if flow.src is None:
+        return '%sethertype 0x%04x' % (vlan, flow.ethertype)
+    if flow.protocol in PROTOCOLS:
+        return '%s%s %s:%d > %s:%d' % (vlan, PROTOCOLS[flow.protocol],
+                                       flow.src, flow.src_port, flow.dst,
+                                       flow.dst_port)
+    return '%sproto %d %s > %s' % (vlan, flow.protocol, flow.src, flow.dst)
+
+
+def show(client, count, order):
+    active, evicted, flows = client.top_flows(count, order)
+    now = time.time()
+    print '%d active flows, %d evicted' % (active, evicted)
+    print '%12s %12s %9s %9s  %s' % ('packets', 'bytes', 'idle', 'max gap',
+                                     'flow')
+    for flow in flows:
+        idle, idle_unit = conversions.convert_time_units(
+            max(now - flow.last, 0) * 1e9)
+        gap, gap_unit = conversions.convert_time_units(flow.max_gap * 1e9)
+        print '%12d %12d %7.1f%-2s %7.1f%-2s  %s' % (
+            flow.packets, flow.bytes, idle, idle_unit, gap, gap_unit,
+            describe(flow))
+    print
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--count', type=int, default=10,
+                        help='how many flows to show, up to %d'
+                        % SEASIDE.FLOWS_MAX_TOP)
+    parser.add_argument('--order', choices=('bytes', 'packets'),
+                        default='bytes', help='what to rank the flows by')
+    parser.add_argument('--interval', type=float, default=2,
+                        help='seconds between updates, 0 to show them once')
+    parser.add_argument('--socket', default=SOCKET_ADDR)
+    args = parser.parse_args()
+
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    sock.connect(args.socket)
+    client = SEASIDE.SEASIDE_Client(sock)
+    order = SEASIDE.FLOW_ORDER[args.order.upper()]
+    try:
+        while True:
+            show(client, args.count, order)
+            if not args.interval:
+                break
+            time.sleep(args.interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        client.close()
+
+
+if __name__ == '__main__':
+    main()
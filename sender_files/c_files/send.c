@@ -1,14 +1,23 @@
+/* For sendmmsg. */
+#define _GNU_SOURCE
+
 #include <arpa/inet.h>
 #include <errno.h>
+#include <limits.h>
+#include <linux/if_ether.h>
+#include <linux/if_packet.h>
 #include <sys/file.h>
 #include <math.h>
+#include <net/if.h>
 #include <netinet/tcp.h>
 #include <pcap.h>
+#include <poll.h>
 #include <pthread.h>
 #include <stdint.h>
 #include <stdio.h>
 #include <stdlib.h>
 #include <string.h>
+#include <sys/mman.h>
 #include <sys/socket.h>
 #include <sys/un.h>
 #include <time.h>
@@ -21,7 +30,8 @@
 #define MAX(A,B) (A) < (B) ? (B) : (A)
 #define MIN(A,B) (A) < (B) ? (A) : (B)
 
-/* The device that we will be listening to. */
+/* The device that we will be sending on, unless another one is given with
+ * -i at startup. */
 #define DEVICE "eth0"
 
 /* The file that we will create in order to initialize a socket between this
@@ -36,12 +46,57 @@
 /* The size of the buffer that holds incoming packets. */
 #define PCAP_BUFFER_SIZE 2097152
 
-/* The buffer that will be used to hold the packet that the UI sends over,
- * must be big enough to gurantee that it does not overflow (obviously). */
-#define UI_BUFFER_SIZE 2048
+/* The largest packet that can be held, big enough for jumbo frames (9000
+ * byte MTU) with plenty to spare. */
+#define MAX_PACKET_SIZE 65535
+
+/* How many bytes of each SEASIDE message's data are printed as it comes
+ * in. Messages can be megabytes, and printing all of them would hold up the
+ * connection. */
+#define LOG_DATA_BYTES 16
 
 #define NANOSECONDS_PER_SECOND 1000000000
 
+/* The ways packets can be put on the wire, picked with -b at startup.
+ * pcap_inject makes a system call for every packet, which limits how many
+ * small packets can be sent per second. The other two hand the kernel a
+ * batch of up to TX_BATCH packets per system call, through a packet socket
+ * that bypasses the qdisc (where the kernel supports that): with sendmmsg,
+ * or through a PACKET_TX_RING shared with the kernel. */
+#define BACKEND_PCAP 0
+#define BACKEND_MMSG 1
+#define BACKEND_RING 2
+
+/* The most packets handed to the kernel at once by the batching backends. */
+#define TX_BATCH 64
+
+/* The size of the buffer a batch of packets is copied into for sendmmsg. A
+ * batch is sent early if the next packet doesn't fit. */
+#define TX_BATCH_BYTES 262144
+
+/* The PACKET_TX_RING is TX_RING_FRAMES slots of TX_RING_FRAME_SIZE bytes,
+ * each holding a packet after its header (at TPACKET_ALIGN of the header's
+ * size). Packets too big for a slot (i.e. jumbo frames) go through
+ * pcap_inject instead. */
+#define TX_RING_FRAME_SIZE 2048
+#define TX_RING_FRAMES 1024
+#define TX_RING_DATA_OFFSET \
+    ((sizeof(struct tpacket2_hdr) + TPACKET_ALIGNMENT - 1) \
+     / TPACKET_ALIGNMENT * TPACKET_ALIGNMENT)
+
+/* While the device's queue is full, the packets are tried again every
+ * TX_RETRY_USEC microseconds, for as long as the sending thread is running.
+ * Once it is told to stop (or with nothing sending continuously, e.g. for a
+ * single packet), they are given up on after TX_MAX_RETRIES more tries. */
+#define TX_RETRY_USEC 100
+#define TX_MAX_RETRIES 1000
+
+/* The achieved rate is averaged over the last ACHIEVED_BUCKETS buckets of
+ * ACHIEVED_BUCKET_NSEC nanoseconds each (one second), or over the time since
+ * sending started if that is shorter. */
+#define ACHIEVED_BUCKETS 10
+#define ACHIEVED_BUCKET_NSEC 100000000
+
 #define SEASIDE_PACKET          0
 #define SEASIDE_START           1
 #define SEASIDE_STOP            2
@@ -54,16 +109,196 @@
 #define SEASIDE_START_SEQUENCE  9
 #define SEASIDE_STOP_SEQUENCE   10
 #define SEASIDE_RESPONSE        11
+#define SEASIDE_SUBSCRIBE_STATS 12
+#define SEASIDE_STATS           13
+#define SEASIDE_SET_MUTATORS    14
+#define SEASIDE_START_REPLAY    15
+#define SEASIDE_STOP_REPLAY     16
+#define SEASIDE_SET_RATE        17
+#define SEASIDE_SEND_BURST      18
+#define SEASIDE_GET_TX_STATS    19
+#define SEASIDE_GET_GAPS        20
+#define SEASIDE_GET_RX_RATES    21
+#define SEASIDE_GET_PACKETS     22
+#define SEASIDE_GET_FLOWS       23
+
+/* The most packets that a sequence (see SEASIDE_START_SEQUENCE) can hold. */
+#define MAX_SEQUENCE_PACKETS 65536
+
+/* The most field mutators (see SEASIDE_SET_MUTATORS) a packet can have. */
+#define MAX_MUTATORS 8
+
+/* How a replay (see SEASIDE_START_REPLAY) times its packets: with the gaps
+ * they were captured with, with those gaps multiplied by a scale, or back to
+ * back, as fast as they can be sent. */
+#define REPLAY_ORIGINAL 0
+#define REPLAY_SCALED   1
+#define REPLAY_MAX_RATE 2
+
+/* How long the sending thread sleeps at most before checking whether it
+ * should stop, in nanoseconds. */
+#define SPAM_CHECK_NSEC 500000000
+
+/* What the rate of a SEASIDE_SET_RATE message is in: packets or bits per
+ * second. */
+#define RATE_PPS 0
+#define RATE_BPS 1
+
+/* When sending at a rate, gaps shorter than this (in nanoseconds) are waited
+ * out by polling the clock, since waking up from a sleep isn't that
+ * precise. Longer gaps are slept until this much before the deadline. */
+#define BUSY_POLL_NSEC 100000
+
+/* When sending at a rate, if the sending thread falls more than this (in
+ * nanoseconds) behind, e.g. because it wasn't scheduled for a while, it
+ * starts counting from the current time again instead of sending a burst to
+ * catch up. Smaller lags are caught up by sending back to back. */
+#define MAX_RATE_LAG_NSEC 10000000
+
+/* The shortest interval between two statistics pushes that a UI connection
+ * can subscribe to, in milliseconds. */
+#define MIN_STATS_INTERVAL 10
+
+/* Set on the type of a message that carries a request ID. The four byte ID
+ * follows the three byte header (it is not counted in the size), and is
+ * echoed back in the header of the response, so the UI side can have
+ * several requests in flight on the same connection. */
+#define SEASIDE_TAGGED 0x80
+
+/* The size of the header at the start of every SEASIDE message: one byte
+ * of type, and two bytes of size. */
+#define SEASIDE_HEADER_SIZE 3
+
+/* A size of SEASIDE_EXTENDED in the header means that the data is too big
+ * for two bytes. Its real size follows the header as four bytes (before the
+ * request ID, if tagged), and is not counted in the size either. */
+#define SEASIDE_EXTENDED UINT16_MAX
+
+/* The most data a single SEASIDE message may carry, so that a corrupted
+ * size can't make a UI connection allocate unbounded memory. */
+#define SEASIDE_MAX_SIZE (16 * 1024 * 1024)
 
 /* Struct to hold the info that we receive from the UI side. The type
  * refers to the type of data that it holds (see above defines), and the size
- * member is the size of the data that it receives. */
+ * member is the size of the data that it receives. If tagged is set, id holds
+ * the request ID that should be echoed in the response. */
 typedef struct {
     uint8_t type;
-    uint16_t size;
+    uint32_t size;
+    uint8_t tagged;
+    uint32_t id;
     uint8_t *data;
 } __attribute__((packed)) SEASIDE;
 
+/* The size of the buffer that each UI connection starts out reading into. It
+ * is big enough for any message without an extended size; the buffer grows
+ * for bigger ones, so a message's data can always be used right where it was
+ * received. */
+#define SEASIDE_STREAM_SIZE \
+    (SEASIDE_HEADER_SIZE + 2 * sizeof(uint32_t) + UINT16_MAX)
+
+/* Buffered reader for the stream of SEASIDE messages on a UI connection.
+ * Bytes between start and end have been received, but not parsed yet, and
+ * capacity is the size of buf. */
+typedef struct {
+    int fd;
+    size_t start;
+    size_t end;
+    size_t capacity;
+    uint8_t *buf;
+} seaside_stream;
+
+/* The statistics record that is pushed to UI connections that subscribed
+ * with SEASIDE_SUBSCRIBE_STATS. The timestamp is CLOCK_MONOTONIC in
+ * nanoseconds, bandwidth is in bits/s, and packets is the number of packets
+ * sent so far. */
+typedef struct {
+    uint64_t timestamp;
+    uint64_t bandwidth;
+    uint64_t packets;
+} __attribute__((packed)) seaside_stats;
+
+/* A field mutator, as sent in the data of a SEASIDE_SET_MUTATORS message.
+ * The field is width (1, 2 or 4) bytes at offset in the packet, in network
+ * byte order. It starts out at min, and counts up by step after every packet
+ * that is sent, wrapping around from max back to min. */
+typedef struct {
+    uint16_t offset;
+    uint8_t width;
+    uint32_t step;
+    uint32_t min;
+    uint32_t max;
+} __attribute__((packed)) seaside_mutator;
+
+/* A field mutator on the packet, along with its current value and the
+ * offsets of the checksums that cover the field (-1 if none do). */
+typedef struct {
+    seaside_mutator field;
+    uint32_t value;
+    long ip_checksum;
+    long l4_checksum;
+    int l4_is_udp;
+} mutator;
+
+/* The options of a replay, as sent at the start of the data of a
+ * SEASIDE_START_REPLAY message; the path of the capture file follows them.
+ * timing is one of the REPLAY_ defines, scale multiplies the gaps between
+ * packets with REPLAY_SCALED, and loops is the number of times to go through
+ * the file, 0 to keep going until stopped. */
+typedef struct {
+    uint8_t timing;
+    uint32_t loops;
+    double scale;
+} __attribute__((packed)) seaside_replay;
+
+/* The rate to send packets at, as sent in the data of a SEASIDE_SET_RATE
+ * message. unit is one of the RATE_ defines. A rate of 0 goes back to
+ * waiting the sleep time between packets. */
+typedef struct {
+    uint8_t unit;
+    double rate;
+} __attribute__((packed)) seaside_rate;
+
+/* A burst of packets, as sent in the data of a SEASIDE_SEND_BURST message:
+ * the number of packets to send, and the gap from the start of one packet to
+ * the next in nanoseconds, 0 to send them back to back. The gap can be left
+ * out of the data. */
+typedef struct {
+    uint64_t count;
+    uint64_t gap;
+} __attribute__((packed)) seaside_burst;
+
+/* The response to a SEASIDE_SEND_BURST message, sent once the burst is over:
+ * the number of packets sent (fewer than the count if it was stopped, or
+ * sending failed), and the time from sending the first to having sent the
+ * last, in nanoseconds. */
+typedef struct {
+    uint64_t sent;
+    uint64_t duration;
+} __attribute__((packed)) seaside_burst_result;
+
+/* The response to a SEASIDE_GET_TX_STATS message: the packets and bytes
+ * handed to the device since startup, the packets that could not be sent,
+ * the number of times the device's queue was full and sending had to be
+ * retried, and the packets/s and bits/s achieved over the last second. */
+typedef struct {
+    uint64_t packets;
+    uint64_t bytes;
+    uint64_t errors;
+    uint64_t retries;
+    uint64_t pps;
+    uint64_t bps;
+} __attribute__((packed)) seaside_tx_stats;
+
+/* The packets and bytes sent during one bucket of the achieved rate, and the
+ * number of the bucket (CLOCK_MONOTONIC over ACHIEVED_BUCKET_NSEC) they were
+ * sent in. */
+typedef struct {
+    uint64_t number;
+    uint64_t packets;
+    uint64_t bytes;
+} achieved_bucket;
+
 /* Singleton file, used to ensure only once instance of this program
  * is running at a time. */
 static int singleton_file;
@@ -81,46 +316,140 @@ static socklen_t size_sock;
 /* A thread dedicated solely to sending packets onto the wire. */
 static pthread_t send_thread;
 
+/* The device to send on, and the backend to send through (one of the
+ * BACKEND_ defines). The batching backends send through tx_fd, a packet
+ * socket bound to the device. */
+static const char *device = DEVICE;
+static int backend = BACKEND_PCAP;
+static int tx_fd = -1;
+
+/* The packets queued by tx_queue that haven't been handed to the kernel
+ * yet. For sendmmsg, they are copied back to back into tx_buffer, which has
+ * tx_used bytes in it, with a message for each. For the PACKET_TX_RING, they
+ * are in the slots before tx_ring_next, and tx_used counts their bytes. Only
+ * the sending thread queues packets, or a connection thread while it is
+ * stopped. */
+static unsigned int tx_count = 0;
+static uint8_t tx_buffer[TX_BATCH_BYTES];
+static size_t tx_used = 0;
+static struct mmsghdr tx_msgs[TX_BATCH];
+static struct iovec tx_iovecs[TX_BATCH];
+static uint8_t *tx_ring = NULL;
+static unsigned int tx_ring_next = 0;
+
 /* Static error buffer that holds any errors that pcap returns back to us.
  * Used so that you don't have to declare an error buffer per function. */
 static char errbuf[PCAP_ERRBUF_SIZE];
 static pcap_t *handle;
 
 /* packet and packet length, to send to the receiving Pi. */
-static uint8_t packet[UI_BUFFER_SIZE];
+static uint8_t packet[MAX_PACKET_SIZE];
 static size_t packet_len = 0;
 
+/* A sequence of packets to cycle through instead of packet, uploaded with
+ * SEASIDE_START_SEQUENCE. The packets are stored back to back in one
+ * preallocated buffer, with packet i running from sequence_offsets[i] up to
+ * sequence_offsets[i + 1]. sequence_len is the number of packets, 0 when
+ * sending packet instead, and sequence_next is the one that is sent next.
+ * Like packet, these are only changed while the sending thread is stopped,
+ * so it cycles through them without any locking. */
+static uint8_t sequence[SEASIDE_MAX_SIZE];
+static uint32_t sequence_offsets[MAX_SEQUENCE_PACKETS + 1];
+static size_t sequence_len = 0;
+static size_t sequence_next = 0;
+
+/* The field mutators on packet, applied after every time it is sent. Like
+ * packet, they are only changed while the sending thread is stopped. */
+static mutator mutators[MAX_MUTATORS];
+static size_t num_mutators = 0;
+
+/* The capture file that is replayed instead of sending packet (empty if
+ * there is none), and how. Like packet, these are only changed while the
+ * sending thread is stopped. */
+static char replay_file[PATH_MAX] = "";
+static seaside_replay replay;
+
+/* The rate to send packet (or the sequence) at, if it is non-zero, instead
+ * of waiting the sleep time between packets. Like packet, this is only
+ * changed while the sending thread is stopped. */
+static seaside_rate rate = {RATE_PPS, 0};
+
+/* The burst to send instead of sending continuously, if its count is
+ * non-zero. Like packet, it is only changed while the sending thread is
+ * stopped. burst_number counts the bursts that were started, and
+ * sending_burst is the number of the one the sending thread is sending (0
+ * if it isn't sending one). */
+static seaside_burst burst = {0, 0};
+static unsigned long burst_number = 0;
+static unsigned long sending_burst = 0;
+
+/* Where the sending thread puts the result of the burst once it is over,
+ * for the connection that asked for it, which waits on burst_done until
+ * burst_report is set back to NULL. */
+static seaside_burst_result *burst_report = NULL;
+static pthread_mutex_t burst_mutex = PTHREAD_MUTEX_INITIALIZER;
+static pthread_cond_t burst_done = PTHREAD_COND_INITIALIZER;
+
 /* Mutex to ensure no two threads attempt to modify packet or packet_len
  * at the same time. */
 static pthread_mutex_t packet_mutex;
 
-/* Variable to hold the bandwidth calculation (bits/s), and a mutex to
- * ensure that it's not read and written to at the same time. */
-static unsigned long long bandwidth = 0;
-static pthread_mutex_t bandwidth_mutex;
-
 /* Boolean to share between threads. As long as send is true, the sending
  * thread will spam the receiving Pi with as many packets as it can send.
  * If it turns false, it will stop sending packets. */
 static volatile unsigned int spam_packets = 0;
 
-/* Variable to hold how many packets we have sent. Used for diagnostic
- * purposes on the UI side. */
-static volatile unsigned long long num_packets_sent = 0;
+/* The transmit counters, for diagnostic purposes on the UI side: packets
+ * and bytes sent, packets that could not be sent, and retries because the
+ * device's queue was full. They are only changed with the __sync builtins,
+ * so they can be read while packets are being sent, without the 64 bit
+ * values tearing on the Pi's 32 bit ARM. */
+static volatile uint64_t num_packets_sent = 0;
+static volatile uint64_t num_bytes_sent = 0;
+static volatile uint64_t num_send_errors = 0;
+static volatile uint64_t num_send_retries = 0;
+
+/* The packets and bytes sent in each of the last ACHIEVED_BUCKETS buckets,
+ * for the achieved rate, and when sending last started. */
+static achieved_bucket achieved[ACHIEVED_BUCKETS];
+static struct timespec achieved_since = {0, 0};
+static pthread_mutex_t achieved_mutex = PTHREAD_MUTEX_INITIALIZER;
 
 /* How long we should wait in between each sent packet. */
 static uint8_t sleep_time_seconds = 1;
 static int32_t sleep_time_useconds = 0;
 
-void
-send_response(int ui_fd, void *data, uint16_t len)
+/* Sends a SEASIDE message through an arbitrary file descriptor. First sends
+ * the header (type and size, the extended size if the data doesn't fit in
+ * two bytes, and the ID of request if it was tagged), and then sends the
+ * actual data. request may be NULL for unrequested messages, such as
+ * statistics pushes. */
+static void
+send_message(int ui_fd, uint8_t type, const SEASIDE *request,
+             void *data, uint32_t len)
 {
-    char buf[3];
+    uint8_t buf[SEASIDE_HEADER_SIZE + 2 * sizeof(uint32_t)];
+    size_t header_len = SEASIDE_HEADER_SIZE;
+    uint16_t short_len =
+        (uint16_t) (len < SEASIDE_EXTENDED ? len : SEASIDE_EXTENDED);
 
-    buf[0] = 11;
-    memcpy(buf + 1, &len, 2);
+    buf[0] = type;
+    memcpy(buf + 1, &short_len, sizeof(uint16_t));
+
+    if (short_len == SEASIDE_EXTENDED) {
+        memcpy(buf + header_len, &len, sizeof(uint32_t));
+        header_len += sizeof(uint32_t);
+    }
+
+    /* Echo the request ID, so the UI side knows which request this
+     * response belongs to. */
+    if (request != NULL && request->tagged) {
+        buf[0] |= SEASIDE_TAGGED;
+        memcpy(buf + header_len, &request->id, sizeof(uint32_t));
+        header_len += sizeof(uint32_t);
+    }
 
-    if (send(ui_fd, buf, 3, MSG_MORE) < 0) {
+    if (send(ui_fd, buf, header_len, MSG_MORE) < 0) {
         fprintf(stderr, "Error with send to ui_fd\n");
     }
     if (send(ui_fd, data, len, 0) < 0) {
@@ -128,6 +457,14 @@ send_response(int ui_fd, void *data, uint16_t len)
     }
 }
 
+/* Sends the response to a request through an arbitrary file descriptor,
+ * echoing the request ID if the request had one. */
+void
+send_response(int ui_fd, const SEASIDE *request, void *data, uint32_t len)
+{
+    send_message(ui_fd, SEASIDE_RESPONSE, request, data, len);
+}
+
 /* Initializes the socket that will be used to receive packet info from
  * the UI program. It binds to the file specified as UI_SOCKET,
  * and then listens in for any attempted connections. When it hears one,
@@ -172,7 +509,7 @@ initialize_socket(void)
 static int
 initialize_pcap(void)
 {
-    handle = pcap_create(DEVICE, errbuf);
+    handle = pcap_create(device, errbuf);
 
     if (handle == NULL) {
         fprintf(stderr, "pcap failed to create handler: %s.\n", errbuf);
@@ -193,6 +530,286 @@ initialize_pcap(void)
     return 0;
 }
 
+/* Opens tx_fd for the batching backends: a packet socket bound to the
+ * device, which only sends (its protocol is 0, so nothing is captured on
+ * it), bypassing the qdisc if the kernel can. Returns 0 on success, and -1
+ * on failure. */
+static int
+open_tx_socket(void)
+{
+    struct sockaddr_ll bind_address;
+
+    tx_fd = socket(AF_PACKET, SOCK_RAW, 0);
+    if (tx_fd < 0) {
+        perror("Could not open a packet socket: ");
+        return -1;
+    }
+
+#ifdef PACKET_QDISC_BYPASS
+    int bypass = 1;
+    if (setsockopt(tx_fd, SOL_PACKET, PACKET_QDISC_BYPASS, &bypass,
+                   sizeof(bypass))) {
+        perror("Could not bypass the qdisc, sending through it: ");
+    }
+#endif
+
+    memset(&bind_address, 0, sizeof(bind_address));
+    bind_address.sll_family = AF_PACKET;
+    bind_address.sll_ifindex = (int) if_nametoindex(device);
+    if (bind_address.sll_ifindex == 0
+        || bind(tx_fd, (struct sockaddr *) &bind_address,
+                sizeof(bind_address))) {
+        fprintf(stderr, "Could not bind a packet socket to %s.\n", device);
+        close(tx_fd);
+        tx_fd = -1;
+        return -1;
+    }
+    return 0;
+}
+
+/* Sets up the PACKET_TX_RING on tx_fd, and maps it. Returns 0 on success,
+ * and -1 on failure. */
+static int
+setup_tx_ring(void)
+{
+    int version = TPACKET_V2;
+    struct tpacket_req request;
+
+    request.tp_block_size = TX_RING_FRAME_SIZE;
+    while (request.tp_block_size < (unsigned int) getpagesize()) {
+        request.tp_block_size *= 2;
+    }
+    request.tp_frame_size = TX_RING_FRAME_SIZE;
+    request.tp_frame_nr = TX_RING_FRAMES;
+    request.tp_block_nr = TX_RING_FRAMES * TX_RING_FRAME_SIZE
+                          / request.tp_block_size;
+
+    if (setsockopt(tx_fd, SOL_PACKET, PACKET_VERSION, &version,
+                   sizeof(version))
+        || setsockopt(tx_fd, SOL_PACKET, PACKET_TX_RING, &request,
+                      sizeof(request))) {
+        perror("Could not set up a PACKET_TX_RING: ");
+        return -1;
+    }
+
+    void *ring = mmap(NULL, (size_t) TX_RING_FRAMES * TX_RING_FRAME_SIZE,
+                      PROT_READ | PROT_WRITE, MAP_SHARED, tx_fd, 0);
+    if (ring == MAP_FAILED) {
+        perror("Could not map the PACKET_TX_RING: ");
+        return -1;
+    }
+    tx_ring = ring;
+    return 0;
+}
+
+/* Sets up the backend picked at startup. If it can't be set up (e.g. the
+ * kernel is too old), falls back to pcap_inject. */
+static void
+initialize_backend(void)
+{
+    if (backend == BACKEND_PCAP) {
+        return;
+    }
+
+    if (open_tx_socket() == 0
+        && (backend != BACKEND_RING || setup_tx_ring() == 0)) {
+        for (unsigned int i = 0; i < TX_BATCH; ++i) {
+            tx_msgs[i].msg_hdr.msg_iov = &tx_iovecs[i];
+            tx_msgs[i].msg_hdr.msg_iovlen = 1;
+        }
+        printf("Sending through %s.\n",
+               backend == BACKEND_RING ? "a PACKET_TX_RING" : "sendmmsg");
+        return;
+    }
+
+    fprintf(stderr, "Falling back to pcap_inject.\n");
+    if (tx_fd >= 0) {
+        close(tx_fd);
+        tx_fd = -1;
+    }
+    backend = BACKEND_PCAP;
+}
+
+/* Returns the header of a slot in the PACKET_TX_RING. */
+static struct tpacket2_hdr *
+tx_ring_slot(unsigned int slot)
+{
+    return (struct tpacket2_hdr *) (void *)
+           (tx_ring + (size_t) slot * TX_RING_FRAME_SIZE);
+}
+
+/* Counts packets as sent, in the totals and in the current bucket of the
+ * achieved rate. */
+static void
+count_sent(uint64_t packets, uint64_t bytes)
+{
+    struct timespec now;
+
+    if (packets == 0) {
+        return;
+    }
+    (void) __sync_add_and_fetch(&num_packets_sent, packets);
+    (void) __sync_add_and_fetch(&num_bytes_sent, bytes);
+
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    uint64_t number = ((uint64_t) now.tv_sec * NANOSECONDS_PER_SECOND
+                       + (uint64_t) now.tv_nsec) / ACHIEVED_BUCKET_NSEC;
+    achieved_bucket *bucket = &achieved[number % ACHIEVED_BUCKETS];
+
+    pthread_mutex_lock(&achieved_mutex);
+    if (bucket->number != number) {
+        bucket->number = number;
+        bucket->packets = 0;
+        bucket->bytes = 0;
+    }
+    bucket->packets += packets;
+    bucket->bytes += bytes;
+    pthread_mutex_unlock(&achieved_mutex);
+}
+
+/* Called when the device's queue is full: counts the retry, and waits a
+ * little for room in it. retries counts the tries made with nothing
+ * sending continuously. Returns 0 to try again, and -1 to give up (see
+ * TX_MAX_RETRIES). */
+static int
+tx_wait(unsigned int *retries)
+{
+    if (spam_packets < 1 && ++*retries > TX_MAX_RETRIES) {
+        return -1;
+    }
+    (void) __sync_add_and_fetch(&num_send_retries, 1);
+    (void) usleep(TX_RETRY_USEC);
+    return 0;
+}
+
+/* Hands the packets queued by tx_queue to the kernel, and waits for them to
+ * be sent. Returns 0 on success, and -1 on error, in which case the queued
+ * packets are dropped. */
+static int
+tx_flush(void)
+{
+    unsigned int done = 0;
+    unsigned int retries = 0;
+    uint64_t bytes = 0;
+
+    while (done < tx_count) {
+        int ret;
+        if (backend == BACKEND_RING) {
+            /* The kernel sends every slot marked for sending. */
+            ret = send(tx_fd, NULL, 0, 0) < 0 ? -1 : (int) tx_count;
+        } else {
+            ret = sendmmsg(tx_fd, tx_msgs + done, tx_count - done, 0);
+        }
+
+        if (ret < 0) {
+            if (errno == EINTR) {
+                continue;
+            }
+            /* The device's queue is full, try again. */
+            if ((errno == EAGAIN || errno == ENOBUFS)
+                && tx_wait(&retries) == 0) {
+                continue;
+            }
+            perror("Could not send a batch of packets: ");
+            break;
+        }
+
+        if (backend == BACKEND_RING) {
+            bytes = tx_used;
+        } else {
+            for (int i = 0; i < ret; ++i) {
+                bytes += tx_iovecs[done + (unsigned int) i].iov_len;
+            }
+        }
+        done += (unsigned int) ret;
+    }
+
+    count_sent(done, bytes);
+    (void) __sync_add_and_fetch(&num_send_errors, tx_count - done);
+    int ret = done < tx_count ? -1 : 0;
+    tx_count = 0;
+    tx_used = 0;
+    return ret;
+}
+
+/* Sends a packet with pcap_inject, trying again while the device's queue is
+ * full (see tx_wait). Returns a negative number on error. */
+static int
+tx_inject(const uint8_t *data, size_t len)
+{
+    unsigned int retries = 0;
+    int ret;
+
+    while ((ret = pcap_inject(handle, data, len)) < 0) {
+        if (errno == EINTR) {
+            continue;
+        }
+        if ((errno != EAGAIN && errno != ENOBUFS)
+            || tx_wait(&retries) < 0) {
+            (void) __sync_add_and_fetch(&num_send_errors, 1);
+            return ret;
+        }
+    }
+    count_sent(1, len);
+    return ret;
+}
+
+/* Queues a packet for the backend to send, handing the queued ones to the
+ * kernel first if there is no room for it, and after it if that makes a
+ * full batch. With pcap_inject, it is sent right away. The packet is copied,
+ * so it can be changed as soon as this returns. Returns a negative number
+ * on error. */
+static int
+tx_queue(const uint8_t *data, size_t len)
+{
+    if (backend == BACKEND_MMSG) {
+        if (tx_used + len > TX_BATCH_BYTES && tx_flush() < 0) {
+            return -1;
+        }
+        memcpy(tx_buffer + tx_used, data, len);
+        tx_iovecs[tx_count].iov_base = tx_buffer + tx_used;
+        tx_iovecs[tx_count].iov_len = len;
+        tx_used += len;
+    } else if (backend == BACKEND_RING
+               && len <= TX_RING_FRAME_SIZE - TX_RING_DATA_OFFSET) {
+        struct tpacket2_hdr *header = tx_ring_slot(tx_ring_next);
+        volatile uint32_t *status = &header->tp_status;
+
+        /* Wait for the kernel to be done with the slot from the last time
+         * around the ring. */
+        while (*status != TP_STATUS_AVAILABLE) {
+            if (*status == TP_STATUS_WRONG_FORMAT) {
+                fprintf(stderr, "The kernel rejected a packet in the "
+                        "PACKET_TX_RING.\n");
+                *status = TP_STATUS_AVAILABLE;
+                return -1;
+            }
+            if (tx_flush() < 0) {
+                return -1;
+            }
+        }
+
+        memcpy((uint8_t *) header + TX_RING_DATA_OFFSET, data, len);
+        header->tp_len = (uint32_t) len;
+        __sync_synchronize();
+        *status = TP_STATUS_SEND_REQUEST;
+        tx_ring_next = (tx_ring_next + 1) % TX_RING_FRAMES;
+        tx_used += len;
+    } else {
+        /* Packets that don't fit in a ring slot go after the ones that are
+         * queued, not before them. */
+        if (tx_count > 0 && tx_flush() < 0) {
+            return -1;
+        }
+        return tx_inject(data, len);
+    }
+
+    if (++tx_count == TX_BATCH) {
+        return tx_flush();
+    }
+    return 0;
+}
+
 /* Helper function to add two timespecs together. */
 static struct timespec
 timespec_add(const struct timespec *t1, const struct timespec *t2)
@@ -229,11 +846,486 @@ timespec_sub(const struct timespec *t1, const struct timespec *t2)
     return result;
 }
 
-/* Send a packet through the pcap interface. */
+/* Helper function to convert a number of seconds to a timespec. */
+static struct timespec
+timespec_from_seconds(double seconds)
+{
+    struct timespec result;
+
+    result.tv_sec = (time_t) seconds;
+    result.tv_nsec = (long) ((seconds - (double) result.tv_sec)
+                             * NANOSECONDS_PER_SECOND);
+
+    return result;
+}
+
+/* Sleeps until deadline (on CLOCK_MONOTONIC), waking up every
+ * SPAM_CHECK_NSEC to check whether the sending thread should stop. Returns 0
+ * once the deadline has passed, and -1 if it should stop before then. */
+static int
+sleep_until(const struct timespec *deadline)
+{
+    const struct timespec check = {0, SPAM_CHECK_NSEC};
+    struct timespec now, wake;
+
+    while (spam_packets) {
+        clock_gettime(CLOCK_MONOTONIC, &now);
+        if (timespec_sub(deadline, &now).tv_sec < 0) {
+            return 0;
+        }
+
+        wake = timespec_add(&now, &check);
+        if (timespec_sub(deadline, &wake).tv_sec < 0) {
+            wake = *deadline;
+        }
+        clock_nanosleep(CLOCK_MONOTONIC, TIMER_ABSTIME, &wake, NULL);
+    }
+    return -1;
+}
+
+/* Waits until deadline (on CLOCK_MONOTONIC) as precisely as it can:
+ * sleeps until BUSY_POLL_NSEC before it, and polls the clock for the rest.
+ * Stores the time it stopped waiting in now. Returns 0 once the deadline has
+ * passed, and -1 if the sending thread should stop before then. */
+static int
+wait_until(const struct timespec *deadline, struct timespec *now)
+{
+    const struct timespec busy_poll = {0, BUSY_POLL_NSEC};
+    struct timespec poll_from = timespec_sub(deadline, &busy_poll);
+
+    if (sleep_until(&poll_from)) {
+        return -1;
+    }
+    do {
+        clock_gettime(CLOCK_MONOTONIC, now);
+    } while (timespec_sub(deadline, now).tv_sec >= 0);
+    return 0;
+}
+
+/* Updates the checksum at csum for one of the 16-bit words it covers
+ * changing from old_word to new_word, without summing everything again
+ * (RFC 1624, equation 3). */
+static void
+checksum_update(uint8_t *csum, uint16_t old_word, uint16_t new_word)
+{
+    uint32_t sum = (uint16_t) ~((csum[0] << 8) | csum[1]);
+    sum += (uint16_t) ~old_word;
+    sum += new_word;
+    sum = (sum & 0xFFFF) + (sum >> 16);
+    sum = (sum & 0xFFFF) + (sum >> 16);
+
+    uint16_t result = (uint16_t) ~sum;
+    csum[0] = (uint8_t) (result >> 8);
+    csum[1] = (uint8_t) result;
+}
+
+/* Writes a mutator's value into packet, and fixes up the checksums that
+ * cover it. */
+static void
+apply_mutator(const mutator *mut)
+{
+    /* The 16-bit words that the field overlaps. Checksummed headers all
+     * start at even offsets, so the words line up with theirs. */
+    size_t first = mut->field.offset & ~(size_t) 1;
+    size_t last = mut->field.offset + mut->field.width;
+    uint16_t old_words[3];
+
+    for (size_t i = first, w = 0; i < last; i += 2, ++w) {
+        old_words[w] = (uint16_t) (packet[i] << 8
+                                   | (i + 1 < packet_len ? packet[i + 1] : 0));
+    }
+
+    for (uint8_t i = 0; i < mut->field.width; ++i) {
+        packet[mut->field.offset + i] =
+            (uint8_t) (mut->value >> (8 * (mut->field.width - 1 - i)));
+    }
+
+    for (size_t i = first, w = 0; i < last; i += 2, ++w) {
+        uint16_t new_word = (uint16_t) (packet[i] << 8
+                                | (i + 1 < packet_len ? packet[i + 1] : 0));
+        if (mut->ip_checksum >= 0) {
+            checksum_update(packet + mut->ip_checksum, old_words[w], new_word);
+        }
+        if (mut->l4_checksum >= 0) {
+            checksum_update(packet + mut->l4_checksum, old_words[w], new_word);
+        }
+    }
+
+    /* A UDP checksum of 0 means there is none, so send it as all ones. */
+    if (mut->l4_is_udp && packet[mut->l4_checksum] == 0
+        && packet[mut->l4_checksum + 1] == 0) {
+        packet[mut->l4_checksum] = 0xFF;
+        packet[mut->l4_checksum + 1] = 0xFF;
+    }
+}
+
+/* Moves every mutator on to its next value, and applies it to packet. */
+static void
+advance_mutators(void)
+{
+    for (size_t i = 0; i < num_mutators; ++i) {
+        mutator *mut = &mutators[i];
+        uint64_t range = (uint64_t) mut->field.max - mut->field.min + 1;
+        uint64_t next = ((uint64_t) mut->value - mut->field.min
+                         + mut->field.step) % range;
+        mut->value = (uint32_t) (mut->field.min + next);
+        apply_mutator(mut);
+    }
+}
+
+/* Finds the checksums in packet that cover the bytes from start up to end:
+ * the IPv4 header checksum, and the UDP or TCP checksum (which also covers
+ * the IP addresses, through its pseudo header). Only Ethernet frames (with
+ * any number of VLAN tags) are looked into. */
+static void
+find_checksums(size_t start, size_t end, mutator *mut)
+{
+    size_t pos = 12;
+    mut->ip_checksum = -1;
+    mut->l4_checksum = -1;
+    mut->l4_is_udp = 0;
+
+    while (pos + 4 <= packet_len
+           && ((packet[pos] == 0x81 && packet[pos + 1] == 0x00)
+               || (packet[pos] == 0x88 && packet[pos + 1] == 0xa8))) {
+        pos += 4;
+    }
+    if (pos + 2 + 20 > packet_len
+        || packet[pos] != 0x08 || packet[pos + 1] != 0x00) {
+        return;
+    }
+
+    size_t ip = pos + 2;
+    size_t ihl = (size_t) (packet[ip] & 0x0F) * 4;
+    size_t ip_end = ip + (size_t) (packet[ip + 2] << 8 | packet[ip + 3]);
+    uint8_t proto = packet[ip + 9];
+    size_t l4 = ip + ihl;
+    if (ip_end > packet_len) {
+        ip_end = packet_len;
+    }
+
+    if (start < ip + ihl && end > ip) {
+        mut->ip_checksum = (long) ip + 10;
+    }
+
+    size_t l4_checksum;
+    if (proto == IPPROTO_UDP && l4 + 8 <= ip_end) {
+        l4_checksum = l4 + 6;
+        /* A UDP checksum of 0 means there is none, so leave it that way. */
+        if (packet[l4_checksum] == 0 && packet[l4_checksum + 1] == 0) {
+            return;
+        }
+        mut->l4_is_udp = 1;
+    } else if (proto == IPPROTO_TCP && l4 + 20 <= ip_end) {
+        l4_checksum = l4 + 16;
+    } else {
+        return;
+    }
+
+    if ((start < ip + 20 && end > ip + 12) || (start < ip_end && end > l4)) {
+        mut->l4_checksum = (long) l4_checksum;
+    }
+}
+
+/* Replaces the mutators on packet with the ones in the data of a
+ * SEASIDE_SET_MUTATORS message, and applies their starting values. No data
+ * removes them all. Returns 0 on success, and -1 if the data is malformed or
+ * a mutator doesn't fit in packet, in which case none are set. */
+static int
+set_mutators(const uint8_t *data, uint32_t size)
+{
+    size_t count = size / sizeof(seaside_mutator);
+    num_mutators = 0;
+
+    if (size % sizeof(seaside_mutator) || count > MAX_MUTATORS) {
+        return -1;
+    }
+
+    for (size_t i = 0; i < count; ++i) {
+        mutator *mut = &mutators[i];
+        memcpy(&mut->field, data + i * sizeof(seaside_mutator),
+               sizeof(seaside_mutator));
+
+        size_t end = (size_t) mut->field.offset + mut->field.width;
+        if ((mut->field.width != 1 && mut->field.width != 2
+             && mut->field.width != 4)
+            || end > packet_len || mut->field.min > mut->field.max) {
+            return -1;
+        }
+
+        find_checksums(mut->field.offset, end, mut);
+
+        /* Don't let a mutator overwrite a checksum it is fixing up. */
+        for (long csum = 0; csum < 2; ++csum) {
+            long at = csum ? mut->l4_checksum : mut->ip_checksum;
+            if (at >= 0 && (size_t) at < end
+                && (size_t) at + 2 > mut->field.offset) {
+                return -1;
+            }
+        }
+    }
+
+    for (size_t i = 0; i < count; ++i) {
+        mutators[i].value = mutators[i].field.min;
+        apply_mutator(&mutators[i]);
+    }
+    num_mutators = count;
+    return 0;
+}
+
+/* Returns the length of the packet that send_packet will send next. */
+static size_t
+next_packet_len(void)
+{
+    if (sequence_len == 0) {
+        return packet_len;
+    }
+    return sequence_offsets[sequence_next + 1]
+           - sequence_offsets[sequence_next];
+}
+
+/* Queue a packet for the backend to send: either packet, or the next one in
+ * the sequence if there is one. Any mutators on packet move on to their next
+ * values after it is queued. With a batching backend, the packet may not be
+ * sent until tx_flush. Returns a negative number on error. */
+static int
+queue_packet(void)
+{
+    if (sequence_len == 0) {
+        int ret = tx_queue(packet, packet_len);
+        advance_mutators();
+        return ret;
+    }
+
+    size_t len = next_packet_len();
+    uint8_t *next = sequence + sequence_offsets[sequence_next];
+    if (++sequence_next == sequence_len) {
+        sequence_next = 0;
+    }
+    return tx_queue(next, len);
+}
+
+/* Send a packet right away, see queue_packet. */
 static int
 send_packet(void)
 {
-    return pcap_inject(handle, packet, packet_len);
+    int ret = queue_packet();
+    if (ret >= 0 && tx_flush() < 0) {
+        return -1;
+    }
+    return ret;
+}
+
+/* Replaces the sequence with the packets in the data of a
+ * SEASIDE_START_SEQUENCE message: each one is a two byte length followed by
+ * the packet itself. Returns 0 on success, and -1 if the data is malformed,
+ * in which case the sequence is left as it was. */
+static int
+set_sequence(const uint8_t *data, uint32_t size)
+{
+    size_t count = 0;
+    uint32_t pos = 0;
+    uint16_t len;
+
+    /* Check the whole thing before touching the current sequence. A length
+     * never goes over MAX_PACKET_SIZE, because it is two bytes. */
+    while (pos < size) {
+        if (size - pos < sizeof(uint16_t) || count == MAX_SEQUENCE_PACKETS) {
+            return -1;
+        }
+        memcpy(&len, data + pos, sizeof(uint16_t));
+        pos += sizeof(uint16_t);
+        if (len == 0 || len > size - pos) {
+            return -1;
+        }
+        pos += len;
+        count++;
+    }
+    if (count == 0) {
+        return -1;
+    }
+
+    /* The packets take up less room than the data they came in, so they
+     * always fit in sequence. */
+    uint32_t stored = 0;
+    pos = 0;
+    for (size_t i = 0; i < count; ++i) {
+        memcpy(&len, data + pos, sizeof(uint16_t));
+        pos += sizeof(uint16_t);
+        sequence_offsets[i] = stored;
+        memcpy(sequence + stored, data + pos, len);
+        stored += len;
+        pos += len;
+    }
+    sequence_offsets[count] = stored;
+    sequence_len = count;
+    sequence_next = 0;
+    return 0;
+}
+
+/* Sets up a replay from the data of a SEASIDE_START_REPLAY message: a
+ * seaside_replay, followed by the path of the capture file. Returns 0 on
+ * success, and -1 if the data is malformed or the file can't be opened or
+ * has no packets, in which case the replay is left as it was. */
+static int
+set_replay(const uint8_t *data, uint32_t size)
+{
+    seaside_replay options;
+    size_t path_len = size - sizeof(seaside_replay);
+
+    if (size <= sizeof(seaside_replay) || path_len >= PATH_MAX) {
+        return -1;
+    }
+    memcpy(&options, data, sizeof(seaside_replay));
+    if (options.timing > REPLAY_MAX_RATE
+        || !isfinite(options.scale) || options.scale < 0) {
+        return -1;
+    }
+
+    char path[PATH_MAX];
+    memcpy(path, data + sizeof(seaside_replay), path_len);
+    path[path_len] = '\0';
+
+    /* Only check that it opens and has a packet here; the sending thread
+     * reads it one packet at a time, so it can be any size. */
+    pcap_t *capture = pcap_open_offline(path, errbuf);
+    if (capture == NULL) {
+        fprintf(stderr, "Could not open %s: %s\n", path, errbuf);
+        return -1;
+    }
+    struct pcap_pkthdr *header;
+    const u_char *packet_data;
+    int has_packet = pcap_next_ex(capture, &header, &packet_data) == 1;
+    pcap_close(capture);
+    if (!has_packet) {
+        fprintf(stderr, "%s has no packets to replay.\n", path);
+        return -1;
+    }
+
+    memcpy(replay_file, path, path_len + 1);
+    replay = options;
+    return 0;
+}
+
+/* Sets the rate from the data of a SEASIDE_SET_RATE message. Returns 0 on
+ * success, and -1 if the data is invalid, in which case the rate is left as
+ * it was. */
+static int
+set_rate(const uint8_t *data, uint32_t size)
+{
+    seaside_rate options;
+
+    if (size != sizeof(seaside_rate)) {
+        return -1;
+    }
+    memcpy(&options, data, sizeof(seaside_rate));
+    if (options.unit > RATE_BPS || !isfinite(options.rate)
+        || options.rate < 0) {
+        return -1;
+    }
+
+    rate = options;
+    return 0;
+}
+
+/* Sets up a burst from the data of a SEASIDE_SEND_BURST message. Returns 0
+ * on success, and -1 if the data is invalid or there is no packet to send,
+ * in which case there is no burst. */
+static int
+set_burst(const uint8_t *data, uint32_t size)
+{
+    burst.count = 0;
+    burst.gap = 0;
+
+    if (size != sizeof(uint64_t) && size != sizeof(seaside_burst)) {
+        return -1;
+    }
+    memcpy(&burst, data, size);
+    if (burst.count == 0 || next_packet_len() == 0) {
+        burst.count = 0;
+        return -1;
+    }
+    return 0;
+}
+
+/* Replays the packets in replay_file, instead of sending packet. The file is
+ * read one packet at a time, so memory use doesn't grow with its size. Each
+ * packet is sent when it is due according to its capture timestamp,
+ * relative to the first packet of the file (so delays don't add up), unless
+ * the timing is REPLAY_MAX_RATE. Goes through the file replay.loops times,
+ * or until stopped if that is 0. */
+static void *
+replay_packets(void *unused)
+{
+    struct timespec start, deadline, offset;
+    struct pcap_pkthdr *header;
+    const u_char *data;
+    int ret = 0;
+
+    for (uint32_t loop = 0;
+         spam_packets && ret >= 0
+         && (replay.loops == 0 || loop < replay.loops);
+         ++loop) {
+        pcap_t *capture = pcap_open_offline(replay_file, errbuf);
+        if (capture == NULL) {
+            fprintf(stderr, "Could not open %s: %s\n", replay_file, errbuf);
+            break;
+        }
+
+        struct timeval first;
+        int have_first = 0;
+        clock_gettime(CLOCK_MONOTONIC, &start);
+
+        while (spam_packets && pcap_next_ex(capture, &header, &data) == 1) {
+            if (!have_first) {
+                first = header->ts;
+                have_first = 1;
+            }
+
+            if (replay.timing != REPLAY_MAX_RATE) {
+                double gap = (double) (header->ts.tv_sec - first.tv_sec)
+                             + (double) (header->ts.tv_usec - first.tv_usec)
+                               / 1000000;
+                if (replay.timing == REPLAY_SCALED) {
+                    gap *= replay.scale;
+                }
+                /* Packets captured out of order go out right away. */
+                if (gap < 0) {
+                    gap = 0;
+                }
+                offset = timespec_from_seconds(gap);
+                deadline = timespec_add(&start, &offset);
+                if (sleep_until(&deadline)) {
+                    break;
+                }
+            }
+
+            /* Back to back, the packets go out in batches. */
+            ret = tx_queue(data, header->caplen);
+            if (ret >= 0 && replay.timing != REPLAY_MAX_RATE) {
+                ret = tx_flush();
+            }
+            if (ret < 0) {
+                fprintf(stderr, "Error in tx_queue(), returned %d\n", ret);
+                printf("%s\n", pcap_geterr(handle));
+                break;
+            }
+        }
+        pcap_close(capture);
+
+        /* The file was emptied since set_replay, so looping over it again
+         * would only spin. */
+        if (!have_first) {
+            fprintf(stderr, "%s has no packets to replay.\n", replay_file);
+            break;
+        }
+    }
+    tx_flush();
+
+    if (spam_packets) {
+        printf("Replay of %s finished\n", replay_file);
+    }
+    return unused;
 }
 
 /* Sends the packet stored in packet to the socket specified in
@@ -254,7 +1346,7 @@ send_packets(void *unused)
      * if we should exit or not. */
     const long SPAM_CHECK_TIME = 500000;
 
-    struct timespec cur_time, beg_time, end_time, elapsed_time, sleep_time;
+    struct timespec cur_time, end_time, sleep_time;
     long diff;
     ssize_t ret = 0;
 
@@ -267,7 +1359,6 @@ send_packets(void *unused)
     end_time = cur_time;
 
     do {
-        clock_gettime(CLOCK_MONOTONIC, &beg_time);
         end_time = timespec_add(&end_time, &sleep_time);
 
         /* Basically a non-blocking sleep. We could just sleep the entire
@@ -301,24 +1392,102 @@ send_packets(void *unused)
         } while (diff > 0);
 
         printf(".");
+    } while (spam_packets &&
+            (ret = send_packet()) >= 0);
 
-        /* Bandwidth calculation in bits per second. */
-        clock_gettime(CLOCK_MONOTONIC, &cur_time);
-        elapsed_time = timespec_sub(&cur_time, &beg_time);
+    if (ret < 0) {
+        fprintf(stderr, "Error in send_packet(), returned %d\n", ret);
+        printf("%s\n", pcap_geterr(handle));
+    }
 
-        double d_time = elapsed_time.tv_sec
-                        + ( (double) elapsed_time.tv_nsec
-                            / NANOSECONDS_PER_SECOND );
+    return unused;
+}
 
-        pthread_mutex_lock(&bandwidth_mutex);
-        bandwidth = (packet_len * 8.0) / d_time;
-        pthread_mutex_unlock(&bandwidth_mutex);
-    } while (spam_packets &&
-            (ret = send_packet()) >= 0);
+/* Sends packet (or the sequence) at the set rate, instead of waiting the
+ * sleep time between packets. Every packet is due at an absolute time: the
+ * packets (or bits) sent so far over the rate, from when sending started.
+ * Since that doesn't depend on when the packets before it actually went out,
+ * errors in the timing of one packet don't add up over many. The thread
+ * sleeps with clock_nanosleep until just before each deadline, and polls the
+ * clock for the rest (see BUSY_POLL_NSEC). If it falls behind, it sends
+ * back to back until it has caught up, unless it fell too far behind (see
+ * MAX_RATE_LAG_NSEC). */
+static void *
+pace_packets(void *unused)
+{
+    const struct timespec max_lag = {0, MAX_RATE_LAG_NSEC};
+    struct timespec start, deadline, cur_time, lag, offset;
+    /* Packets or bits (depending on the unit) sent since start. */
+    double sent = 0;
+    ssize_t ret = 0;
+
+    if (next_packet_len() == 0) {
+        printf("Cannot send an empty packet\n");
+        return unused;
+    }
+
+    clock_gettime(CLOCK_MONOTONIC, &start);
+    deadline = start;
+
+    while (spam_packets) {
+        if (wait_until(&deadline, &cur_time)) {
+            break;
+        }
+
+        lag = timespec_sub(&cur_time, &deadline);
+        lag = timespec_sub(&lag, &max_lag);
+        if (lag.tv_sec >= 0) {
+            start = cur_time;
+            sent = 0;
+        }
+
+        size_t len = next_packet_len();
+        if ((ret = queue_packet()) < 0) {
+            break;
+        }
+        sent += rate.unit == RATE_BPS ? (double) len * 8 : 1;
 
-    pthread_mutex_lock(&bandwidth_mutex);
-    bandwidth = 0;
-    pthread_mutex_unlock(&bandwidth_mutex);
+        offset = timespec_from_seconds(sent / rate.rate);
+        deadline = timespec_add(&start, &offset);
+
+        /* If the next packet is already due, it goes out in the same batch
+         * as this one. */
+        if (timespec_sub(&deadline, &cur_time).tv_sec >= 0
+            && (ret = tx_flush()) < 0) {
+            break;
+        }
+    }
+    tx_flush();
+
+    if (ret < 0) {
+        fprintf(stderr, "Error in send_packet(), returned %zd\n", ret);
+        printf("%s\n", pcap_geterr(handle));
+    }
+
+    return unused;
+}
+
+/* Sends packet (or the sequence) as fast as the backend can, in batches,
+ * for when the sleep time is 0. */
+static void *
+flood_packets(void *unused)
+{
+    int ret = 0;
+
+    if (next_packet_len() == 0) {
+        printf("Cannot send an empty packet\n");
+        return unused;
+    }
+
+    while (spam_packets) {
+        for (int i = 0; i < TX_BATCH && ret >= 0; ++i) {
+            ret = queue_packet();
+        }
+        if (ret < 0 || (ret = tx_flush()) < 0) {
+            break;
+        }
+    }
+    tx_flush();
 
     if (ret < 0) {
         fprintf(stderr, "Error in send_packet(), returned %d\n", ret);
@@ -328,19 +1497,92 @@ send_packets(void *unused)
     return unused;
 }
 
+/* Sends the burst: burst.count packets (packet, or the sequence) back to
+ * back in batches, or each burst.gap after the one before if that is set,
+ * and then reports the result to burst_report. The packets are due at
+ * absolute times from the first one, like with pace_packets, so the gaps
+ * don't add up errors. Stops early if spam_packets is cleared. */
+static void *
+burst_packets(void *unused)
+{
+    struct timespec start, deadline, cur_time, offset, elapsed;
+    uint64_t sent = 0;
+    int ret = 0;
+
+    clock_gettime(CLOCK_MONOTONIC, &start);
+
+    while (spam_packets && sent < burst.count) {
+        if (burst.gap > 0) {
+            uint64_t due = sent * burst.gap;
+            offset.tv_sec = (time_t) (due / NANOSECONDS_PER_SECOND);
+            offset.tv_nsec = (long) (due % NANOSECONDS_PER_SECOND);
+            deadline = timespec_add(&start, &offset);
+            if (wait_until(&deadline, &cur_time)) {
+                break;
+            }
+        }
+        if ((ret = burst.gap > 0 ? send_packet() : queue_packet()) < 0) {
+            fprintf(stderr, "Error in send_packet(), returned %d\n", ret);
+            printf("%s\n", pcap_geterr(handle));
+            break;
+        }
+        ++sent;
+    }
+    tx_flush();
+
+    clock_gettime(CLOCK_MONOTONIC, &cur_time);
+    elapsed = timespec_sub(&cur_time, &start);
+    printf("Burst of [%llu] packets sent in [%ld.%09ld] seconds\n",
+           (unsigned long long) sent, (long) elapsed.tv_sec, elapsed.tv_nsec);
+
+    pthread_mutex_lock(&burst_mutex);
+    if (burst_report != NULL) {
+        burst_report->sent = sent;
+        burst_report->duration =
+            (uint64_t) elapsed.tv_sec * NANOSECONDS_PER_SECOND
+            + (uint64_t) elapsed.tv_nsec;
+        burst_report = NULL;
+        pthread_cond_broadcast(&burst_done);
+    }
+    pthread_mutex_unlock(&burst_mutex);
+
+    return unused;
+}
+
 /* Helper function to set spam_packets to 1 and spawns a new thread
- * to start sending packets. */
+ * to start sending packets: the burst if there is one, replaying
+ * replay_file if it is set, and otherwise sending packet at the rate if one
+ * is set, or with the sleep time in between (as fast as possible if it is
+ * 0). */
 static void
 start_sending(void)
 {
     if (spam_packets < 1) {
+        void *(*sender)(void *) = send_packets;
+        sending_burst = 0;
+        if (burst.count > 0) {
+            sender = burst_packets;
+            sending_burst = burst_number;
+        } else if (replay_file[0] != '\0') {
+            sender = replay_packets;
+        } else if (rate.rate > 0) {
+            sender = pace_packets;
+        } else if (sleep_time_seconds == 0 && sleep_time_useconds == 0) {
+            sender = flood_packets;
+        }
+
+        pthread_mutex_lock(&achieved_mutex);
+        clock_gettime(CLOCK_MONOTONIC, &achieved_since);
+        pthread_mutex_unlock(&achieved_mutex);
+
         (void) __sync_add_and_fetch(&spam_packets, 1);
-        pthread_create(&send_thread, NULL, send_packets, NULL);
+        pthread_create(&send_thread, NULL, sender, NULL);
     }
 }
 
 /* Helper function to set spam_packets to 0 and then waits for the sending
- * thread to join before returning. */
+ * thread to join before returning. A burst is over once it is stopped, so
+ * the next start sends continuously again. */
 static void
 stop_sending(void)
 {
@@ -348,6 +1590,290 @@ stop_sending(void)
         (void) __sync_sub_and_fetch(&spam_packets, 1);
         (void) pthread_join(send_thread, NULL);
     }
+    if (sending_burst) {
+        sending_burst = 0;
+        burst.count = 0;
+    }
+}
+
+/* Allocates a stream for reading SEASIDE messages from a UI connection.
+ * Returns NULL if out of memory. */
+static seaside_stream *
+stream_new(int fd)
+{
+    seaside_stream *stream = malloc(sizeof(seaside_stream));
+    if (stream == NULL) {
+        return NULL;
+    }
+
+    stream->buf = malloc(SEASIDE_STREAM_SIZE);
+    if (stream->buf == NULL) {
+        free(stream);
+        return NULL;
+    }
+    stream->fd = fd;
+    stream->start = 0;
+    stream->end = 0;
+    stream->capacity = SEASIDE_STREAM_SIZE;
+    return stream;
+}
+
+static void
+stream_free(seaside_stream *stream)
+{
+    free(stream->buf);
+    free(stream);
+}
+
+/* Receives more bytes into the stream's buffer until at least size unparsed
+ * bytes are in it, moving the unparsed bytes to the front of the buffer first
+ * if they wouldn't fit otherwise, and growing the buffer if they still won't.
+ * A single recv may pull in several messages, which are then parsed without
+ * any more system calls. Returns 0 on success, and -1 if the connection was
+ * closed or broken before then. */
+static int
+stream_fill(seaside_stream *stream, size_t size)
+{
+    if (stream->end - stream->start >= size) {
+        return 0;
+    }
+
+    if (stream->start + size > stream->capacity) {
+        memmove(stream->buf, stream->buf + stream->start,
+                stream->end - stream->start);
+        stream->end -= stream->start;
+        stream->start = 0;
+    }
+
+    if (size > stream->capacity) {
+        uint8_t *buf = realloc(stream->buf, size);
+        if (buf == NULL) {
+            fprintf(stderr, "Could not grow SEASIDE stream to %zu bytes.\n",
+                    size);
+            return -1;
+        }
+        stream->buf = buf;
+        stream->capacity = size;
+    }
+
+    while (stream->end - stream->start < size) {
+        ssize_t ret = recv(stream->fd, stream->buf + stream->end,
+                           stream->capacity - stream->end, 0);
+        if (ret < 0) {
+            if (errno == EINTR || errno == EAGAIN) {
+                continue;
+            }
+            perror("Stream fill error: ");
+            return -1;
+        } else if (ret == 0) {
+            return -1;
+        }
+        stream->end += (size_t) ret;
+    }
+    return 0;
+}
+
+/* Parses the next SEASIDE message out of the stream, receiving more of it if
+ * it hasn't all arrived yet. Messages are length-delimited by the size in
+ * their header, so any number of them can be sent in one write. The header
+ * (extended size and request ID included) is parsed into message, and
+ * message->data points straight into the stream's buffer, so it is only
+ * valid until the next call. Returns 0 on success, and -1 once the
+ * connection is closed, or if the message is bigger than SEASIDE_MAX_SIZE. */
+static int
+read_seaside(seaside_stream *stream, SEASIDE *message)
+{
+    size_t header_len = SEASIDE_HEADER_SIZE;
+    uint16_t short_size;
+    uint8_t *header;
+
+    if (stream_fill(stream, SEASIDE_HEADER_SIZE)) {
+        return -1;
+    }
+    header = stream->buf + stream->start;
+
+    /* WARNING: If you ever change the layout or order of the SEASIDE
+     * struct, be sure to change this copying bit, too. */
+    message->type = (uint8_t) (header[0] & ~SEASIDE_TAGGED);
+    message->tagged = (uint8_t) (header[0] & SEASIDE_TAGGED);
+    memcpy(&short_size, header + 1, sizeof(uint16_t));
+    message->size = short_size;
+    message->id = 0;
+
+    if (short_size == SEASIDE_EXTENDED) {
+        header_len += sizeof(uint32_t);
+    }
+    if (message->tagged) {
+        header_len += sizeof(uint32_t);
+    }
+
+    /* Filling may move the buffer around, so find the header again. */
+    if (stream_fill(stream, header_len)) {
+        return -1;
+    }
+    header = stream->buf + stream->start;
+
+    if (short_size == SEASIDE_EXTENDED) {
+        memcpy(&message->size, header + SEASIDE_HEADER_SIZE,
+               sizeof(uint32_t));
+        if (message->size > SEASIDE_MAX_SIZE) {
+            fprintf(stderr, "SEASIDE message of %u bytes is too big.\n",
+                    message->size);
+            return -1;
+        }
+    }
+
+    if (stream_fill(stream, header_len + message->size)) {
+        return -1;
+    }
+    header = stream->buf + stream->start;
+
+    if (message->tagged) {
+        memcpy(&message->id, header + header_len - sizeof(uint32_t),
+               sizeof(uint32_t));
+    }
+    message->data = header + header_len;
+
+    stream->start += header_len + message->size;
+    return 0;
+}
+
+/* Reads the transmit counters, and works out the achieved rate from the
+ * buckets of the last second, or of the time since sending started if that
+ * is shorter. Buckets older than that are left to be reused. */
+static void
+get_tx_stats(seaside_tx_stats *stats)
+{
+    struct timespec now;
+    uint64_t packets = 0;
+    uint64_t bytes = 0;
+
+    stats->packets = __sync_add_and_fetch(&num_packets_sent, 0);
+    stats->bytes = __sync_add_and_fetch(&num_bytes_sent, 0);
+    stats->errors = __sync_add_and_fetch(&num_send_errors, 0);
+    stats->retries = __sync_add_and_fetch(&num_send_retries, 0);
+
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    uint64_t now_nsec = (uint64_t) now.tv_sec * NANOSECONDS_PER_SECOND
+                        + (uint64_t) now.tv_nsec;
+    uint64_t number = now_nsec / ACHIEVED_BUCKET_NSEC;
+    uint64_t window_start = (number - (ACHIEVED_BUCKETS - 1))
+                            * ACHIEVED_BUCKET_NSEC;
+
+    pthread_mutex_lock(&achieved_mutex);
+    for (int i = 0; i < ACHIEVED_BUCKETS; ++i) {
+        if (number - achieved[i].number < ACHIEVED_BUCKETS) {
+            packets += achieved[i].packets;
+            bytes += achieved[i].bytes;
+        }
+    }
+    uint64_t since = (uint64_t) achieved_since.tv_sec * NANOSECONDS_PER_SECOND
+                     + (uint64_t) achieved_since.tv_nsec;
+    pthread_mutex_unlock(&achieved_mutex);
+
+    if (since > window_start) {
+        window_start = since;
+    }
+    stats->pps = 0;
+    stats->bps = 0;
+    if (now_nsec > window_start) {
+        double d_time = (double) (now_nsec - window_start)
+                        / NANOSECONDS_PER_SECOND;
+        stats->pps = (uint64_t) ((double) packets / d_time);
+        stats->bps = (uint64_t) ((double) bytes * 8 / d_time);
+    }
+}
+
+/* Pushes the current statistics to a subscribed UI connection. */
+static void
+send_stats(int ui_fd)
+{
+    seaside_stats stats;
+    seaside_tx_stats tx_stats;
+    struct timespec now;
+
+    get_tx_stats(&tx_stats);
+
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    stats.timestamp = (uint64_t) now.tv_sec * NANOSECONDS_PER_SECOND
+                      + (uint64_t) now.tv_nsec;
+    stats.bandwidth = tx_stats.bps;
+    stats.packets = tx_stats.packets;
+
+    send_message(ui_fd, SEASIDE_STATS, NULL, &stats, sizeof(stats));
+}
+
+/* Waits until the next SEASIDE message can be read from the stream. If the
+ * connection has subscribed to statistics (interval is non-zero), pushes
+ * them every interval in the meantime, with next_stats holding the deadline
+ * of the next push. Returns 0 once a message can be read, and -1 on error. */
+static int
+wait_for_message(seaside_stream *stream, const struct timespec *interval,
+                 struct timespec *next_stats)
+{
+    struct pollfd ui_poll;
+    ui_poll.fd = stream->fd;
+    ui_poll.events = POLLIN;
+
+    /* If part of a message is already buffered, the rest is on its way, so
+     * there is no need to wait for it here. */
+    while ((interval->tv_sec || interval->tv_nsec)
+           && stream->start == stream->end) {
+        struct timespec now, left;
+        int timeout = 0;
+
+        clock_gettime(CLOCK_MONOTONIC, &now);
+        left = timespec_sub(next_stats, &now);
+        if (left.tv_sec >= 0) {
+            timeout = (int) (left.tv_sec * 1000
+                             + (left.tv_nsec + 999999) / 1000000);
+        }
+
+        int ret = poll(&ui_poll, 1, timeout);
+        if (ret > 0) {
+            return 0;
+        } else if (ret < 0) {
+            if (errno == EINTR) {
+                continue;
+            }
+            perror("poll() failed: ");
+            return -1;
+        }
+
+        send_stats(stream->fd);
+
+        /* Push on a fixed schedule, but if we fell behind, skip the missed
+         * pushes instead of sending a burst of them. */
+        *next_stats = timespec_add(next_stats, interval);
+        if (timespec_sub(next_stats, &now).tv_sec < 0) {
+            *next_stats = timespec_add(&now, interval);
+        }
+    }
+    return 0;
+}
+
+/* Subscribes a connection to statistics pushes, with the interval in
+ * milliseconds taken from the message's data. An interval of 0 (or no data)
+ * unsubscribes it. */
+static void
+subscribe_stats(const SEASIDE *message, struct timespec *interval,
+                struct timespec *next_stats)
+{
+    uint32_t interval_ms = 0;
+
+    if (message->size >= sizeof(uint32_t)) {
+        memcpy(&interval_ms, message->data, sizeof(uint32_t));
+    }
+    if (interval_ms != 0 && interval_ms < MIN_STATS_INTERVAL) {
+        interval_ms = MIN_STATS_INTERVAL;
+    }
+
+    interval->tv_sec = interval_ms / 1000;
+    interval->tv_nsec = (long) (interval_ms % 1000) * 1000000;
+
+    clock_gettime(CLOCK_MONOTONIC, next_stats);
+    *next_stats = timespec_add(next_stats, interval);
+    printf("Statistics interval: [%u] ms\n", interval_ms);
 }
 
 /* Listens to the Unix socket for the packet that we should be sending to the
@@ -356,43 +1882,60 @@ stop_sending(void)
 static void *
 listen_packet_info(void *ui_fd_temp)
 {
-    /* Temporary variables to store any received data, before moving it
-     * to the global scope. */
-    uint8_t packet_temp[UI_BUFFER_SIZE];
-    ssize_t packet_len_temp;
-
+    /* The descriptor was allocated by accept_connections, so that it
+     * couldn't be overwritten by the next connection before we read it. */
     int ui_fd = *(int *) ui_fd_temp;
+    free(ui_fd_temp);
+
+    /* Any received data stays in the stream's buffer until it is parsed
+     * and moved to the global scope. */
+    seaside_stream *stream = stream_new(ui_fd);
+    if (stream == NULL) {
+        fprintf(stderr, "Could not allocate a SEASIDE stream.\n");
+        close(ui_fd);
+        return (void *) NULL;
+    }
+
+    /* How often to push statistics to this connection (zero if it hasn't
+     * subscribed), and when the next push is due. */
+    struct timespec stats_interval = {0, 0};
+    struct timespec next_stats = {0, 0};
+
     while (1) {
-        packet_len_temp = recv(ui_fd, packet_temp, UI_BUFFER_SIZE, 0);
+        SEASIDE seaside_header;
 
-        /* EOF signal received, will close socket in orderly manner. */
-        if (packet_len_temp == 0) {
+        /* The number of the burst this connection asked for, if it did,
+         * and where its result goes once it is over. */
+        unsigned long awaiting_burst = 0;
+        seaside_burst_result burst_result;
+
+        seaside_tx_stats tx_stats;
+
+        /* The connection was closed, will close socket in orderly manner. */
+        if (wait_for_message(stream, &stats_interval, &next_stats)
+            || read_seaside(stream, &seaside_header)) {
+            stream_free(stream);
             close(ui_fd);
             return (void *) NULL;
         }
 
-        SEASIDE seaside_header;
-
-        /* WARNING: If you ever change the layout or order of the SEASIDE
-         * struct, be sure to change this copying bit, too. */
-        memcpy(&seaside_header.type, packet_temp, sizeof(uint8_t));
-        memcpy(&seaside_header.size, (packet_temp + 1), sizeof(uint16_t));
-        seaside_header.data = packet_temp + 3;
-
-        printf("Type: [%d], size: [%d]\n",
+        printf("Type: [%d], size: [%u]\n",
             seaside_header.type, seaside_header.size);
-        for (int i = 0; i < packet_len_temp; ++i) {
-            printf("%i ", packet_temp[i]);
+        uint32_t log_bytes = MIN(seaside_header.size, LOG_DATA_BYTES);
+        for (uint32_t i = 0; i < log_bytes; ++i) {
+            printf("%i ", seaside_header.data[i]);
         }
-        printf("\n");
+        printf(seaside_header.size > LOG_DATA_BYTES ? "...\n" : "\n");
 
         pthread_mutex_lock(&packet_mutex);
 
         /* A state variable, to remember if we were sending before we
          * stopped. After we parse the SEASIDE packet, we continue
          * sending if we were already sending before (or a start
-         * flag was sent). */
-        unsigned int should_continue_sending = spam_packets;
+         * flag was sent). A burst that gets stopped is over, so it
+         * doesn't count as sending, or its count would be lost and the
+         * sending would go on forever. */
+        unsigned int should_continue_sending = spam_packets && !sending_burst;
 
         /* WARNING: If more flags are added, make sure that any flags
          * that directly deal with the sending thread (and should kill
@@ -404,6 +1947,13 @@ listen_packet_info(void *ui_fd_temp)
         case SEASIDE_STOP:
         case SEASIDE_SLEEP_TIME:
         case SEASIDE_SINGLE_PACKET:
+        case SEASIDE_START_SEQUENCE:
+        case SEASIDE_STOP_SEQUENCE:
+        case SEASIDE_SET_MUTATORS:
+        case SEASIDE_START_REPLAY:
+        case SEASIDE_STOP_REPLAY:
+        case SEASIDE_SET_RATE:
+        case SEASIDE_SEND_BURST:
             stop_sending();
         break;
 
@@ -415,8 +1965,15 @@ listen_packet_info(void *ui_fd_temp)
 
         /* An Ethernet frame was received. Update our packet to reflect it. */
         case SEASIDE_PACKET:
+            if (seaside_header.size > MAX_PACKET_SIZE) {
+                fprintf(stderr, "Packet of %u bytes is too big, ignoring "
+                        "it.\n", seaside_header.size);
+                break;
+            }
             memcpy(packet, seaside_header.data, seaside_header.size);
             packet_len = seaside_header.size;
+            /* The mutators were for the old packet. */
+            num_mutators = 0;
             break;
 
         /* We should start sending, if not already sending. */
@@ -437,11 +1994,15 @@ listen_packet_info(void *ui_fd_temp)
             memcpy(&sleep_time_useconds, seaside_header.data + 1, sizeof(int32_t));
             printf("Seconds: [%d], USeconds: [%d]\n",
                 sleep_time_seconds, sleep_time_useconds);
+            /* Waiting the sleep time replaces sending at a rate. */
+            rate.rate = 0;
             break;
 
-        /* Return the number of received packets. */
+        /* Return the number of packets sent since startup. */
         case SEASIDE_NUM_PACKETS:
-            /* TODO: Implement. */
+            get_tx_stats(&tx_stats);
+            send_response(ui_fd, &seaside_header, &tx_stats.packets,
+                          sizeof(tx_stats.packets));
             break;
 
         /* Send a single packet. */
@@ -451,22 +2012,105 @@ listen_packet_info(void *ui_fd_temp)
 
         /* Return the current packet. */
         case SEASIDE_GET_PACKET:
-            send_response(ui_fd, packet, packet_len);
+            send_response(ui_fd, &seaside_header, packet, packet_len);
             break;
 
-        /* Return the bandwidth calculated. */
+        /* Return the bandwidth achieved over the last second. */
         case SEASIDE_GET_BANDWIDTH:
-            pthread_mutex_lock(&bandwidth_mutex);
-            send_response(ui_fd, &bandwidth, sizeof(bandwidth));
-            pthread_mutex_unlock(&bandwidth_mutex);
+            get_tx_stats(&tx_stats);
+            send_response(ui_fd, &seaside_header, &tx_stats.bps,
+                          sizeof(tx_stats.bps));
             break;
 
         /* Return the size of the current packet. */
         case SEASIDE_GET_PACKET_SIZE:
-            send_response(ui_fd, &packet_len, sizeof(packet_len));
+            send_response(ui_fd, &seaside_header, &packet_len,
+                          sizeof(packet_len));
             printf("Send packet size\n");
             break;
 
+        /* Cycle through a sequence of packets, instead of sending the same
+         * one over and over. */
+        case SEASIDE_START_SEQUENCE:
+            if (set_sequence(seaside_header.data, seaside_header.size)) {
+                fprintf(stderr, "Malformed packet sequence, ignoring it.\n");
+            } else {
+                printf("Sequence of [%zu] packets\n", sequence_len);
+            }
+            break;
+
+        /* Go back to sending the single packet. */
+        case SEASIDE_STOP_SEQUENCE:
+            sequence_len = 0;
+            sequence_next = 0;
+            break;
+
+        /* Vary fields of the packet every time it is sent. */
+        case SEASIDE_SET_MUTATORS:
+            if (set_mutators(seaside_header.data, seaside_header.size)) {
+                fprintf(stderr, "Invalid field mutators, removed them.\n");
+            } else {
+                printf("[%zu] field mutators\n", num_mutators);
+            }
+            break;
+
+        /* Replay a capture file instead of sending packet, starting right
+         * away. Once it is done, SEASIDE_START replays it again. */
+        case SEASIDE_START_REPLAY:
+            if (set_replay(seaside_header.data, seaside_header.size)) {
+                fprintf(stderr, "Invalid replay, ignoring it.\n");
+            } else {
+                printf("Replaying %s\n", replay_file);
+                should_continue_sending = 1;
+            }
+            break;
+
+        /* Stop the replay, and go back to sending packet on the next
+         * SEASIDE_START. */
+        case SEASIDE_STOP_REPLAY:
+            replay_file[0] = '\0';
+            should_continue_sending = 0;
+            break;
+
+        /* Send at a rate in packets or bits per second, instead of waiting
+         * the sleep time between packets. */
+        case SEASIDE_SET_RATE:
+            if (set_rate(seaside_header.data, seaside_header.size)) {
+                fprintf(stderr, "Invalid rate, ignoring it.\n");
+            } else {
+                printf("Rate: [%f] %s\n", rate.rate,
+                       rate.unit == RATE_BPS ? "bits/s" : "packets/s");
+            }
+            break;
+
+        /* Send a fixed number of packets, and then stop. The response is
+         * sent once they have all been sent, below. */
+        case SEASIDE_SEND_BURST:
+            if (set_burst(seaside_header.data, seaside_header.size)) {
+                fprintf(stderr, "Invalid burst, ignoring it.\n");
+                send_response(ui_fd, &seaside_header, NULL, 0);
+            } else {
+                printf("Burst of [%llu] packets\n",
+                       (unsigned long long) burst.count);
+                awaiting_burst = ++burst_number;
+                burst_report = &burst_result;
+                should_continue_sending = 0;
+                start_sending();
+            }
+            break;
+
+        /* Return all of the transmit counters at once. */
+        case SEASIDE_GET_TX_STATS:
+            get_tx_stats(&tx_stats);
+            send_response(ui_fd, &seaside_header, &tx_stats,
+                          sizeof(tx_stats));
+            break;
+
+        /* Push statistics to this connection every so often. */
+        case SEASIDE_SUBSCRIBE_STATS:
+            subscribe_stats(&seaside_header, &stats_interval, &next_stats);
+            break;
+
         default:
             fprintf(stderr, "Invalid SEASIDE flag received.\n");
             break;
@@ -482,6 +2126,13 @@ listen_packet_info(void *ui_fd_temp)
         case SEASIDE_STOP:
         case SEASIDE_SLEEP_TIME:
         case SEASIDE_SINGLE_PACKET:
+        case SEASIDE_START_SEQUENCE:
+        case SEASIDE_STOP_SEQUENCE:
+        case SEASIDE_SET_MUTATORS:
+        case SEASIDE_START_REPLAY:
+        case SEASIDE_STOP_REPLAY:
+        case SEASIDE_SET_RATE:
+        case SEASIDE_SEND_BURST:
             if (should_continue_sending) {
                 start_sending();
             }
@@ -492,6 +2143,26 @@ listen_packet_info(void *ui_fd_temp)
         }
 
         pthread_mutex_unlock(&packet_mutex);
+
+        /* Wait for the burst to be over before responding, without holding
+         * packet_mutex, so that another connection can still stop it. Then
+         * stop the sending thread, unless something else was started since. */
+        if (awaiting_burst) {
+            pthread_mutex_lock(&burst_mutex);
+            while (burst_report == &burst_result) {
+                pthread_cond_wait(&burst_done, &burst_mutex);
+            }
+            pthread_mutex_unlock(&burst_mutex);
+
+            pthread_mutex_lock(&packet_mutex);
+            if (sending_burst == awaiting_burst) {
+                stop_sending();
+            }
+            pthread_mutex_unlock(&packet_mutex);
+
+            send_response(ui_fd, &seaside_header, &burst_result,
+                          sizeof(burst_result));
+        }
     }
     fprintf(stderr, "Error in listen_packet_info().\n");
 
@@ -511,8 +2182,25 @@ accept_connections(void)
             return -1;
         }
 
+        /* Each connection thread gets its own copy of the descriptor, and
+         * is detached, since nothing ever joins it. */
+        int *ui_fd_copy = malloc(sizeof(int));
+        if (ui_fd_copy == NULL) {
+            fprintf(stderr, "Could not allocate a connection.\n");
+            close(ui_fd);
+            continue;
+        }
+        *ui_fd_copy = ui_fd;
+
         pthread_t ui_thread;
-        pthread_create(&ui_thread, NULL, listen_packet_info, (void *) &ui_fd);
+        if (pthread_create(&ui_thread, NULL, listen_packet_info,
+                           (void *) ui_fd_copy)) {
+            fprintf(stderr, "Could not create a connection thread.\n");
+            free(ui_fd_copy);
+            close(ui_fd);
+            continue;
+        }
+        pthread_detach(ui_thread);
     }
 
     return -1;
@@ -538,11 +2226,47 @@ lock_single_instance_file(void)
     return 0;
 }
 
+/* Prints how to run this program. */
+static void
+usage(const char *name)
+{
+    fprintf(stderr, "Usage: %s [-i interface] [-b pcap|mmsg|ring]\n"
+            "  -i  the interface to send on (default %s)\n"
+            "  -b  how to send packets: pcap_inject, one at a time "
+            "(default), or in\n"
+            "      batches with sendmmsg or a PACKET_TX_RING\n",
+            name, DEVICE);
+}
+
 /* Initializes pcap and the socket, and then sends the packet that was
  * received from the UI program. */
 int
-main(void)
+main(int argc, char **argv)
 {
+    int opt;
+    while ((opt = getopt(argc, argv, "i:b:h")) != -1) {
+        switch (opt) {
+        case 'i':
+            device = optarg;
+            break;
+        case 'b':
+            if (strcmp(optarg, "pcap") == 0) {
+                backend = BACKEND_PCAP;
+            } else if (strcmp(optarg, "mmsg") == 0) {
+                backend = BACKEND_MMSG;
+            } else if (strcmp(optarg, "ring") == 0) {
+                backend = BACKEND_RING;
+            } else {
+                usage(argv[0]);
+                return -1;
+            }
+            break;
+        default:
+            usage(argv[0]);
+            return -1;
+        }
+    }
+
     if (lock_single_instance_file()) {
         printf("Error in lock_single_instance_file().\n");
         return -1;
@@ -552,6 +2276,7 @@ main(void)
         printf("Error in initialize_pcap().\n");
         return -1;
     }
+    initialize_backend();
 
     if (initialize_socket()) {
         printf("Error in initialize_socket().\n");
@@ -0,0 +1,104 @@
+"""Benchmarks send.c's backends against each other on a veth pair.
+
+For each backend (pcap_inject, sendmmsg and the PACKET_TX_RING, see the -b
+option of send.c), starts the C-side on one end of a veth pair, has it send a
+burst of minimum size frames back to back, and prints the packets per second
+it sent them at, along with how many arrived on the other end. veth has no
+line rate of its own, so this measures what each backend costs per packet.
+
+Needs root, to create the veth pair and send on it. Run from the project
+root, with the path of the compiled send program:
+
+sudo python -m sender_files.python_files.benchmark_backends \
+    sender_files/c_files/send
+"""
+import argparse
+import os
+import socket
+import subprocess
+import time
+
+from shared_files import SEASIDE
+
+BACKENDS = ('pcap', 'mmsg', 'ring')
+VETH = ('bench0', 'bench1')
+SEND_SOCKET = '/tmp/send_socket'
+
+# A 60 byte frame is 64 bytes on the wire, the minimum, with the FCS.
+FRAME = ('\xff' * 6 + '\x02\x00\x00\x00\x00\x01' + '\x88\xb5'
+         + '\x00' * 46)
+
+
+def rx_packets(interface):
+    with open('/sys/class/net/%s/statistics/rx_packets' % interface) as f:
+        return int(f.read())
+
+
+def connect(timeout=5):
+    """Connects to the C-side once it is listening."""
+    deadline = time.time() + timeout
+    while True:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(SEND_SOCKET)
+            return SEASIDE.SEASIDE_Client(sock)
+        except socket.error:
+            sock.close()
+            if time.time() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def run(send, backend, count):
+    """Sends count frames through a backend.
+
+    Returns:
+        tuple (float, int): The packets per second they were sent at, and
+        how many arrived on the other end.
+    """
+    process = subprocess.Popen([send, '-i', VETH[0], '-b', backend],
+                               stdout=open(os.devnull, 'w'))
+    try:
+        client = connect()
+        client.send(SEASIDE.SEASIDE_FLAGS.PACKET.value, FRAME)
+        # Once to warm up, then for real.
+        client.send_burst(count // 10)
+        received = rx_packets(VETH[1])
+        result = client.send_burst(count)
+        time.sleep(0.2)
+        received = rx_packets(VETH[1]) - received
+        client.close()
+    finally:
+        process.terminate()
+        process.wait()
+    return result.sent / (result.duration / 1e9), received
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('send', help='the compiled send program')
+    parser.add_argument('--count', type=int, default=2000000,
+                        help='frames to send through each backend')
+    args = parser.parse_args()
+
+    subprocess.check_call(['ip', 'link', 'add', VETH[0], 'type', 'veth',
+                           'peer', 'name', VETH[1]])
+    try:
+        for interface in VETH:
+            subprocess.check_call(['ip', 'link', 'set', interface, 'up'])
+        time.sleep(1)
+
+        print '%8s %14s %14s %9s' % ('backend', 'sent (pps)', 'received',
+                                     'speedup')
+        baseline = None
+        for backend in BACKENDS:
+            pps, received = run(args.send, backend, args.count)
+            baseline = baseline or pps
+            print '%8s %14.0f %14d %8.1fx' % (backend, pps, received,
+                                              pps / baseline)
+    finally:
+        subprocess.call(['ip', 'link', 'del', VETH[0]])
+
+
+if __name__ == '__main__':
+    main()
@@ -4,7 +4,7 @@ Uses the LCD_Input_Wrapper class to interact with the user. All functions
 that use the screen directly require a lock object so that only one function
 can write to the screen at a time; otherwise garbage may result.
 
-configure_delay: gets the delay between packets from the user.
+configure_delay: gets the delay between packets, or their rate, from the user.
 configure_layer: gets the field values for a layer from the user.
 configure_packet: handles the creation of a scapy packet using the LCD screen.
 generate_packet: constructs the packet layer by layer.
@@ -18,29 +18,52 @@ import time
 import scapy.all as scapy
 from shared_files import conversions
 from shared_files import computations
+from shared_files import SEASIDE
+from shared_files.SEASIDE import SEASIDE_FLAGS
 import dictionaries as dicts
 import data_sanitization as ds
 
 
 def configure_delay(lcd, lcd_lock):
-    """Configures the delay in seconds between packets to be sent.
+    """Configures how fast packets are sent: either the delay in seconds
+    between them, or a rate in packets or bits per second, which the C side
+    keeps to more precisely.
 
     Args:
         lcd (LCD_Input_Wrapper object): the lcd screen to interact with
         lcd_lock(RLock object): the lock associated with the screen
 
     Returns:
-        tuple (int, int): the chosen delay in seconds and microseconds.
+        tuple (int, str): the SEASIDE flag and data to send to the C side to
+        set it.
     """
     with lcd_lock:
-        delay = lcd.get_input('Delay:\n%i%i%i.%i%i%i%i',
-                              '%08.4f' % float(dicts.DEFAULTS['Other']
-                                                             ['delay']))
-    delay = float(delay[7:])
+        mode = lcd.get_input(['Delay', 'Packets/s', 'Bits/s'])
+        if mode == 0:
+            delay = lcd.get_input('Delay:\n%i%i%i.%i%i%i%i',
+                                  '%08.4f' % float(dicts.DEFAULTS['Other']
+                                                                 ['delay']))
+        elif mode == 1:
+            pps = lcd.get_input('Packets/s:\n%i%i%i%i%i%i%i',
+                                '%07d' % int(dicts.DEFAULTS['Other']['pps']))
+        else:
+            bps = lcd.get_input('Bits/s:\n%i%i%i%i%i%i%i%i%i',
+                                '%09d' % int(dicts.DEFAULTS['Other']['bps']))
+
+    if mode == 1:
+        return (SEASIDE_FLAGS.SET_RATE.value,
+                SEASIDE.pack_SEASIDE_rate(int(pps.split('\n')[1]),
+                                          SEASIDE.RATE_UNIT.PPS))
+    elif mode == 2:
+        return (SEASIDE_FLAGS.SET_RATE.value,
+                SEASIDE.pack_SEASIDE_rate(int(bps.split('\n')[1]),
+                                          SEASIDE.RATE_UNIT.BPS))
 
+    delay = float(delay[7:])
     delay_seconds = int(delay)
     delay_useconds = (delay * 1000000 - delay_seconds * 1000000)
-    return (delay_seconds, delay_useconds)
+    return (SEASIDE_FLAGS.DELAY.value,
+            conversions.convert_delay_bytes(delay_seconds, delay_useconds))
 
 
 def configure_layer(lcd, lcd_lock, layer):
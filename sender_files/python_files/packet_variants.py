@@ -0,0 +1,363 @@
+"""Generates many variants of a packet at once, without scapy.
+
+Building thousands of packets through scapy takes seconds per thousand on a
+Pi. Instead, a template packet is rendered to bytes once, the offsets of its
+interesting fields are found, and N variants are made as the rows of a 2-D
+uint8 NumPy array by patching whole columns at a time. The IPv4 header
+checksum and the UDP/TCP checksum are then fixed up with vectorized one's
+complement sums, only touching the words that were patched.
+
+Example:
+    variants = generate_variants(str(packet), 60000,
+                                 dport=sweep(1024, 60000))
+    c_client.send(SEASIDE_FLAGS.START_SEQUENCE.value,
+                  variants_to_sequence(variants))
+
+FIELDS: the names of the fields that can be patched.
+find_offsets: finds the offsets of the fields in a frame.
+sweep: makes an array of values counting up, e.g. ports or IP addresses.
+field_mutator: makes a SEASIDE field mutator that does a sweep on the C-side.
+generate_variants: makes the variants of a frame.
+variants_to_sequence: packs variants into the data of a START_SEQUENCE.
+write_pcap: writes variants to a pcap file.
+"""
+import socket
+import struct
+
+import numpy as np
+
+ETH_HEADER_SIZE = 14
+ETHERTYPE_VLAN = (0x8100, 0x88a8)
+ETHERTYPE_IPV4 = 0x0800
+PROTO_TCP = 6
+PROTO_UDP = 17
+
+# The fields that generate_variants can patch: IP source and destination
+# address, L4 source and destination port, the VLAN ID of the outermost
+# 802.1Q tag, and a 4-byte counter in the payload.
+FIELDS = ('src', 'dst', 'sport', 'dport', 'vlan', 'counter')
+
+# The offsets of each field's value, relative to the start of its header,
+# along with its size in bytes.
+_IP_FIELDS = {'src': (12, 4), 'dst': (16, 4)}
+_L4_FIELDS = {'sport': (0, 2), 'dport': (2, 2)}
+
+# The offset of the checksum in the UDP and TCP headers.
+_L4_CHECKSUM = {PROTO_UDP: 6, PROTO_TCP: 16}
+
+# A pcap global header (microsecond timestamps, Ethernet), and the header
+# that goes before every record.
+_PCAP_GLOBAL_HEADER = struct.Struct('=IHHiIII')
+_PCAP_RECORD = np.dtype([('sec', '=u4'), ('usec', '=u4'), ('caplen', '=u4'),
+                         ('len', '=u4')])
+
+
+def find_offsets(frame):
+    """Finds where the fields of an Ethernet frame are.
+
+    Args:
+        frame (str): the raw bytes of the frame.
+
+    Returns:
+        dict: The offsets in the frame of 'vlan' (the outermost tag's TCI),
+        'ip' (the IPv4 header), 'l4' (the UDP or TCP header) and 'payload',
+        along with 'proto' (the IP protocol) and 'ip_end' (the end of the IP
+        packet, before any Ethernet padding). Whatever the frame doesn't have
+        is None.
+    """
+    offsets = dict.fromkeys(('vlan', 'ip', 'l4', 'payload', 'proto',
+                             'ip_end'))
+    pos = ETH_HEADER_SIZE - 2
+    if len(frame) < ETH_HEADER_SIZE:
+        return offsets
+    ethertype = struct.unpack_from('!H', frame, pos)[0]
+    while ethertype in ETHERTYPE_VLAN and len(frame) >= pos + 6:
+        if offsets['vlan'] is None:
+            offsets['vlan'] = pos + 2
+        pos += 4
+        ethertype = struct.unpack_from('!H', frame, pos)[0]
+    pos += 2
+    if ethertype != ETHERTYPE_IPV4 or len(frame) < pos + 20:
+        offsets['payload'] = pos
+        return offsets
+
+    offsets['ip'] = pos
+    ihl = (ord(frame[pos]) & 0x0F) * 4
+    total_length = struct.unpack_from('!H', frame, pos + 2)[0]
+    offsets['proto'] = ord(frame[pos + 9])
+    offsets['ip_end'] = min(pos + total_length, len(frame))
+    l4 = pos + ihl
+    offsets['payload'] = l4
+    if offsets['proto'] == PROTO_UDP and offsets['ip_end'] >= l4 + 8:
+        offsets['l4'] = l4
+        offsets['payload'] = l4 + 8
+    elif offsets['proto'] == PROTO_TCP and offsets['ip_end'] >= l4 + 20:
+        offsets['l4'] = l4
+        offsets['payload'] = l4 + (ord(frame[l4 + 12]) >> 4) * 4
+    return offsets
+
+
+def sweep(start, count, step=1):
+    """Makes an array of count values counting up from start.
+
+    Args:
+        start (int or str): the first value, e.g. a port, or an IPv4 address
+                            like '10.0.24.1'.
+        count (int): how many values to make.
+        step (int): how much to count up by.
+
+    Returns:
+        ndarray: The values, as ints (addresses as 32-bit ints). They aren't
+        wrapped around, so generate_variants can tell if they overflow.
+    """
+    if isinstance(start, basestring) and '.' in start:
+        start = struct.unpack('!I', socket.inet_aton(start))[0]
+    return np.arange(count, dtype=np.uint64) * step + int(start)
+
+
+def field_mutator(frame, name, start, count, step=1):
+    """Makes a field mutator that sweeps a field on the C-side instead.
+
+    Rather than sending the C-side every variant, it is sent the frame and
+    the mutator, and changes the field itself after every packet it sends,
+    so there's no limit on how many variants there are.
+
+    Args:
+        frame (str): the raw bytes of the frame the C-side will send.
+        name (str): the field to sweep, see FIELDS.
+        start (int or str): the first value, see sweep.
+        count (int): the number of values to go through before wrapping
+                     around to start again.
+        step (int): how much to count up by after every packet.
+
+    Returns:
+        tuple: (offset, width, step, min, max), see
+        SEASIDE.pack_SEASIDE_mutators.
+
+    Raises:
+        ValueError: if the frame doesn't have the field, count or step is
+                    less than 1, or the values don't fit in the field.
+    """
+    if count < 1 or step < 1:
+        raise ValueError('The count and step must be at least 1, not %d and '
+                         '%d' % (count, step))
+    offsets = find_offsets(frame)
+    if name in _IP_FIELDS and offsets['ip'] is not None:
+        offset, size = _IP_FIELDS[name]
+        offset += offsets['ip']
+    elif name in _L4_FIELDS and offsets['l4'] is not None:
+        offset, size = _L4_FIELDS[name]
+        offset += offsets['l4']
+    elif name == 'vlan' and offsets['vlan'] is not None:
+        offset, size = offsets['vlan'], 2
+    elif name == 'counter' and offsets['payload'] + 4 <= len(frame):
+        offset, size = offsets['payload'], 4
+    else:
+        raise ValueError('The frame has no %s field to mutate' % name)
+
+    first = int(sweep(start, 1)[0])
+    last = first + (count - 1) * step
+    if name == 'vlan':
+        # The VLAN ID shares its two bytes with the priority and DEI bits, so
+        # keep the template's and make sure the ID doesn't overflow into them.
+        if last > 0x0FFF:
+            raise ValueError('%d VLAN IDs from %s, %d apart, overflow 4095'
+                             % (count, start, step))
+        priority = struct.unpack_from('!H', frame, offset)[0] & 0xF000
+        first, last = priority | first, priority | last
+    elif last >= 1 << (8 * size):
+        raise ValueError('%d values from %s, %d apart, overflow the %s field'
+                         % (count, start, step, name))
+    # The C-side wraps around modulo max - min + 1, so a max of step - 1
+    # past the last value brings it back to first after count values. It is
+    # never reached itself.
+    return (offset, size, step, first, min(last + step - 1, 0xFFFFFFFF))
+
+
+def _words(array, start, end):
+    """Returns the big-endian 16-bit words of array[..., start:end] as
+    uint64, padding an odd number of bytes with a zero."""
+    chunk = array[..., start:end].astype(np.uint64)
+    if (end - start) % 2:
+        pad = np.zeros(chunk.shape[:-1] + (1,), dtype=np.uint64)
+        chunk = np.concatenate([chunk, pad], axis=-1)
+    return (chunk[..., 0::2] << 8) | chunk[..., 1::2]
+
+
+def _fold(sums):
+    """Folds one's complement sums down to 16 bits."""
+    for _ in xrange(4):
+        sums = (sums & 0xFFFF) + (sums >> 16)
+    return sums
+
+
+def _fix_checksum(variants, template, ranges, checksum, patched, extra=0):
+    """Recomputes a one's complement checksum in every row of variants.
+
+    Only the words that were patched differ between rows, so the sum of the
+    rest is taken once from the template, and just the patched words are
+    summed per row.
+
+    Args:
+        variants (ndarray): the rows to fix.
+        template (ndarray): the template frame they were made from.
+        ranges (list of tuples): the (start, end) byte ranges covered by the
+                                 checksum, each starting at an even offset.
+        checksum (int): the offset of the checksum.
+        patched (set): the even offsets of every word that was patched.
+        extra (int): any constant to add to the sum, e.g. part of a pseudo
+                     header.
+    """
+    base = extra
+    row_words = []
+    for start, end in ranges:
+        base += int(_words(template, start, end).sum())
+        for offset in sorted(patched):
+            if start <= offset < end and offset != checksum:
+                base -= int(_words(template, offset, min(offset + 2, end))[0])
+                row_words.append(_words(variants, offset,
+                                        min(offset + 2, end))[:, 0])
+    base -= int(_words(template, checksum, checksum + 2)[0])
+
+    sums = np.full(len(variants), base, dtype=np.uint64)
+    for words in row_words:
+        sums += words
+    checksums = ~_fold(sums) & 0xFFFF
+    variants[:, checksum] = checksums >> 8
+    variants[:, checksum + 1] = checksums & 0xFF
+    return checksums
+
+
+def _check_range(name, values, limit):
+    """Returns values as uint64, after making sure they're all from 0 to
+    limit, like field_mutator does.
+
+    Raises:
+        ValueError: if any of them aren't.
+    """
+    values = np.asarray(values)
+    if values.size and (values.min() < 0 or values.max() > limit):
+        raise ValueError('Values from %d to %d overflow the %s field'
+                         % (values.min(), values.max(), name))
+    # As at least 1-D, since NumPy won't mix a uint64 scalar with ints.
+    return np.atleast_1d(np.asarray(values, dtype=np.uint64))
+
+
+def _patch(variants, offset, size, values, patched):
+    """Writes values as big-endian ints of size bytes into every row."""
+    values = np.asarray(values, dtype=np.uint64)
+    for i in xrange(size):
+        shift = 8 * (size - 1 - i)
+        variants[:, offset + i] = (values >> shift) & 0xFF
+        patched.add((offset + i) & ~1)
+
+
+def generate_variants(frame, count, **fields):
+    """Makes count variants of an Ethernet frame, as rows of a 2-D array.
+
+    Args:
+        frame (str): the raw bytes of the template frame, e.g. str(packet).
+        count (int): the number of variants to make.
+        **fields: the value of each field to patch (see FIELDS), as an int
+                  for every variant, or an array of count ints (e.g. from
+                  sweep). 'counter' is written as a 4-byte big-endian
+                  int at the start of the payload.
+
+    Returns:
+        ndarray: A (count, len(frame)) uint8 array, one variant per row,
+        with the IPv4 and UDP/TCP checksums recomputed.
+
+    Raises:
+        ValueError: if a field is unknown, the frame doesn't have it, or its
+                    values don't fit in it (e.g. a port past 65535, or a
+                    VLAN ID past 4095).
+    """
+    template = np.frombuffer(frame, dtype=np.uint8)
+    offsets = find_offsets(frame)
+    variants = np.empty((count, len(template)), dtype=np.uint8)
+    variants[:] = template
+    patched = set()
+
+    for name, values in fields.iteritems():
+        if name in _IP_FIELDS and offsets['ip'] is not None:
+            offset, size = _IP_FIELDS[name]
+            values = _check_range(name, values, (1 << 8 * size) - 1)
+            _patch(variants, offsets['ip'] + offset, size, values, patched)
+        elif name in _L4_FIELDS and offsets['l4'] is not None:
+            offset, size = _L4_FIELDS[name]
+            values = _check_range(name, values, (1 << 8 * size) - 1)
+            _patch(variants, offsets['l4'] + offset, size, values, patched)
+        elif name == 'vlan' and offsets['vlan'] is not None:
+            # Keep the priority and DEI bits of the template's tag.
+            tci = struct.unpack_from('!H', frame, offsets['vlan'])[0]
+            values = (tci & 0xF000) | _check_range(name, values, 0x0FFF)
+            _patch(variants, offsets['vlan'], 2, values, patched)
+        elif name == 'counter' and offsets['payload'] + 4 <= len(template):
+            values = _check_range(name, values, 0xFFFFFFFF)
+            _patch(variants, offsets['payload'], 4, values, patched)
+        else:
+            raise ValueError('The frame has no %s field to patch' % name)
+
+    ip = offsets['ip']
+    if ip is None:
+        return variants
+    ip_header = (ip, ip + (template[ip] & 0x0F) * 4)
+    if patched.intersection(xrange(*ip_header)):
+        _fix_checksum(variants, template, [ip_header], ip + 10, patched)
+
+    l4 = offsets['l4']
+    if l4 is None:
+        return variants
+    checksum = l4 + _L4_CHECKSUM[offsets['proto']]
+    covered = [(ip + 12, ip + 20), (l4, offsets['ip_end'])]
+    # A UDP checksum of 0 means there is none, so leave it that way.
+    if (offsets['proto'] == PROTO_UDP
+            and not template[checksum] and not template[checksum + 1]):
+        return variants
+    if any(start <= offset < end for start, end in covered
+           for offset in patched):
+        # The rest of the pseudo header: protocol and L4 length.
+        extra = offsets['proto'] + offsets['ip_end'] - l4
+        checksums = _fix_checksum(variants, template, covered, checksum,
+                                  patched, extra)
+        if offsets['proto'] == PROTO_UDP:
+            # A computed UDP checksum of 0 is sent as all ones.
+            zero = checksums == 0
+            variants[zero, checksum] = 0xFF
+            variants[zero, checksum + 1] = 0xFF
+    return variants
+
+
+def variants_to_sequence(variants):
+    """Packs variants into the data of a START_SEQUENCE message, the same as
+    SEASIDE.pack_SEASIDE_sequence does for a list of packets.
+
+    Returns:
+        str: The data, ready to send.
+    """
+    count, size = variants.shape
+    lengths = np.empty((count, 2), dtype=np.uint8)
+    lengths[:] = np.frombuffer(struct.pack('=H', size), dtype=np.uint8)
+    return np.hstack([lengths, variants]).tobytes()
+
+
+def write_pcap(filename, variants, interval=0.000001):
+    """Writes variants to a pcap file, in one write.
+
+    Args:
+        filename (str): the file to write to.
+        variants (ndarray): the frames, one per row.
+        interval (float): the seconds between the frames' timestamps.
+    """
+    count, size = variants.shape
+    records = np.empty(count, dtype=_PCAP_RECORD)
+    usecs = np.arange(count, dtype=np.uint64) * int(interval * 1000000)
+    records['sec'] = usecs // 1000000
+    records['usec'] = usecs % 1000000
+    records['caplen'] = size
+    records['len'] = size
+    data = np.hstack([records.view(np.uint8).reshape(count, -1), variants])
+    with open(filename, 'wb') as pcap_file:
+        pcap_file.write(_PCAP_GLOBAL_HEADER.pack(0xa1b2c3d4, 2, 4, 0, 0,
+                                                 0xffff, 1))
+        pcap_file.write(data.tobytes())
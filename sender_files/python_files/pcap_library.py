@@ -0,0 +1,270 @@
+"""Keeps an index of the pcap files in a directory.
+
+Showing what is in a library of captures (how many packets, how big, over how
+long, of what protocols) would otherwise mean reading every file each time.
+Instead, each file is summarized once, and the summaries are kept in an index
+file in the same directory, which is only redone for a file when its
+modification time or size changes.
+
+Every INDEX_INTERVAL'th record's offset is kept too, so getting a packet from
+the middle of a large capture only reads from the nearest of those on,
+instead of from the start of the file.
+
+Example:
+    library = PcapLibrary('pcap_files')
+    library.summaries()['capture.pcap']['packets']
+    packet = library.packet('capture.pcap', 123456)
+
+summarize: reads a capture, and returns its summary.
+PcapLibrary: the index of a directory of captures.
+"""
+import bisect
+import collections
+import json
+import os
+import struct
+import threading
+
+from shared_files import pcap_reader
+
+# The file the index is kept in, in the directory it indexes. Bump
+# INDEX_VERSION whenever the summaries change, so old indexes are redone.
+INDEX_FILENAME = '.pcap_index.json'
+INDEX_VERSION = 1
+
+# Keep the offset of every this many records.
+INDEX_INTERVAL = 1000
+
+# How many of the most common protocols a summary lists.
+TOP_PROTOCOLS = 5
+
+# The upper bounds of the packet size histogram's buckets, in bytes on the
+# wire; the last bucket holds jumbo frames.
+SIZE_BUCKETS = (64, 127, 255, 511, 1023, 1518)
+
+ETHERTYPE_VLAN = (0x8100, 0x88a8)
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86DD
+ETHERTYPE_ARP = 0x0806
+IP_PROTOCOLS = {1: 'ICMP', 2: 'IGMP', 6: 'TCP', 17: 'UDP', 47: 'GRE',
+                50: 'ESP', 58: 'ICMPv6', 132: 'SCTP'}
+
+
+def _size_labels():
+    labels = []
+    lower = 0
+    for upper in SIZE_BUCKETS:
+        labels.append('%d-%d' % (lower, upper))
+        lower = upper + 1
+    labels.append('%d+' % lower)
+    return labels
+
+
+def _protocol(data, linktype):
+    """Names the protocol of a packet from its headers, e.g. 'IPv4/UDP'."""
+    if linktype != pcap_reader.LINKTYPE_ETHERNET:
+        return 'linktype %d' % linktype
+    try:
+        pos = 12
+        ethertype = struct.unpack_from('!H', data, pos)[0]
+        while ethertype in ETHERTYPE_VLAN:
+            pos += 4
+            ethertype = struct.unpack_from('!H', data, pos)[0]
+        if ethertype == ETHERTYPE_IPV4:
+            name, proto = 'IPv4', struct.unpack_from('B', data, pos + 11)[0]
+        elif ethertype == ETHERTYPE_IPV6:
+            name, proto = 'IPv6', struct.unpack_from('B', data, pos + 8)[0]
+        elif ethertype == ETHERTYPE_ARP:
+            return 'ARP'
+        else:
+            return 'ethertype 0x%04x' % ethertype
+    except struct.error:
+        return 'truncated'
+    return '%s/%s' % (name, IP_PROTOCOLS.get(proto, 'proto %d' % proto))
+
+
+def summarize(path):
+    """Reads a capture, and returns its summary.
+
+    Args:
+        path (str): the path of the pcap or pcapng file.
+
+    Returns:
+        dict: 'packets' and 'bytes' (on the wire) in the capture, the
+        'first' and 'last' timestamps and the 'duration' between them (None
+        if it has none), 'sizes' (a list of [bucket, count] for the packet
+        size histogram), 'protocols' (a list of [name, count] of the most
+        common protocols, most common first, with 'other' for the rest),
+        'linktype', and 'offsets' of every INDEX_INTERVAL'th record.
+
+    Raises:
+        IOError: if the file can't be opened, or isn't a capture.
+    """
+    packets = 0
+    total = 0
+    first = last = None
+    sizes = [0] * (len(SIZE_BUCKETS) + 1)
+    protocols = collections.Counter()
+    offsets = []
+
+    with pcap_reader.PcapReader(path) as reader:
+        linktype = reader.linktype
+        for record in reader:
+            if packets % INDEX_INTERVAL == 0:
+                offsets.append(record.offset)
+            packets += 1
+            total += record.length
+            sizes[bisect.bisect_left(SIZE_BUCKETS, record.length)] += 1
+            protocols[_protocol(record.data, linktype)] += 1
+            if record.timestamp is not None:
+                if first is None:
+                    first = record.timestamp
+                last = record.timestamp
+
+    top = protocols.most_common(TOP_PROTOCOLS)
+    other = packets - sum(count for _, count in top)
+    if other:
+        top.append(('other', other))
+    return {
+        'packets': packets,
+        'bytes': total,
+        'first': first,
+        'last': last,
+        'duration': last - first if first is not None else None,
+        'sizes': [list(bucket) for bucket in zip(_size_labels(), sizes)],
+        'protocols': [list(protocol) for protocol in top],
+        'linktype': linktype,
+        'offsets': offsets,
+    }
+
+
+class PcapLibrary(object):
+    """The index of a directory of captures, see the module description.
+
+    Each summary also holds the 'mtime' and 'size' of the file it was made
+    from, or just those and an 'error' if the file isn't a capture (so it
+    isn't read again either, until it changes). Safe to use from several
+    threads.
+
+    Args:
+        directory (str): the directory of captures.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self.index_path = os.path.join(directory, INDEX_FILENAME)
+        self._lock = threading.Lock()
+        self._summaries = {}
+        try:
+            with open(self.index_path) as index_file:
+                index = json.load(index_file)
+            if index.get('version') == INDEX_VERSION:
+                self._summaries = index['files']
+        except (IOError, ValueError, KeyError):
+            pass
+
+    def filenames(self):
+        """Returns the names of the files in the directory, without the
+        index itself."""
+        return sorted(name for name in os.listdir(self.directory)
+                      if not name.startswith('.'))
+
+    def summaries(self):
+        """Brings the index up to date, and returns the summaries.
+
+        Returns:
+            dict: The summary of each file by name (see summarize), without
+            the offsets.
+        """
+        with self._lock:
+            self._refresh()
+            return dict((name, dict((key, value)
+                                    for key, value in summary.iteritems()
+                                    if key != 'offsets'))
+                        for name, summary in self._summaries.iteritems())
+
+    def packet(self, filename, number):
+        """Returns the raw bytes of a packet in one of the captures.
+
+        Args:
+            filename (str): the name of the capture in the directory.
+            number (int): the packet's position in the capture, from 0.
+
+        Returns:
+            str: The packet.
+
+        Raises:
+            IOError: if the file doesn't exist, or isn't a capture.
+            IndexError: if the capture doesn't have that many packets.
+        """
+        with self._lock:
+            self._refresh(filename)
+            summary = self._summaries.get(filename)
+        if summary is None:
+            raise IOError("%s doesn't exist" % filename)
+        if 'error' in summary:
+            raise IOError(summary['error'])
+        if not 0 <= number < summary['packets']:
+            raise IndexError('%s has %d packets' % (filename,
+                                                    summary['packets']))
+
+        skip = number % INDEX_INTERVAL
+        path = os.path.join(self.directory, filename)
+        with pcap_reader.PcapReader(path) as reader:
+            records = reader.records(
+                summary['offsets'][number // INDEX_INTERVAL])
+            for position, record in enumerate(records):
+                if position == skip:
+                    return record.data.tobytes()
+        raise IndexError('%s changed while reading it' % filename)
+
+    def _refresh(self, filename=None):
+        """Summarizes any files (or just filename) that are new or changed
+        since they were last summarized, drops the ones that are gone, and
+        saves the index if anything changed. Must hold self._lock."""
+        if filename is None:
+            names = self.filenames()
+            changed = set(self._summaries) - set(names)
+            for name in changed:
+                del self._summaries[name]
+        else:
+            if filename != os.path.basename(filename):
+                raise IOError('%s is not in the library' % filename)
+            names = [filename]
+            changed = set()
+
+        for name in names:
+            path = os.path.join(self.directory, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                if self._summaries.pop(name, None) is not None:
+                    changed.add(name)
+                continue
+            summary = self._summaries.get(name)
+            if (summary is not None and summary['mtime'] == stat.st_mtime
+                    and summary['size'] == stat.st_size):
+                continue
+            try:
+                summary = summarize(path)
+            except IOError as error:
+                summary = {'error': str(error)}
+            summary['mtime'] = stat.st_mtime
+            summary['size'] = stat.st_size
+            self._summaries[name] = summary
+            changed.add(name)
+
+        if changed:
+            self._save()
+
+    def _save(self):
+        """Writes the index out, atomically so a crash can't corrupt it."""
+        temporary = self.index_path + '.tmp'
+        try:
+            with open(temporary, 'w') as index_file:
+                json.dump({'version': INDEX_VERSION,
+                           'files': self._summaries}, index_file)
+            os.rename(temporary, self.index_path)
+        except (IOError, OSError) as error:
+            # The summaries still work, they just won't outlive the server.
+            print "Couldn't save the pcap index:", error
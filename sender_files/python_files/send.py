@@ -5,8 +5,9 @@ The threads are as follows:
     display_loop: handles printing to the LCD screen. The information to be
         printed is filled in by the statistics loop. It calls a
         threadsafe function to print.
-    update_statistics_loop: gathers system statistics such as bandwidth and CPU
-        usage both by communicating with the C-side and python functions from 
+    update_statistics_loop: gathers system statistics such as bandwidth,
+        packets sent and CPU usage both from the C-side's statistics pushes
+        and transmit counters, and python functions from
         shared_files/computations. Screen output is held in a global variable
         awaiting printing.
     main: attempts to lock a file to ensure that only one instance may run at a
@@ -40,9 +41,8 @@ from shared_files.SEASIDE import SEASIDE_FLAGS
 
 def sigint_handler(signum, frame):
     """Shuts down the C-side socket and then raises KeyboardInterrupt."""
-    global c_socket
-    c_socket.shutdown(socket.SHUT_RDWR)
-    c_socket.close()
+    global c_client
+    c_client.close()
 
     raise KeyboardInterrupt
 
@@ -56,29 +56,27 @@ def display_loop():
         time.sleep(0.7)
 
 
-def update_statistics_loop(c_socket, c_socket_lock):
-    """Update the values of bandwidth and CPU use.
+def update_statistics_loop(c_client):
+    """Update the values of bandwidth, packets sent and CPU use.
 
-    Calculates bandwidth using change in bytes received over time, which is
-    provided by the C-side. Calculates CPU using psutil.
+    The C-side pushes the bandwidth it achieved once a second, so there is
+    no need to ask for it. The transmit counters are requested along with
+    each push, to show how many packets were sent and how many failed.
+    Calculates CPU using psutil.
     """
-    while True:
-        d_bytes = SEASIDE.request_SEASIDE(c_socket, c_socket_lock,
-                                          SEASIDE_FLAGS.GET_BANDWIDTH.value)
-        print "D_bytes:", repr(d_bytes)
-        d_bytes = struct.unpack('=Q', d_bytes)
-        d_bytes = d_bytes[0]
-
-        bw, bw_unit = conversions.convert_bandwidth_units(d_bytes)
+    for stats in c_client.subscribe_stats(1):
+        bw, bw_unit = conversions.convert_bandwidth_units(stats.bandwidth)
+        tx_stats = c_client.tx_stats()
 
         cpu, percore = computations.read_cpu_usage()  # percore unused
 
-        screen_output[0] = 'Bw:%2.1f %s' % (bw, bw_unit)
-        screen_output[1] = 'CPU:%2.1f%%' % (cpu)
-        time.sleep(1)
+        screen_output[0] = 'Bw:%2.1f%s %2.0f%%' % (bw, bw_unit, cpu)
+        screen_output[1] = 'Tx:%d' % tx_stats.packets
+        if tx_stats.errors:
+            screen_output[1] += ' E:%d' % tx_stats.errors
 
 
-def user_interaction(lcd, lcd_lock, c_socket, c_socket_lock):
+def user_interaction(lcd, lcd_lock, c_client):
     """Uses the LCD screen to interact with the user.
 
     Waits for the user to press a button and then performs the corresponding
@@ -93,8 +91,8 @@ def user_interaction(lcd, lcd_lock, c_socket, c_socket_lock):
     Args:
         lcd (LCD_Input_Wrapper object): the lcd screen to use.
         lcd_lock (RLock object): the lock associated with the screen.
-        c_socket (socket object): the socket used for SEASIDE communication
-        c_socket_lock (RLock object): the lock associated with the socket.
+        c_client (SEASIDE_Client object): the client used for SEASIDE
+            communication.
 
     """
     led_state = (0, 1, 0)  # (r, g, b) for the screen LED
@@ -102,41 +100,33 @@ def user_interaction(lcd, lcd_lock, c_socket, c_socket_lock):
 
     global packet
 
-    delay_seconds, delay_useconds = 1, 0
-    delay_bytes = conversions.convert_delay_bytes(delay_seconds,
-                                                  delay_useconds)
+    # The SEASIDE message that sets how fast to send, see
+    # pgen.configure_delay.
+    delay_message = (SEASIDE_FLAGS.DELAY.value,
+                     conversions.convert_delay_bytes(1, 0))
     while True:
         if lcd.is_pressed(LCD.SELECT):  # Configure packet
             packet_temp = pgen.configure_packet(lcd, lcd_lock)
             if packet_temp is None:
                 time.sleep(0.3)
                 continue
-            packet = conversions.convert_packet_int_array(packet_temp)
+            packet = conversions.convert_packet_bytes(packet_temp)
 
-            SEASIDE.send_SEASIDE(c_socket, c_socket_lock,
-                                 SEASIDE_FLAGS.DELAY.value, delay_bytes)
-            time.sleep(1)  # TODO: This separates sends. Make it unnecessary.
-            SEASIDE.send_SEASIDE(c_socket, c_socket_lock,
-                                 SEASIDE_FLAGS.PACKET.value, packet)
+            c_client.send_batch([delay_message,
+                                 (SEASIDE_FLAGS.PACKET.value, packet)])
             led_state = (0, 1, 0)
         elif lcd.is_pressed(LCD.UP):  # Begin sending
-            SEASIDE.send_SEASIDE(c_socket, c_socket_lock,
-                                 SEASIDE_FLAGS.START.value)
+            c_client.send(SEASIDE_FLAGS.START.value)
             is_sending = True
         elif lcd.is_pressed(LCD.DOWN):  # Stop sending
-            SEASIDE.send_SEASIDE(c_socket, c_socket_lock,
-                                 SEASIDE_FLAGS.STOP.value)
+            c_client.send(SEASIDE_FLAGS.STOP.value)
             is_sending = False
         elif lcd.is_pressed(LCD.LEFT):  # Send single packet
-            SEASIDE.send_SEASIDE(c_socket, c_socket_lock,
-                                 SEASIDE_FLAGS.SINGLE_PACKET.value)
+            c_client.send(SEASIDE_FLAGS.SINGLE_PACKET.value)
             threaded_lcd.flash_led(lcd, lcd_lock, *led_state)
-        elif lcd.is_pressed(LCD.RIGHT):  # Configure delay
-            delay_seconds, delay_useconds = pgen.configure_delay(lcd, lcd_lock)
-            delay_bytes = conversions.convert_delay_bytes(delay_seconds,
-                                                          delay_useconds)
-            SEASIDE.send_SEASIDE(c_socket, c_socket_lock,
-                                 SEASIDE_FLAGS.DELAY.value, delay_bytes)
+        elif lcd.is_pressed(LCD.RIGHT):  # Configure delay or rate
+            delay_message = pgen.configure_delay(lcd, lcd_lock)
+            c_client.send(*delay_message)
             threaded_lcd.flash_led(lcd, lcd_lock, 0, 0, 1)
         if is_sending:  # Ensures the LED always stays the right color.
             threaded_lcd.lock_and_set_led_color(lcd, lcd_lock, *led_state)
@@ -156,11 +146,6 @@ def main():
     global lcd_lock
     lcd_lock = threading.RLock()
 
-    # A lock to ensure that only one thread may use the c_socket to communicate
-    # using SEASIDE at once.
-    global c_socket_lock
-    c_socket_lock = threading.RLock()
-
     global screen_output
     screen_output = ['', '']
 
@@ -180,7 +165,6 @@ def main():
         sys.exit(0)
     # End of lock code.
 
-    global c_socket # Global so that the signal handler can close it.
     c_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
     SOCKET_ADDR = '/tmp/send_socket'
     while True:
@@ -190,20 +174,24 @@ def main():
         except:
             time.sleep(1)
             print 'Trying to connect...'
+
+    # Shared by every thread; requests are tagged, so they can be in flight
+    # at the same time. Global so that the signal handler can close it.
+    global c_client
+    c_client = SEASIDE.SEASIDE_Client(c_socket)
     def_handler = signal.signal(signal.SIGINT, sigint_handler)
 
     print 'Connected to socket'
 
     try:
         thread.start_new_thread(display_loop, ())
-        thread.start_new_thread(update_statistics_loop, (c_socket,
-                                                         c_socket_lock))
+        thread.start_new_thread(update_statistics_loop, (c_client,))
     except:
         print 'Error: ', sys.exc_info()
 
     # In the main thread so that we don't have to start another one.
     # Theoretically, this will never exit. Unless it crashes.
-    user_interaction(lcd, lcd_lock, c_socket, c_socket_lock)
+    user_interaction(lcd, lcd_lock, c_client)
 
 
 if __name__ == '__main__':
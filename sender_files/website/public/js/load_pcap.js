@@ -1,14 +1,67 @@
 $(document).ready(function () {
     'use strict';
 
+    /* What is in each file in pcap_files, see get_pcap_library. */
+    var library = {};
+
+    /* Shows what is in the selected file. */
+    function show_summary() {
+        var summary = library[$("#pcap_files option:selected").text()];
+        var text = "";
+        if (summary === undefined) {
+            return $("#pcap-summary").html("");
+        }
+        if (summary.error !== undefined) {
+            text = summary.error;
+        } else {
+            text = summary.packets + " packets, " + summary.bytes + " bytes";
+            if (summary.duration !== null) {
+                text += ", " + summary.duration.toFixed(3) + " s";
+            }
+            text += "<br>" + summary.protocols.map(function (protocol) {
+                return protocol[0] + ": " + protocol[1];
+            }).join(", ");
+            $("#pcap-packet-number").attr("max", summary.packets - 1);
+        }
+        $("#pcap-summary").html(text);
+    }
+
     /* Load a file from the server files stored in pcap_files. */
     $("#load-file-from-server").click(function () {
         $.ajax({
             type: "POST",
-            url: "load_pcap_file?filename=" + $("#pcap_files option:selected").text(),
+            url: "load_pcap_file",
+            data: {
+                filename: $("#pcap_files option:selected").text(),
+                number: $("#pcap-packet-number").val()
+            }
         });
    });
 
+    $("#pcap_files").change(show_summary);
+
+    /* Replay every packet of a file from the server files, with the chosen
+     * timing. */
+    $("#replay-file-from-server").click(function () {
+        $.ajax({
+            type: "POST",
+            url: "replay_pcap_file",
+            data: {
+                filename: $("#pcap_files option:selected").text(),
+                timing: $("#replay-timing").val(),
+                scale: $("#replay-scale").val(),
+                loops: $("#replay-loops").val()
+            }
+        });
+    });
+
+    $("#stop-replay").click(function () {
+        $.ajax({
+            type: "POST",
+            url: "stop_replay"
+        });
+    });
+
     /* Takes the pcap file uploaded to input_file, and then sends it to the
      * server for processing. */
     $("#load-file-from-user").click(function () {
@@ -39,4 +92,13 @@ $(document).ready(function () {
         }
     });
 
+    $.ajax({
+        type: "POST",
+        url: "get_pcap_library",
+        success: function (data) {
+            library = JSON.parse(data);
+            show_summary();
+        }
+    });
+
 });
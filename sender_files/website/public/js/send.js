@@ -13,16 +13,16 @@ $(document).ready(function () {
         return String(band.toFixed(2)) + " " + units[i];
     }
 
-    /* Requests the bandwidth and updates the progress bar to represent
-     * the current bandwidth. */
+    /* Requests the latest statistics that the C side pushed to the server,
+     * and updates the progress bar to represent the current bandwidth. */
     function update_bar() {
         $.ajax({
             type: "POST",
-            url: "command_and_respond?command=7&size=Q",
-            success: function (data) {
+            url: "get_statistics",
+            dataType: "json",
+            success: function (stats) {
                 var band = $("#bandwidth-bar");
-                var max = parseInt(band.attr("aria-valuemax"));
-                var bandwidth = parseInt(data, 16);
+                var bandwidth = stats.bandwidth;
                 band.css("width", String(bandwidth / MAX_LINE_RATE * 100) + "%");
                 band.html(calculate_bandwidth(bandwidth));
             },
@@ -32,6 +32,24 @@ $(document).ready(function () {
         });
     }
 
+    /* Requests the C side's transmit counters, and shows them along with
+     * the rate it achieved. */
+    function update_tx_stats() {
+        $.ajax({
+            type: "POST",
+            url: "get_tx_stats",
+            dataType: "json",
+            success: function (stats) {
+                $("#tx-stats").html("Sent " + String(stats.packets)
+                                    + " packets (" + String(stats.bytes)
+                                    + " bytes), at " + String(stats.pps)
+                                    + " pps (" + calculate_bandwidth(stats.bps)
+                                    + "). Errors: " + String(stats.errors)
+                                    + ", retries: " + String(stats.retries));
+            }
+        });
+    }
+
     $("#start-sending").click(function () {
         $.ajax({
             type: "POST",
@@ -56,8 +74,48 @@ $(document).ready(function () {
         });
     });
 
-    /* Gets the bandwidth from C side once every second. */
+    /* Sends a burst, and shows how many packets went out, and how fast,
+     * once it's over. */
+    $("#send-burst").click(function () {
+        $("#send-burst").prop("disabled", true);
+        $("#burst-result").html("Sending...");
+        $.ajax({
+            type: "POST",
+            url: "send_burst?count=" + parseInt($("#burst-count").val())
+                 + "&gap=" + parseInt($("#burst-gap").val()),
+            dataType: "json",
+            success: function (result) {
+                var text = String(result.sent) + " packets in "
+                           + result.duration.toFixed(6) + " s";
+                if (result.duration > 0) {
+                    text += " (" + String(Math.round(result.sent / result.duration))
+                            + " pps)";
+                }
+                $("#burst-result").html(text);
+            },
+            error: function () {
+                $("#burst-result").html("The burst failed; is a packet configured?");
+            },
+            complete: function () {
+                $("#send-burst").prop("disabled", false);
+            }
+        });
+    });
+
+    // When you press enter, it refreshes the page. This disables that.
+    $("form").submit(function () {
+        return false;
+    });
+
+    /* The server already has the C side's statistics, so asking for them
+     * often is cheap. */
     setInterval(function () {
         update_bar();
+    }, 250);
+
+    /* The counters come from the C side itself, so ask less often. */
+    update_tx_stats();
+    setInterval(function () {
+        update_tx_stats();
     }, 1000);
 });
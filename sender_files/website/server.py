@@ -8,7 +8,8 @@ sender_files, shared_files, etc. are located) is run this command:
 
 python -m sender_files.website.server
 
-Probably gonna have to run it as root.
+Probably gonna have to run it as root. Pass --quiet to stop it from printing
+every packet it builds.
 
 The idea behind the implementation of this server is we have a client, which
 occasionally sends us different requests. Some of these requests are for a new
@@ -30,6 +31,7 @@ TODO: Any functions that deal with taking in input should do sanitization.
 """
 
 
+import collections
 import copy
 import json
 import os
@@ -38,22 +40,66 @@ import socket
 import string
 import struct
 import sys
-import tempfile
 import threading
 
 import cherrypy
 from scapy.all import *
 
 from shared_files import SEASIDE
-from shared_files import conversions
 from shared_files import computations
+from shared_files import conversions
+from shared_files import pcap_reader
 from sender_files.python_files import data_sanitization as ds
 from sender_files.python_files import dictionaries as dicts
+from sender_files.python_files import packet_variants as pv
+from sender_files.python_files import pcap_library
+
+# The C side's socket.
+SOCKET_ADDR = '/tmp/send_socket'
+
+# A pool of SEASIDE connections for interaction with the C side. Each web
+# request borrows one, so requests from different browsers don't queue up
+# behind each other on a single socket.
+c_pool = SEASIDE.SEASIDE_Pool(SOCKET_ADDR)
+
+# How often the C side pushes its statistics to us, in seconds.
+STATISTICS_INTERVAL = 0.1
+
+# The connection the C side pushes its statistics over, kept out of the pool
+# so the subscription stays put, along with a lock so only one web request
+# reconnects it if it is lost.
+stats_client = None
+stats_client_lock = threading.Lock()
+
+# The latest statistics the C side pushed, served to every browser that asks,
+# so polling browsers don't cost the C side anything.
+latest_stats = None
+
+# Whether to print every packet that gets built, set by --quiet.
+show_packets = True
 
-# A socket for interaction with the C side, and a lock to ensure that no two
-# web requests can write at the same time.
-c_socket = None
-c_socket_lock = threading.Lock()
+# A built packet: the scapy packet itself (for writing pcap files), and its
+# finished wire bytes (for sending to the C side).
+PacketTemplate = collections.namedtuple('PacketTemplate', 'packet wire')
+
+
+def store_stats(stats):
+    """Keeps the latest statistics pushed by the C side."""
+    global latest_stats
+    latest_stats = stats
+
+
+def subscribe_stats():
+    """(Re)connects the statistics connection if it was lost.
+
+    Raises:
+        socket.error: if the C side isn't accepting connections.
+    """
+    global stats_client
+    with stats_client_lock:
+        if stats_client is None or stats_client.closed:
+            stats_client = c_pool.connect()
+            stats_client.subscribe_stats(STATISTICS_INTERVAL, store_stats)
 
 
 def str_to_class(string):
@@ -103,13 +149,14 @@ def configure_packet_layers(packet_layers):
             (ordered from lowest layer to highest layer), and any optional
             fields to configure. Not all fields will be present, the rest
             will be auto-generated. And if a field is empty, it will also
-            be auto-generated.
+            be auto-generated. The array may also be passed already decoded.
 
         Returns:
             Packet: A scapy packet, with all the layers and fields configured
             as specified.
         """
-    packet_layers = json.loads(packet_layers)
+    if isinstance(packet_layers, basestring):
+        packet_layers = json.loads(packet_layers)
     packet = Packet()
 
     for layer in packet_layers:
@@ -132,10 +179,115 @@ def configure_packet_layers(packet_layers):
                 setattr(temp_layer, key, sanitized_field)
         # Add the configured layer to the packet.
         packet /= temp_layer
-    packet.show()
+    if show_packets:
+        packet.show()
     return packet
 
 
+class PacketTemplateCache(object):
+    """An LRU cache of built packets, keyed by their layer configuration.
+
+    Building a packet with scapy takes tens of milliseconds on a Pi, while
+    users mostly go back and forth between a few configurations. The key is
+    the layer JSON with its keys sorted and whitespace stripped, so the same
+    configuration hits no matter how the browser serialized it.
+    """
+
+    def __init__(self, maxsize=64):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._templates = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, packet_layers):
+        """Returns the PacketTemplate for packet_layers, building it if needed.
+
+        Args:
+            packet_layers (JSON): The packet layers in a string of JSON. See
+                configure_packet_layers above for the format.
+
+        Returns:
+            PacketTemplate: The built packet and its wire bytes.
+        """
+        layers = json.loads(packet_layers)
+        key = json.dumps(layers, sort_keys=True, separators=(',', ':'))
+        with self._lock:
+            template = self._templates.pop(key, None)
+            if template is not None:
+                self.hits += 1
+                self._templates[key] = template
+                return template
+            self.misses += 1
+
+        # Built outside the lock, so a slow build doesn't hold up hits.
+        packet = configure_packet_layers(layers)
+        template = PacketTemplate(packet, str(packet))
+        with self._lock:
+            self._templates[key] = template
+            while len(self._templates) > self.maxsize:
+                self._templates.popitem(last=False)
+        return template
+
+    def stats(self):
+        """Returns a dictionary of the hits, misses and current size."""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'size': len(self._templates), 'maxsize': self.maxsize}
+
+
+packet_templates = PacketTemplateCache()
+
+# The index of the files in pcap_files/, set up once the server has moved
+# into its directory.
+pcap_index = None
+
+
+# The fields that a packet sequence can sweep, by layer and field name as the
+# browser sends them, mapped to their names in packet_variants.
+SWEEP_FIELDS = {
+    ('IP', 'src'): 'src',
+    ('IP', 'dst'): 'dst',
+    ('UDP', 'sport'): 'sport',
+    ('UDP', 'dport'): 'dport',
+    ('TCP', 'sport'): 'sport',
+    ('TCP', 'dport'): 'dport',
+    ('802.1Q', 'vlan'): 'vlan',
+}
+
+
+def sweep_packet(packet_layers, layer_type, field, start, count):
+    """Makes a copy of a packet for each value of a field, counting up.
+
+    The packet is built once (or taken from the template cache), and the
+    copies are patched together by packet_variants, checksums and all.
+
+    Args:
+        packet_layers (JSON): The packet layers in a string of JSON. See
+            configure_packet_layers above for the format.
+        layer_type (str): The layer of the field to sweep, e.g. 'UDP'.
+        field (str): The field to sweep, e.g. 'dport'. See SWEEP_FIELDS.
+        start (str): The first value of the field, either an int or an IPv4
+            address.
+        count (str): The number of copies to make.
+
+    Returns:
+        ndarray: The copies, one per row, see packet_variants.
+
+    Raises:
+        ValueError: If the field can't be swept, or the packet doesn't have
+            it.
+    """
+    try:
+        name = SWEEP_FIELDS[(layer_type, field)]
+    except KeyError:
+        raise ValueError("Can't sweep %s.%s" % (layer_type, field))
+    count = int(count)
+    wire = packet_templates.get(packet_layers).wire
+    return pv.generate_variants(wire, count,
+                                **{name: pv.sweep(start, count)})
+
+
 class PacketServer(object):
 
     # PAGE REQUESTS START HERE
@@ -216,12 +368,80 @@ class PacketServer(object):
         # "Done configuring" button like the silly user they are.
         if packet_layers == '[]':
             return
-        # Turn it into a Scapy packet.
-        packet = configure_packet_layers(packet_layers)
-        # Turn it into the corresponding int array.
-        packet = conversions.convert_packet_int_array(packet)
+        # Turn it into a Scapy packet, unless it was built before.
+        template = packet_templates.get(packet_layers)
         # Send it to the C side, using the SEASIDE format.
-        SEASIDE.send_SEASIDE(c_socket, c_socket_lock, 0, packet)
+        with c_pool.connection() as c_client:
+            c_client.send(0, template.wire)
+
+    @cherrypy.expose
+    def packet_sequence_config(self, packet_layers, layer_type, field, start,
+                               count):
+        """Sends the C side a sequence of packets that sweeps a field.
+
+        The C side cycles through the sequence instead of sending the same
+        packet over and over, so the traffic is spread over many flows (e.g.
+        to exercise ECMP, flow tables or ACLs). Sending it stops again with
+        the STOP_SEQUENCE command.
+
+        Args:
+            packet_layers (JSON): The packet layers in a string of JSON. See
+                configure_packet_layers above for the format.
+            layer_type (str): The layer of the field to sweep, e.g. 'UDP'.
+            field (str): The field to sweep, e.g. 'dport'.
+            start (str): The first value of the field, either an int or an
+                IPv4 address. Every next packet counts up by one.
+            count (str): The number of packets in the sequence, up to
+                SEASIDE.MAX_SEQUENCE_PACKETS.
+
+        Raises:
+            ValueError: If count is out of range, or the values of the field
+                don't fit in it.
+        """
+        if packet_layers == '[]':
+            return
+        if not 0 < int(count) <= SEASIDE.MAX_SEQUENCE_PACKETS:
+            raise ValueError('A sequence must have 1 to %d packets, not %s'
+                             % (SEASIDE.MAX_SEQUENCE_PACKETS, count))
+        variants = sweep_packet(packet_layers, layer_type, field, start, count)
+        with c_pool.connection() as c_client:
+            c_client.send(SEASIDE.SEASIDE_FLAGS.START_SEQUENCE.value,
+                          pv.variants_to_sequence(variants))
+
+    @cherrypy.expose
+    def packet_mutators_config(self, packet_layers, layer_type, field, start,
+                               count, step='1'):
+        """Sends the C side a packet, and has it sweep a field by itself.
+
+        Unlike packet_sequence_config, only the one packet is sent over; the
+        C side changes the field after every packet it sends (fixing up the
+        checksums as it goes), so the sweep can be as long as the field
+        allows.
+
+        Args:
+            packet_layers (JSON): The packet layers in a string of JSON. See
+                configure_packet_layers above for the format.
+            layer_type (str): The layer of the field to sweep, e.g. 'UDP'.
+            field (str): The field to sweep, e.g. 'dport'.
+            start (str): The first value of the field, either an int or an
+                IPv4 address.
+            count (str): The number of values to go through before wrapping
+                around to start again.
+            step (str): How much to count up by after every packet.
+        """
+        if packet_layers == '[]':
+            return
+        try:
+            name = SWEEP_FIELDS[(layer_type, field)]
+        except KeyError:
+            raise ValueError("Can't sweep %s.%s" % (layer_type, field))
+        wire = packet_templates.get(packet_layers).wire
+        mutator = pv.field_mutator(wire, name, start, int(count), int(step))
+        with c_pool.connection() as c_client:
+            c_client.send_batch([
+                (SEASIDE.SEASIDE_FLAGS.PACKET.value, wire),
+                (SEASIDE.SEASIDE_FLAGS.SET_MUTATORS.value,
+                 SEASIDE.pack_SEASIDE_mutators([mutator]))])
 
     @cherrypy.expose
     def command(self, command, data):
@@ -236,7 +456,53 @@ class PacketServer(object):
         TODO: Clean up the types / documentation.
         TODO: Remove the eval.
         """
-        SEASIDE.send_SEASIDE(c_socket, c_socket_lock, int(command), eval(data))
+        with c_pool.connection() as c_client:
+            c_client.send(int(command), eval(data))
+
+    @cherrypy.expose
+    def configure_rate(self, rate, unit='PPS'):
+        """Has the C side send at a rate, instead of with a delay in between
+        packets.
+
+        Args:
+            rate (str): The packets or bits to send per second. 0 sends as
+                fast as the C side can, with no delay at all.
+            unit (str): PPS if the rate is in packets per second, or BPS if
+                it is in bits per second.
+        """
+        rate = float(rate)
+        if rate == 0:
+            message = (SEASIDE.SEASIDE_FLAGS.DELAY.value,
+                       conversions.convert_delay_bytes(0, 0))
+        else:
+            message = (SEASIDE.SEASIDE_FLAGS.SET_RATE.value,
+                       SEASIDE.pack_SEASIDE_rate(rate,
+                                                 SEASIDE.RATE_UNIT[unit]))
+        with c_pool.connection() as c_client:
+            c_client.send(*message)
+
+    @cherrypy.expose
+    def send_burst(self, count, gap='0'):
+        """Has the C side send exactly count packets, and then stop.
+
+        Args:
+            count (str): The number of packets to send.
+            gap (str): Microseconds from the start of one packet to the next,
+                0 to send them back to back.
+
+        Returns:
+            JSON: The number of packets sent (fewer than count if the burst
+                was stopped), and how long that took in seconds. As an
+                example:
+                {
+                    'sent': 1000,
+                    'duration': 0.0125
+                }
+        """
+        with c_pool.connection() as c_client:
+            result = c_client.send_burst(int(count), float(gap) / 1000000)
+        return json.dumps({'sent': result.sent,
+                           'duration': result.duration / 1e9})
 
     @cherrypy.expose
     def command_and_respond(self, command, size):
@@ -260,11 +526,75 @@ class PacketServer(object):
 
         TODO: What if the value returned isn't an int? Make it more generic.
         """
-        temp = SEASIDE.request_SEASIDE(c_socket, c_socket_lock, int(command))
+        with c_pool.connection() as c_client:
+            temp = c_client.request(int(command))
         temp = struct.unpack('=' + size, temp)[0]
         temp = struct.pack('!' + size, temp)
         return temp.encode('hex')
 
+    @cherrypy.expose
+    def get_statistics(self):
+        """Returns the latest statistics that the C side pushed.
+
+        Returns:
+            JSON: A dictionary with the bandwidth (bits/s), the number of
+                packets sent, and the C side's timestamp (nanoseconds) of
+                when they were measured. As an example:
+                {
+                    'bandwidth': 5120000,
+                    'packets': 10000,
+                    'timestamp': 123456789000
+                }
+        """
+        try:
+            subscribe_stats()
+        except socket.error:
+            print 'Lost the connection to the C side.'
+        stats = latest_stats
+        if stats is None:
+            return json.dumps({'bandwidth': 0, 'packets': 0, 'timestamp': 0})
+        return json.dumps(stats._asdict())
+
+    @cherrypy.expose
+    def get_tx_stats(self):
+        """Returns the C side's transmit counters.
+
+        Returns:
+            JSON: A dictionary with the packets and bytes sent since the C
+                side started, the packets it couldn't send, the times it had
+                to retry because the device's queue was full, and the
+                packets/s and bits/s it achieved over the last second. As an
+                example:
+                {
+                    'packets': 10000,
+                    'bytes': 640000,
+                    'errors': 0,
+                    'retries': 12,
+                    'pps': 1000,
+                    'bps': 512000
+                }
+        """
+        with c_pool.connection() as c_client:
+            stats = c_client.tx_stats()
+        return json.dumps(stats._asdict())
+
+    @cherrypy.expose
+    def get_template_cache_stats(self):
+        """Returns how well the packet template cache is doing.
+
+        Returns:
+            JSON: A dictionary with the number of hits and misses, and how
+                many templates are cached out of the most that can be. As an
+                example:
+                {
+                    'hits': 40,
+                    'misses': 3,
+                    'size': 3,
+                    'maxsize': 64
+                }
+        """
+        return json.dumps(packet_templates.stats())
+
     @cherrypy.expose
     def save_packet_to_file(self, pcap_filename, packet_layers):
         """Takes a packet and saves it to the pcap_files/ directory.
@@ -280,9 +610,25 @@ class PacketServer(object):
         """
         if pcap_filename == '' or packet_layers == '[]':
             return
-        packet = configure_packet_layers(packet_layers)
+        packet = packet_templates.get(packet_layers).packet
         wrpcap('pcap_files/' + pcap_filename, packet)
 
+    @cherrypy.expose
+    def save_packet_sequence_to_file(self, pcap_filename, packet_layers,
+                                     layer_type, field, start, count):
+        """Makes a sequence of packets that sweeps a field, and saves it to
+        the pcap_files/ directory.
+
+        Args:
+            pcap_filename (str): Name of the file to save it to.
+            packet_layers, layer_type, field, start, count: See
+                packet_sequence_config above.
+        """
+        if pcap_filename == '' or packet_layers == '[]':
+            return
+        variants = sweep_packet(packet_layers, layer_type, field, start, count)
+        pv.write_pcap('pcap_files/' + pcap_filename, variants)
+
     @cherrypy.expose
     def return_pcap_file(self, packet_layers):
         """Contructs a packet, makes a pcap file, and returns the contents.
@@ -299,7 +645,7 @@ class PacketServer(object):
         """
         if packet_layers == '[]':
             return
-        packet = configure_packet_layers(packet_layers)
+        packet = packet_templates.get(packet_layers).packet
         pcap_filename = '/tmp/temp_pcap_file.pcap'
         wrpcap(pcap_filename, packet)
         with open(pcap_filename, 'r') as pcap_file:
@@ -317,54 +663,136 @@ class PacketServer(object):
         Returns:
             JSON: List of filenames in an array, encoded in JSON format.
         """
-        return json.dumps(os.listdir('pcap_files'))
+        return json.dumps(pcap_index.filenames())
 
     @cherrypy.expose
-    def load_pcap_file(self, filename):
+    def get_pcap_library(self):
+        """Returns what is in each file in pcap_files.
+
+        The files are only read the first time, and again when they change;
+        see pcap_library.
+
+        Returns:
+            JSON: Dictionary of filenames to their summaries. As an example:
+                {
+                    'capture.pcap':
+                    {
+                        'packets': 1000, 'bytes': 64000,
+                        'first': 1475000000.5, 'last': 1475000010.5,
+                        'duration': 10.0, 'linktype': 1,
+                        'sizes': [['0-64', 1000], ['65-127', 0], ...],
+                        'protocols': [['IPv4/UDP', 990], ['ARP', 10]],
+                        'mtime': 1475000011.0, 'size': 80024
+                    },
+                    'notes.txt':
+                    {
+                        'error': 'Not a pcap or pcapng file',
+                        'mtime': 1475000011.0, 'size': 120
+                    }
+                }
+        """
+        return json.dumps(pcap_index.summaries())
+
+    @cherrypy.expose
+    def load_pcap_file(self, filename, number='0'):
         """Takes a filename, and attempts to load it from pcap_files/.
 
-        Reads the files, takes the first packet that is specified in that
-        file, and then sends it over to the C side for sending.
+        Takes a packet in that file as is, without dissecting it, and then
+        sends it over to the C side for sending. The first packet is read
+        without reading the rest of the file; for later ones, the index of
+        the file is used to skip most of the way there.
 
         Args:
             filename (str): Name of the file located in the pcap_files dir.
+            number (str): Which packet in the file to load, from 0.
         """
         if filename == '':
             return
+        number = int(number)
         try:
-            packet = rdpcap('pcap_files/' + filename)[0]
+            if number == 0:
+                packet = pcap_reader.first_packet('pcap_files/' + filename)
+            else:
+                packet = pcap_index.packet(filename, number)
         except IOError:
+            print filename, "doesn't exist, or isn't a pcap file."
+            return
+        except IndexError as error:
+            print error
+            return
+        if packet is None:
+            return
+        with c_pool.connection() as c_client:
+            c_client.send(0, packet)
+
+    @cherrypy.expose
+    def replay_pcap_file(self, filename, timing='ORIGINAL', scale='1',
+                         loops='1'):
+        """Has the C side replay every packet of a file in pcap_files/.
+
+        The C side reads the file itself, a packet at a time, so it can be as
+        big as the disk allows. It starts sending right away, and goes back
+        to the configured packet after stop_replay.
+
+        Args:
+            filename (str): Name of the file located in the pcap_files dir.
+            timing (str): ORIGINAL to keep the captured gaps between packets,
+                SCALED to multiply them by scale, or MAX_RATE to send the
+                packets back to back.
+            scale (str): What to multiply the gaps by, for SCALED.
+            loops (str): How many times to go through the file, 0 to keep
+                going until stopped.
+        """
+        if filename == '':
+            return
+        path = 'pcap_files/' + filename
+        if not os.path.isfile(path):
             print filename, "doesn't exist."
             return
-        packet = conversions.convert_packet_int_array(packet)
-        SEASIDE.send_SEASIDE(c_socket, c_socket_lock, 0, packet)
+        data = SEASIDE.pack_SEASIDE_replay(path,
+                                           SEASIDE.REPLAY_TIMING[timing],
+                                           float(scale), int(loops))
+        with c_pool.connection() as c_client:
+            c_client.send(SEASIDE.SEASIDE_FLAGS.START_REPLAY.value, data)
+
+    @cherrypy.expose
+    def stop_replay(self):
+        """Stops a replay started by replay_pcap_file."""
+        with c_pool.connection() as c_client:
+            c_client.send(SEASIDE.SEASIDE_FLAGS.STOP_REPLAY.value)
 
     @cherrypy.expose
     def upload_pcap_file(self, file_data):
-        """Takes a pcap file, and sends it to the C side for sending.
+        """Takes a pcap file, and sends its first packet to the C side for
+        sending.
+
+        The packet is read straight from the file CherryPy received the
+        upload into, see load_pcap_file.
 
         Args:
             file_data (File): A CherryPy representation of a file.
-
-        TODO: Find a way to remove that NamedTemporaryFile middleman.
         """
-        pcap_file = tempfile.NamedTemporaryFile()
-        pcap_file.write(bytearray(file_data.file.read()))
-        pcap_file.seek(0)
-        packet = rdpcap(pcap_file.name)[0]
-        packet = conversions.convert_packet_int_array(packet)
-        SEASIDE.send_SEASIDE(c_socket, c_socket_lock, 0, packet)
+        try:
+            packet = pcap_reader.first_packet(file_data.file)
+        except IOError:
+            print file_data.filename, "isn't a pcap file."
+            return
+        if packet is None:
+            return
+        with c_pool.connection() as c_client:
+            c_client.send(0, packet)
 
         # SIDE-EFFECT REQUESTS END HERE
 
 if __name__ == '__main__':
+    show_packets = '--quiet' not in sys.argv
     os.chdir('sender_files/website/')
-    c_socket = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    pcap_index = pcap_library.PcapLibrary('pcap_files')
     while True:
         try:
-            c_socket.connect('/tmp/send_socket')
+            subscribe_stats()
             break
-        except:
+        except socket.error:
             time.sleep(1)
             print 'Trying to connect...'
 
@@ -6,29 +6,517 @@ without expecting a response and is used to send instructions to the C-side.
 The other waits for a response and is used to request statistical information
 such as bandwidth usage.
 
+For callers that share one connection between several threads, the
+SEASIDE_Client class tags each request with an ID, so several requests can be
+in flight at once and nobody has to hold the socket for a whole round trip.
+
 SEASIDE_FLAGS: The enum of SEASIDE flags.
 send_SEASIDE: sends a SEASIDE message without waiting for a response.
+send_SEASIDE_batch: sends several SEASIDE messages in a single write.
 request_SEASIDE: sends a SEASIDE message and returns the C-side's response.
+read_SEASIDE_frame: reads exactly one SEASIDE message from a socket.
+SEASIDE_Future: the pending response to a tagged request.
+SEASIDE_Client: a pipelined SEASIDE connection with a background reader.
+SEASIDE_Stats: a statistics record pushed by the C-side.
+SEASIDE_Burst: the result of a burst sent with SEND_BURST.
+SEASIDE_TX_Stats: the sending side's transmit counters, from GET_TX_STATS.
+SEASIDE_Gaps: the receiving side's histogram of the gaps between packets.
+unpack_SEASIDE_gaps: unpacks the response to a GET_GAPS.
+SEASIDE_RX_Rate: the rate received over a window, from GET_RX_RATES.
+SEASIDE_Packet: a received packet, from GET_PACKETS.
+unpack_SEASIDE_packets: unpacks the response to a GET_PACKETS.
+SEASIDE_Flow: a flow on the receiving side, from GET_FLOWS.
+unpack_SEASIDE_flows: unpacks the response to a GET_FLOWS.
+SEASIDE_Pool: a bounded pool of SEASIDE_Clients with health checks.
+send_SEASIDE_coroutine: send_SEASIDE for sockets run by an EventLoop.
+request_SEASIDE_coroutine: request_SEASIDE for sockets run by an EventLoop.
 """
 
+import collections
+import contextlib
 import conversions
+import event_loop
+import os
+import Queue
+import socket as socket_module
 import struct
+import threading
+import time
 from enum import Enum
 
 SEASIDE_FLAGS = Enum('SEASIDE_FLAGS',
                      'PACKET START STOP DELAY NUM_PACKETS SINGLE_PACKET\
                      GET_PACKET GET_BANDWIDTH GET_PACKET_SIZE START_SEQUENCE\
-                     STOP_SEQUENCE',
+                     STOP_SEQUENCE RESPONSE SUBSCRIBE_STATS STATS\
+                     SET_MUTATORS START_REPLAY STOP_REPLAY SET_RATE\
+                     SEND_BURST GET_TX_STATS GET_GAPS GET_RX_RATES\
+                     GET_PACKETS GET_FLOWS',
                      start=0)
 
+# How a START_REPLAY times the packets of the capture: with the gaps they
+# were captured with, with those gaps multiplied by a scale, or back to back.
+REPLAY_TIMING = Enum('REPLAY_TIMING', 'ORIGINAL SCALED MAX_RATE', start=0)
+
+# What the rate of a SET_RATE is in: packets or bits per second.
+RATE_UNIT = Enum('RATE_UNIT', 'PPS BPS', start=0)
+
+# The SEASIDE header: a one-byte flag followed by two bytes of data size.
+SEASIDE_HEADER = struct.Struct('=BH')
+
+# Set on the flag of a message that carries a request ID. The ID is four
+# bytes that follow the header (and are not counted in the size), and the
+# C-side echoes it in the header of its response.
+TAGGED = 0x80
+REQUEST_ID = struct.Struct('=I')
+
+# The statistics record the C-side pushes after a SUBSCRIBE_STATS: a
+# CLOCK_MONOTONIC timestamp in nanoseconds, the bandwidth in bits/s, and the
+# number of packets sent (or received, on the receiving side).
+STATS_RECORD = struct.Struct('=QQQ')
+SEASIDE_Stats = collections.namedtuple('SEASIDE_Stats',
+                                       'timestamp bandwidth packets')
+
+# The subscription data: the push interval in milliseconds, 0 to unsubscribe.
+STATS_INTERVAL = struct.Struct('=I')
+
+# The data of a SEND_BURST: the number of packets, and the gap from the start
+# of one to the next in nanoseconds (0 for back to back). The C-side's
+# response, once the burst is over, is the number of packets sent and the
+# time it took in nanoseconds.
+BURST = struct.Struct('=QQ')
+BURST_RESULT = struct.Struct('=QQ')
+SEASIDE_Burst = collections.namedtuple('SEASIDE_Burst', 'sent duration')
+
+# The response to a GET_TX_STATS: the packets and bytes sent since the C-side
+# started, the packets it couldn't send, how many times the device's queue
+# was full and it had to try again, and the packets/s and bits/s it achieved
+# over the last second.
+TX_STATS = struct.Struct('=QQQQQQ')
+SEASIDE_TX_Stats = collections.namedtuple(
+    'SEASIDE_TX_Stats', 'packets bytes errors retries pps bps')
+
+# The response to a GET_GAPS, all in nanoseconds: the number of gaps between
+# received packets, the shortest, longest and mean gap, their 50th, 99th and
+# 99.9th percentiles, and then the count of each of GAP_BUCKETS buckets of
+# the histogram. Gaps shorter than 2 * GAP_SUB_BUCKETS ns get a bucket each,
+# and every doubling from there on is split into GAP_SUB_BUCKETS buckets (see
+# gap_bucket_bounds); the last bucket also holds any gaps longer than it.
+# Sending a nonzero byte with the request starts the histogram over after it.
+GAP_SUB_BUCKETS = 8
+GAP_BUCKETS = 264
+GAPS = struct.Struct('=QQQQQQQ%dQ' % GAP_BUCKETS)
+SEASIDE_Gaps = collections.namedtuple(
+    'SEASIDE_Gaps', 'count min max mean p50 p99 p999 histogram')
+
+# The data of a GET_RX_RATES is any number (up to RX_RATE_MAX_WINDOWS) of
+# windows in milliseconds, or none for RX_RATE_DEFAULT_WINDOWS. For each, the
+# C-side responds with the window (shortened to RX_RATE_MAX_WINDOW, if it was
+# longer), and the bits/s and packets/s received over it.
+RX_RATE_WINDOW = struct.Struct('=I')
+RX_RATE = struct.Struct('=IQQ')
+RX_RATE_MAX_WINDOWS = 16
+RX_RATE_MAX_WINDOW = 16.383
+RX_RATE_DEFAULT_WINDOWS = (0.1, 1, 10)
+SEASIDE_RX_Rate = collections.namedtuple('SEASIDE_RX_Rate', 'window bps pps')
+
+# The data of a GET_PACKETS: the sequence number of the last packet already
+# seen (0 for none), and the most packets to return. The response starts with
+# the sequence number of the last packet received (i.e. how many have been
+# received), and the number of packets in it. Each packet follows, oldest
+# first: its sequence number, timestamp in nanoseconds, length on the wire and
+# how much of it is included, and then that much of it. The receiving side
+# keeps the last PACKETS_KEPT packets, and the first PACKETS_SNAPLEN bytes of
+# each.
+PACKETS_REQUEST = struct.Struct('=QI')
+PACKETS_HEADER = struct.Struct('=QI')
+PACKET_RECORD = struct.Struct('=QQII')
+PACKETS_KEPT = 1024
+PACKETS_SNAPLEN = 2048
+SEASIDE_Packet = collections.namedtuple('SEASIDE_Packet',
+                                        'seq timestamp length data')
+
+# What a GET_FLOWS orders the flows by.
+FLOW_ORDER = Enum('FLOW_ORDER', 'BYTES PACKETS', start=0)
+
+# The data of a GET_FLOWS: the order (see FLOW_ORDER), and how many of the
+# top flows to return, up to FLOWS_MAX_TOP. The response starts with the
+# number of flows with a packet in the last minute, the number of flows
+# evicted from the receiving side's table to make room for new ones, and the
+# number of flows that follow, from the top down. Each flow is its VLAN ID (0
+# if untagged), ethertype, IP protocol, source and destination ports, source
+# and destination addresses (IPv4 ones in the first four bytes), then its
+# packets and bytes, the timestamps of its first and last packet and the
+# longest gap between two of them, in nanoseconds.
+FLOWS_REQUEST = struct.Struct('=BH')
+FLOWS_HEADER = struct.Struct('=QQI')
+FLOW_RECORD = struct.Struct('=HHHHH16s16sQQQQQ')
+FLOWS_MAX_TOP = 64
+SEASIDE_Flow = collections.namedtuple(
+    'SEASIDE_Flow', 'vlan ethertype protocol src dst src_port dst_port '
+    'packets bytes first last max_gap')
+
+# A size of EXTENDED_SIZE in the header means the data is too big for two
+# bytes. Its real size follows the header as four bytes (before the request
+# ID, if tagged), and is not counted in the size either.
+EXTENDED_SIZE = 0xFFFF
+EXTENDED_LENGTH = struct.Struct('=I')
+
+# The largest amount of data a single SEASIDE message can carry; the C-side
+# drops the connection if a message is any bigger.
+MAX_DATA_SIZE = 16 * 1024 * 1024
+
+# The biggest packet the C-side will send, big enough for jumbo frames.
+MAX_PACKET_SIZE = 0xFFFF
+
+# In the data of a START_SEQUENCE, every packet is preceded by its length.
+SEQUENCE_LENGTH = struct.Struct('=H')
+
+# The most packets a sequence can hold on the C-side.
+MAX_SEQUENCE_PACKETS = 65536
+
+# A field mutator in the data of a SET_MUTATORS: the offset of the field in
+# the packet, its width in bytes (1, 2 or 4), and the step, min and max of
+# its value.
+MUTATOR = struct.Struct('=HBIII')
+
+# The most field mutators the C-side can apply to a packet.
+MAX_MUTATORS = 8
+
+# The options at the start of the data of a START_REPLAY: the timing (see
+# REPLAY_TIMING), the number of loops through the file (0 for no end), and
+# the scale of the gaps. The path of the capture file follows them.
+REPLAY = struct.Struct('=BId')
+
+# The data of a SET_RATE: the unit (see RATE_UNIT) and the rate.
+RATE = struct.Struct('=Bd')
+
+# Data that can go on the socket as is, without converting it first.
+_BUFFER_TYPES = (str, bytearray, memoryview, buffer)
+
+# Scratch space for read_SEASIDE_frame. Kept per thread so that threads
+# reading from different sockets never share a buffer.
+_frame_buffers = threading.local()
+
+
+def pack_SEASIDE_header(SEASIDE_flag, size, request_id=None):
+    """Packs the header of a SEASIDE message.
+
+    Messages with EXTENDED_SIZE bytes of data or more (e.g. jumbo frame
+    sequences) get an extended size, and tagged requests get their ID.
+
+    Args:
+        SEASIDE_flag (int): the flag of the message, see send_SEASIDE.
+        size (int): the number of bytes of data that follow the header.
+        request_id (int): the ID of a tagged request, or None.
+
+    Returns:
+        str: The header, ready to go in front of the data.
+
+    Raises:
+        ValueError: if size is bigger than MAX_DATA_SIZE.
+    """
+    if size > MAX_DATA_SIZE:
+        raise ValueError('SEASIDE data of %d bytes is over the %d byte limit'
+                         % (size, MAX_DATA_SIZE))
+    if size < EXTENDED_SIZE:
+        header = SEASIDE_HEADER.pack(SEASIDE_flag, size)
+    else:
+        header = (SEASIDE_HEADER.pack(SEASIDE_flag, EXTENDED_SIZE)
+                  + EXTENDED_LENGTH.pack(size))
+    if request_id is not None:
+        header = (chr(ord(header[0]) | TAGGED) + header[1:]
+                  + REQUEST_ID.pack(request_id))
+    return header
+
+
+def _payload(data):
+    """Returns data in a form that can be written to a socket.
+
+    Bytes (e.g. from conversions.convert_packet_bytes) and buffers are used
+    as they are; only int arrays are converted.
+    """
+    if data is None:
+        return ''
+    if isinstance(data, _BUFFER_TYPES):
+        return data
+    return bytearray(data)
+
+
+def frame_SEASIDE(SEASIDE_flag, data=None, request_id=None):
+    """Builds a whole SEASIDE message: the header followed by the data.
+
+    The data is copied once, straight after the header, so the message can go
+    out in a single write. (Python 2 has no socket.sendmsg to gather the two
+    without copying, and a copy is much cheaper than a second system call.)
+
+    Args:
+        SEASIDE_flag (int): the flag of the message, see send_SEASIDE.
+        data (str, buffer or int array): the data of the message, if any.
+        request_id (int): the ID of a tagged request, or None.
+
+    Returns:
+        str or bytearray: The message, ready to be sent.
+    """
+    data = _payload(data)
+    header = pack_SEASIDE_header(SEASIDE_flag, len(data), request_id)
+    if isinstance(data, str):
+        return header + data
+    message = bytearray(header)
+    message += data
+    return message
+
+
+def pack_SEASIDE_sequence(packets):
+    """Packs packets into the data of a START_SEQUENCE message.
+
+    The C-side copies them into one contiguous buffer, and cycles through
+    them while sending, e.g. to spread traffic over many flows by sweeping
+    ports or addresses.
+
+    Args:
+        packets (list of str): the raw bytes of each packet (see
+                               conversions.convert_packet_bytes), in the
+                               order they should be sent.
+
+    Returns:
+        bytearray: The data for a START_SEQUENCE message.
+
+    Raises:
+        ValueError: if there are no packets, too many of them, or one of
+                    them is empty or too big.
+    """
+    if not 0 < len(packets) <= MAX_SEQUENCE_PACKETS:
+        raise ValueError('A sequence must have 1 to %d packets, not %d'
+                         % (MAX_SEQUENCE_PACKETS, len(packets)))
+    data = bytearray()
+    for packet in packets:
+        if not 0 < len(packet) <= MAX_PACKET_SIZE:
+            raise ValueError('Packet of %d bytes can not be in a sequence'
+                             % len(packet))
+        data += SEQUENCE_LENGTH.pack(len(packet))
+        data += packet
+    return data
+
+
+def pack_SEASIDE_mutators(mutators):
+    """Packs field mutators into the data of a SET_MUTATORS message.
+
+    After every packet it sends, the C-side counts each field up by its step,
+    wrapping around from max back to min, and fixes up the IP and UDP/TCP
+    checksums incrementally. That varies flows (e.g. by sweeping ports or
+    addresses) at full send rate without sending any more packets over. The
+    mutators are dropped when a new packet is sent over.
+
+    Args:
+        mutators (list of tuples): (offset, width, step, min, max) for each
+                                   field, with the offset in bytes from the
+                                   start of the packet, and the width 1, 2 or
+                                   4 bytes. See packet_variants.field_mutator
+                                   to find these for a known field.
+
+    Returns:
+        str: The data for a SET_MUTATORS message.
+
+    Raises:
+        ValueError: if there are too many mutators.
+    """
+    if len(mutators) > MAX_MUTATORS:
+        raise ValueError('At most %d mutators, not %d'
+                         % (MAX_MUTATORS, len(mutators)))
+    return ''.join(MUTATOR.pack(*mutator) for mutator in mutators)
+
+
+def pack_SEASIDE_replay(path, timing=REPLAY_TIMING.ORIGINAL, scale=1.0,
+                        loops=1):
+    """Packs the data of a START_REPLAY message.
+
+    The C-side reads the capture file itself, one packet at a time, so it can
+    be any size; it must be somewhere the C-side can read it.
+
+    Args:
+        path (str): the path of the pcap (or pcapng) file to replay. It is
+                    made absolute, since the C-side runs in another directory.
+        timing (REPLAY_TIMING): how to time the packets.
+        scale (float): what to multiply the gaps between packets by, with
+                       REPLAY_TIMING.SCALED (e.g. 0.5 replays twice as fast).
+        loops (int): how many times to go through the file, 0 to keep
+                     going until STOP_REPLAY.
+
+    Returns:
+        str: The data for a START_REPLAY message.
+
+    Raises:
+        ValueError: if the scale or loops are negative.
+    """
+    if scale < 0 or loops < 0:
+        raise ValueError('Scale and loops must not be negative')
+    path = os.path.abspath(path)
+    if isinstance(path, unicode):
+        path = path.encode('utf-8')
+    return REPLAY.pack(timing.value, loops, scale) + path
+
+
+def pack_SEASIDE_rate(rate, unit=RATE_UNIT.PPS):
+    """Packs the data of a SET_RATE message.
+
+    Unlike a delay, the C-side keeps to a rate by sending every packet at an
+    absolute deadline, so its timing errors don't add up over many packets.
+    In bits per second, the gap after each packet depends on its size.
+
+    Args:
+        rate (float): the packets or bits to send per second, or 0 to go
+                      back to the delay.
+        unit (RATE_UNIT): what the rate is in.
+
+    Returns:
+        str: The data for a SET_RATE message.
+
+    Raises:
+        ValueError: if the rate is negative.
+    """
+    if not rate >= 0:
+        raise ValueError('Rate must not be negative')
+    return RATE.pack(unit.value, rate)
+
+
+def pack_SEASIDE_burst(count, gap=0):
+    """Packs the data of a SEND_BURST message.
+
+    Args:
+        count (int): the number of packets to send.
+        gap (float): seconds from the start of one packet to the next, or 0
+                     to send them back to back.
+
+    Returns:
+        str: The data for a SEND_BURST message.
+
+    Raises:
+        ValueError: if the count isn't positive, or the gap is negative.
+    """
+    if count <= 0 or gap < 0:
+        raise ValueError('A burst needs a positive count and gap >= 0')
+    return BURST.pack(count, int(round(gap * 1e9)))
+
+
+def gap_bucket_bounds(bucket):
+    """Returns the gaps, in nanoseconds, that fall in a bucket of a GET_GAPS
+    histogram, as (lowest, highest + 1)."""
+    if bucket < 2 * GAP_SUB_BUCKETS:
+        return bucket, bucket + 1
+    shift = bucket // GAP_SUB_BUCKETS - 1
+    lowest = (bucket % GAP_SUB_BUCKETS + GAP_SUB_BUCKETS) << shift
+    return lowest, lowest + (1 << shift)
+
+
+def unpack_SEASIDE_gaps(data):
+    """Unpacks the response to a GET_GAPS.
+
+    Args:
+        data (str): the data of the C-side's response.
+
+    Returns:
+        SEASIDE_Gaps: the statistics, in nanoseconds, with the histogram as
+        a list of (lowest, highest + 1, count) for each bucket that isn't
+        empty, shortest gaps first.
+    """
+    fields = GAPS.unpack_from(data)
+    histogram = [gap_bucket_bounds(bucket) + (count,)
+                 for bucket, count in enumerate(fields[7:]) if count]
+    return SEASIDE_Gaps(*(fields[:7] + (histogram,)))
+
+
+def pack_SEASIDE_rx_windows(windows):
+    """Packs the data of a GET_RX_RATES.
+
+    Args:
+        windows (list of float): the windows to measure the rate over, in
+                                 seconds, see RX_RATE.
+
+    Returns:
+        str: The bytes of the windows.
+
+    Raises:
+        ValueError: if there are more than RX_RATE_MAX_WINDOWS windows.
+    """
+    if len(windows) > RX_RATE_MAX_WINDOWS:
+        raise ValueError('At most %d windows' % RX_RATE_MAX_WINDOWS)
+    return ''.join(RX_RATE_WINDOW.pack(int(round(window * 1000)))
+                   for window in windows)
+
+
+def unpack_SEASIDE_rx_rates(data):
+    """Unpacks the response to a GET_RX_RATES.
+
+    Returns:
+        list of SEASIDE_RX_Rate: the rate over each window, with the windows
+        in seconds, in the order they were asked for.
+    """
+    rates = []
+    for offset in xrange(0, len(data) - RX_RATE.size + 1, RX_RATE.size):
+        window_ms, bps, pps = RX_RATE.unpack_from(data, offset)
+        rates.append(SEASIDE_RX_Rate(window_ms / 1000.0, bps, pps))
+    return rates
+
+
+def unpack_SEASIDE_packets(data):
+    """Unpacks the response to a GET_PACKETS.
+
+    Returns:
+        tuple (int, list of SEASIDE_Packet): The sequence number of the last
+        packet received, and the packets in the response, oldest first,
+        with their timestamps in seconds.
+    """
+    last, count = PACKETS_HEADER.unpack_from(data)
+    packets = []
+    offset = PACKETS_HEADER.size
+    for _ in xrange(count):
+        seq, timestamp, length, caplen = PACKET_RECORD.unpack_from(data,
+                                                                   offset)
+        offset += PACKET_RECORD.size
+        packets.append(SEASIDE_Packet(seq, timestamp / 1e9, length,
+                                      data[offset:offset + caplen]))
+        offset += caplen
+    return last, packets
+
+
+def _flow_address(ethertype, address):
+    """Formats an address of a flow, or returns None if it has none."""
+    if ethertype == 0x0800:
+        return socket_module.inet_ntop(socket_module.AF_INET, address[:4])
+    if ethertype == 0x86DD:
+        return socket_module.inet_ntop(socket_module.AF_INET6, address)
+    return None
+
+
+def unpack_SEASIDE_flows(data):
+    """Unpacks the response to a GET_FLOWS.
+
+    Returns:
+        tuple (int, int, list of SEASIDE_Flow): The number of active flows,
+        the number evicted, and the top flows, with their addresses as
+        strings (None if they aren't IP) and their times in seconds.
+    """
+    active, evicted, count = FLOWS_HEADER.unpack_from(data)
+    flows = []
+    for i in xrange(count):
+        (vlan, ethertype, protocol, src_port, dst_port, src, dst, packets,
+         total, first, last, max_gap) = FLOW_RECORD.unpack_from(
+             data, FLOWS_HEADER.size + i * FLOW_RECORD.size)
+        flows.append(SEASIDE_Flow(
+            vlan, ethertype, protocol, _flow_address(ethertype, src),
+            _flow_address(ethertype, dst), src_port, dst_port, packets,
+            total, first / 1e9, last / 1e9, max_gap / 1e9))
+    return active, evicted, flows
+
 
 def send_SEASIDE(socket, socket_lock, SEASIDE_flag, data=None):
     """Sends a SEASIDE packet through the socket.
 
-    Converts the packet and the int array of data (including flag and size
-    information) to a byte array, and then sends it through the
-    provided socket. The header consists of a one-byte flag and two bytes
-    indicating the size of the data. Following the header is the data, if any.
+    Puts the header (flag and size information) in front of the data, and
+    then sends it through the provided socket in a single write. The header
+    consists of a one-byte flag and two bytes indicating the size of the data
+    (see pack_SEASIDE_header for data that is too big for two bytes).
+    Following the header is the data, if any.
 
     Args:
         socket (socket object): the socket to send the data to.
@@ -43,7 +531,8 @@ def send_SEASIDE(socket, socket_lock, SEASIDE_flag, data=None):
             3  - Set delay. Data contains the number of seconds and
                  microseconds to sleep between packets.
             4  - Number of packets. Requests the number of packets sent since
-                 startup from the C-side. Currently unimplemented.
+                 startup from the C-side (8 bytes), or received on the
+                 receiving side (4 bytes).
             5  - Single Packet. Instructs the C-side to send a single packet.
             6  - Get Packet. Requests the currently buffered packet from the
                  C-side.
@@ -51,21 +540,73 @@ def send_SEASIDE(socket, socket_lock, SEASIDE_flag, data=None):
                  C-side.
             8  - Get Packet Size. Requests the size of the currently
                  buffered packet from the C-side.
-            9  - Start Sequence. Currently unimplemented.
-            10 - Stop Sequence. Currently unimplemented.
+            9  - Start Sequence. Data contains a sequence of packets (see
+                 pack_SEASIDE_sequence) that the C-side cycles through
+                 instead of sending the same packet.
+            10 - Stop Sequence. Goes back to sending the single packet.
+            12 - Subscribe Stats. Data contains the number of milliseconds
+                 between statistics pushes, or 0 to stop them. See
+                 SEASIDE_Client.subscribe_stats.
+            14 - Set Mutators. Data contains fields of the packet to change
+                 after every packet sent (see pack_SEASIDE_mutators), or
+                 nothing to stop changing them.
+            15 - Start Replay. Data contains a capture file for the C-side to
+                 replay instead of sending the packet (see
+                 pack_SEASIDE_replay). Starts sending right away.
+            16 - Stop Replay. Stops the replay, and goes back to the packet
+                 on the next start signal.
+            17 - Set Rate. Data contains a rate in packets or bits per second
+                 to send at instead of the delay (see pack_SEASIDE_rate).
+                 Setting the delay goes back to it.
+            18 - Send Burst. Data contains a number of packets for the C-side
+                 to send and then stop (see pack_SEASIDE_burst). It responds
+                 once they are sent, see SEASIDE_Client.send_burst.
+            19 - Get TX Stats. Requests all of the sending side's transmit
+                 counters at once, see SEASIDE_Client.tx_stats.
+            20 - Get Gaps. Requests the receiving side's histogram of the
+                 gaps between packets. Data can contain a nonzero byte to
+                 start it over, see SEASIDE_Client.gaps.
+            21 - Get RX Rates. Requests the rate the receiving side received
+                 at over several windows, see SEASIDE_Client.rx_rates.
+            22 - Get Packets. Requests the packets the receiving side
+                 received after a given one, see SEASIDE_Client.get_packets.
+            23 - Get Flows. Requests the receiving side's top flows by bytes
+                 or packets, see SEASIDE_Client.top_flows.
 
-        data (bytearray or int array): the data contained in the packet,
-                                       if any.
+        data (str, bytearray or int array): the data contained in the packet,
+                                            if any. Bytes are sent without
+                                            being converted, so prefer them
+                                            (see convert_packet_bytes).
     """
+    SEASIDE_message = frame_SEASIDE(SEASIDE_flag, data)
+    with socket_lock:
+        socket.sendall(SEASIDE_message)
 
-    if data is None:
-        data = []
 
-    SEASIDE_header = struct.pack('=BH', SEASIDE_flag, len(data))
+def send_SEASIDE_batch(socket, socket_lock, messages):
+    """Sends several SEASIDE messages through the socket in a single write.
+
+    The C-side parses messages by the size in their headers, so there is no
+    need to wait in between them; e.g. a new delay, a new packet and a start
+    signal can all go out at once, and are applied in order.
+
+    Args:
+        socket (socket object): the socket to send the data to.
+
+        socket_lock (RLock object): the lock associated with the socket, for
+                                   multithreading safety.
 
-    SEASIDE_packet = bytearray(data)
+        messages (list of tuples): (SEASIDE_flag, data) pairs, with data being
+                                   None if the message has no data. See
+                                   send_SEASIDE for the flags.
+    """
+    batch = bytearray()
+    for SEASIDE_flag, data in messages:
+        data = _payload(data)
+        batch += pack_SEASIDE_header(SEASIDE_flag, len(data))
+        batch += data
     with socket_lock:
-        socket.send(SEASIDE_header + SEASIDE_packet)
+        socket.sendall(batch)
 
 
 def request_SEASIDE(socket, socket_lock, SEASIDE_flag):
@@ -84,20 +625,607 @@ def request_SEASIDE(socket, socket_lock, SEASIDE_flag):
                  C-side.
             8  - Get Packet Size. Requests the size of the currently buffered
                  packet from the C-side.
+            19 - Get TX Stats. Requests the sending side's transmit counters
+                 (see TX_STATS).
+            20 - Get Gaps. Requests the receiving side's histogram of the
+                 gaps between packets (see unpack_SEASIDE_gaps).
+            21 - Get RX Rates. Requests the rate the receiving side received
+                 at over the last 0.1, 1 and 10 seconds (see RX_RATE).
+            22 - Get Packets. Requests all the packets the receiving side
+                 still has (see unpack_SEASIDE_packets).
+            23 - Get Flows. Requests the receiving side's top 10 flows by
+                 bytes (see unpack_SEASIDE_flows).
     Returns:
-        bytearray: The response from the C-side.
-
+        str: The data of the C-side's response, without the SEASIDE header.
     """
-    SEASIDE_header = struct.pack('=BH', SEASIDE_flag, 0)
-    data = ''
     with socket_lock:
-        socket.send(SEASIDE_header)
+        socket.sendall(pack_SEASIDE_header(SEASIDE_flag, 0))
+        flag, request_id, data = read_SEASIDE_frame(socket)
+    return data.tobytes()
+
+
+def _receive_exactly(socket, view):
+    """Fills view with bytes from the socket, using as few recvs as possible.
+
+    Raises:
+        EOFError: if the C-side closes the connection mid-message.
+    """
+    received = 0
+    while received < len(view):
+        n = socket.recv_into(view[received:])
+        if n == 0:
+            raise EOFError('SEASIDE connection closed by the C-side')
+        received += n
+
+
+def read_SEASIDE_frame(socket):
+    """Reads exactly one SEASIDE message from the socket.
+
+    The header is read into a preallocated buffer, and then exactly as many
+    bytes as the header announces are read into a reusable payload buffer,
+    so a full message costs a few recv calls and no string building. The
+    payload buffer grows to fit messages with an extended size. The caller
+    must hold the socket's lock.
+
+    Args:
+        socket (socket object): the socket to read the message from.
+
+    Returns:
+        tuple (int, int, memoryview): The flag of the message (without the
+        TAGGED bit), its request ID (None if it was not tagged) and a view of
+        its data. The view is only valid until the next call on this thread,
+        so copy it (e.g. view.tobytes()) if it needs to be kept.
+
+    Raises:
+        EOFError: if the connection closes mid-message.
+        ValueError: if the message is bigger than MAX_DATA_SIZE.
+    """
+    try:
+        header, header_view, payload_view = _frame_buffers.buffers
+    except AttributeError:
+        header = bytearray(REQUEST_ID.size)
+        header_view = memoryview(header)
+        payload_view = memoryview(bytearray(EXTENDED_SIZE))
+        _frame_buffers.buffers = (header, header_view, payload_view)
+
+    _receive_exactly(socket, header_view[:SEASIDE_HEADER.size])
+    flag, size = SEASIDE_HEADER.unpack_from(header)
+    if size == EXTENDED_SIZE:
+        _receive_exactly(socket, header_view[:EXTENDED_LENGTH.size])
+        size = EXTENDED_LENGTH.unpack_from(header)[0]
+        if size > MAX_DATA_SIZE:
+            raise ValueError('SEASIDE message of %d bytes is too big' % size)
+    request_id = None
+    if flag & TAGGED:
+        _receive_exactly(socket, header_view[:REQUEST_ID.size])
+        request_id = REQUEST_ID.unpack_from(header)[0]
+        flag &= ~TAGGED
+    if size > len(payload_view):
+        payload_view = memoryview(bytearray(size))
+        _frame_buffers.buffers = (header, header_view, payload_view)
+    data = payload_view[:size]
+    _receive_exactly(socket, data)
+    return flag, request_id, data
+
+
+class SEASIDE_Future(object):
+    """The response to a tagged request, filled in by the reader thread."""
+
+    def __init__(self):
+        self._done = threading.Event()
+        self._data = None
+        self._error = None
+
+    def set_result(self, data):
+        self._data = data
+        self._done.set()
+
+    def set_error(self, error):
+        self._error = error
+        self._done.set()
+
+    def done(self):
+        return self._done.is_set()
+
+    def result(self, timeout=None):
+        """Waits for the response and returns its data.
+
+        Args:
+            timeout (float): seconds to wait, or None to wait forever.
+
+        Returns:
+            str: The data of the C-side's response.
+
+        Raises:
+            EOFError: if the connection closed before the response arrived.
+            RuntimeError: if the response did not arrive within the timeout.
+        """
+        if not self._done.wait(timeout):
+            raise RuntimeError('Timed out waiting for a SEASIDE response')
+        if self._error is not None:
+            raise self._error
+        return self._data
+
+
+class SEASIDE_Client(object):
+    """A SEASIDE connection that keeps several requests in flight.
+
+    Each request is tagged with a request ID and gets a SEASIDE_Future. A
+    background thread reads every response off the socket and completes the
+    future with the matching ID, so the only thing callers serialize on is
+    the write of their own request.
+
+    Example:
+        client = SEASIDE_Client(c_socket)
+        bandwidth = client.request_async(SEASIDE_FLAGS.GET_BANDWIDTH.value)
+        packet = client.request(SEASIDE_FLAGS.GET_PACKET.value)
+        bandwidth = bandwidth.result()
+    """
+
+    def __init__(self, socket, timeout=None):
+        """Starts the reader thread on an already connected socket.
+
+        Args:
+            socket (socket object): the socket connected to the C-side.
+            timeout (float): default number of seconds request waits for a
+                             response, or None to wait forever.
+        """
+        self.socket = socket
+        self.socket_lock = threading.Lock()
+        self.timeout = timeout
+
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+        self._next_id = 0
+        self._closed = None
+        self._stats_callbacks = []
+
+        self._reader = threading.Thread(target=self._read_loop)
+        self._reader.daemon = True
+        self._reader.start()
+
+    def send(self, SEASIDE_flag, data=None):
+        """Sends a SEASIDE message without waiting for a response.
+
+        See send_SEASIDE for the flags and data.
+        """
+        send_SEASIDE(self.socket, self.socket_lock, SEASIDE_flag, data)
+
+    def send_batch(self, messages):
+        """Sends several SEASIDE messages in a single write.
+
+        See send_SEASIDE_batch for the format of messages.
+        """
+        send_SEASIDE_batch(self.socket, self.socket_lock, messages)
+
+    def request_async(self, SEASIDE_flag, data=None):
+        """Sends a tagged request and returns its SEASIDE_Future right away.
+
+        Args:
+            SEASIDE_flag (int): the request flag, see request_SEASIDE.
+            data (bytearray or str): the data of the request, if any.
+
+        Returns:
+            SEASIDE_Future: completed once the C-side responds.
+        """
+        future = SEASIDE_Future()
+        with self._pending_lock:
+            if self._closed is not None:
+                future.set_error(self._closed)
+                return future
+            request_id = self._next_id
+            self._next_id = (self._next_id + 1) & 0xFFFFFFFF
+            self._pending[request_id] = future
+
+        try:
+            message = frame_SEASIDE(SEASIDE_flag, data, request_id)
+            with self.socket_lock:
+                self.socket.sendall(message)
+        except Exception as error:
+            with self._pending_lock:
+                self._pending.pop(request_id, None)
+            future.set_error(error)
+        return future
+
+    def request(self, SEASIDE_flag, data=None, timeout=None):
+        """Sends a tagged request and waits for the response.
+
+        Args:
+            timeout (float): seconds to wait, overriding the client's default.
+
+        Returns:
+            str: The data of the C-side's response.
+        """
+        if timeout is None:
+            timeout = self.timeout
+        return self.request_async(SEASIDE_flag, data).result(timeout)
+
+    @property
+    def closed(self):
+        """Whether the connection to the C-side has been lost."""
+        return self._closed is not None
+
+    def subscribe_stats(self, interval, callback=None):
+        """Asks the C-side to push statistics every interval seconds.
+
+        Instead of polling GET_BANDWIDTH, the C-side pushes a SEASIDE_Stats
+        record over this connection on its own schedule, down to every 10
+        milliseconds. There is one schedule per connection, so the latest
+        interval subscribed to applies to every subscriber.
+
+        Args:
+            interval (float): seconds between pushes.
+            callback (function): called from the reader thread with each
+                                 SEASIDE_Stats. It must not block.
+
+        Returns:
+            iterator: If no callback is given, an iterator that blocks for and
+            yields each SEASIDE_Stats. If it falls behind, the oldest records
+            are dropped.
+        """
+        records = None
+        if callback is None:
+            records = Queue.Queue(maxsize=64)
+
+            def callback(stats):
+                if records.full():
+                    try:
+                        records.get_nowait()
+                    except Queue.Empty:
+                        pass
+                records.put_nowait(stats)
+
+        self._stats_callbacks.append(callback)
+        self.send(SEASIDE_FLAGS.SUBSCRIBE_STATS.value,
+                  STATS_INTERVAL.pack(max(1, int(interval * 1000))))
+
+        if records is not None:
+            return self._iterate_stats(records)
+
+    def send_burst(self, count, gap=0, timeout=None):
+        """Has the C-side send exactly count packets, and waits for it.
+
+        The packets go out back to back, or each gap after the one before,
+        without a round trip per packet. Whatever was being sent before is
+        stopped, and sending stays stopped once the burst is over. A STOP
+        (e.g. from another connection) ends the burst early. Statistics
+        pushes to this connection pause until the burst is over.
+
+        Args:
+            count (int): the number of packets to send.
+            gap (float): seconds from the start of one packet to the next, or
+                         0 to send them back to back.
+            timeout (float): seconds to wait for the burst, or None to wait
+                             however long it takes.
+
+        Returns:
+            SEASIDE_Burst: the number of packets sent, and the nanoseconds
+            from sending the first to having sent the last.
+
+        Raises:
+            ValueError: if the C-side rejected the burst (e.g. because it has
+                        no packet to send).
+        """
+        data = self.request_async(SEASIDE_FLAGS.SEND_BURST.value,
+                                  pack_SEASIDE_burst(count, gap)).result(
+                                      timeout)
+        if len(data) < BURST_RESULT.size:
+            raise ValueError('The C-side rejected the burst')
+        return SEASIDE_Burst(*BURST_RESULT.unpack_from(data))
+
+    def tx_stats(self, timeout=None):
+        """Requests the sending side's transmit counters.
+
+        Comparing the achieved rate with the one that was asked for shows
+        whether the C-side kept up with it, and the errors and retries show
+        why not, if it didn't.
+
+        Args:
+            timeout (float): seconds to wait, overriding the client's default.
+
+        Returns:
+            SEASIDE_TX_Stats: the counters.
+        """
+        data = self.request(SEASIDE_FLAGS.GET_TX_STATS.value, timeout=timeout)
+        return SEASIDE_TX_Stats(*TX_STATS.unpack_from(data))
+
+    def gaps(self, reset=False, timeout=None):
+        """Requests the receiving side's histogram of the gaps between
+        packets.
+
+        The percentiles show how evenly the packets arrive (the jitter)
+        where the bandwidth alone can't, e.g. a sender that bunches them up.
+
+        Args:
+            reset (bool): start the histogram over once it has been read, so
+                          the next request only covers the packets from now.
+            timeout (float): seconds to wait, overriding the client's default.
+
+        Returns:
+            SEASIDE_Gaps: the statistics, see unpack_SEASIDE_gaps.
+        """
+        data = self.request(SEASIDE_FLAGS.GET_GAPS.value,
+                            '\x01' if reset else None, timeout=timeout)
+        return unpack_SEASIDE_gaps(data)
+
+    def rx_rates(self, windows=RX_RATE_DEFAULT_WINDOWS, timeout=None):
+        """Requests the rate the receiving side received at, over the last
+        few windows of time.
+
+        Each rate counts every byte received over its window, so unlike
+        extrapolating from the gap between two packets, it holds steady with
+        bursts and mixed packet sizes.
+
+        Args:
+            windows (list of float): the windows in seconds, up to
+                                     RX_RATE_MAX_WINDOWS of them. Windows
+                                     are measured to the millisecond, and
+                                     longer ones than RX_RATE_MAX_WINDOW
+                                     are shortened to it.
+            timeout (float): seconds to wait, overriding the client's default.
+
+        Returns:
+            list of SEASIDE_RX_Rate: the rate over each window.
+        """
+        data = self.request(SEASIDE_FLAGS.GET_RX_RATES.value,
+                            pack_SEASIDE_rx_windows(windows), timeout=timeout)
+        return unpack_SEASIDE_rx_rates(data)
+
+    def get_packets(self, since=0, max_packets=0xFFFFFFFF, timeout=None):
+        """Requests the packets the receiving side received after a given
+        one.
+
+        Polling with the sequence number of the last packet from the
+        previous poll gets every packet in between, as long as fewer than
+        PACKETS_KEPT arrived in the meantime (and the last number shows how
+        many were missed if not). A single response holds up to 256 KB of
+        packets, so poll again if the last packet in it isn't the last one
+        received.
+
+        Args:
+            since (int): the sequence number of the last packet already seen,
+                         0 for all of them.
+            max_packets (int): the most packets to return.
+            timeout (float): seconds to wait, overriding the client's default.
+
+        Returns:
+            tuple (int, list of SEASIDE_Packet): see unpack_SEASIDE_packets.
+        """
+        data = self.request(SEASIDE_FLAGS.GET_PACKETS.value,
+                            PACKETS_REQUEST.pack(since, max_packets),
+                            timeout=timeout)
+        return unpack_SEASIDE_packets(data)
+
+    def top_flows(self, count=10, order=FLOW_ORDER.BYTES, timeout=None):
+        """Requests the receiving side's top flows.
+
+        Packets are told apart into flows by VLAN, ethertype, IP protocol,
+        addresses and ports, so with traffic spread over several flows, this
+        shows how much of each arrived, e.g. to spot flows that a link
+        aggregation hash put on a congested link.
+
+        Args:
+            count (int): how many flows, up to FLOWS_MAX_TOP.
+            order (FLOW_ORDER): whether the top flows are the ones with the
+                                most bytes or the most packets.
+            timeout (float): seconds to wait, overriding the client's default.
+
+        Returns:
+            tuple (int, int, list of SEASIDE_Flow): see unpack_SEASIDE_flows.
+        """
+        data = self.request(SEASIDE_FLAGS.GET_FLOWS.value,
+                            FLOWS_REQUEST.pack(order.value, count),
+                            timeout=timeout)
+        return unpack_SEASIDE_flows(data)
+
+    def unsubscribe_stats(self):
+        """Stops the C-side's statistics pushes, and drops all subscribers."""
+        self.send(SEASIDE_FLAGS.SUBSCRIBE_STATS.value, STATS_INTERVAL.pack(0))
+        self._stats_callbacks = []
+
+    def _iterate_stats(self, records):
         while True:
-            data += (socket.recv(4096))
-            if len(data) < 3:
+            # A timeout keeps the wait interruptible by KeyboardInterrupt.
+            try:
+                yield records.get(timeout=3600)
+            except Queue.Empty:
                 continue
-            print repr(data), len(data), struct.unpack('=H', data[1:3])[0] + 3
-            if len(data) >= struct.unpack('=H', data[1:3])[0] + 3:
-                break
-    print repr(data)
-    return data[3:]
+
+    def close(self):
+        """Shuts down the connection; pending requests fail with EOFError."""
+        try:
+            self.socket.shutdown(socket_module.SHUT_RDWR)
+        except socket_module.error:
+            pass
+        self.socket.close()
+
+    def _read_loop(self):
+        """Reads responses forever, completing the matching futures."""
+        try:
+            while True:
+                flag, request_id, data = read_SEASIDE_frame(self.socket)
+                if flag == SEASIDE_FLAGS.STATS.value and request_id is None:
+                    stats = SEASIDE_Stats(*STATS_RECORD.unpack_from(data))
+                    for callback in self._stats_callbacks:
+                        callback(stats)
+                    continue
+                with self._pending_lock:
+                    future = self._pending.pop(request_id, None)
+                if future is not None:
+                    future.set_result(data.tobytes())
+        except Exception as error:
+            if not isinstance(error, EOFError):
+                error = EOFError('SEASIDE connection lost: %s' % error)
+            with self._pending_lock:
+                self._closed = error
+                pending, self._pending = self._pending, {}
+            for future in pending.itervalues():
+                future.set_error(error)
+
+
+def send_SEASIDE_coroutine(socket, SEASIDE_flag, data=None):
+    """Coroutine version of send_SEASIDE, see shared_files/event_loop.py.
+
+    Args:
+        socket (socket object): a non-blocking socket, e.g. one from
+                                event_loop.open_unix_connection.
+        SEASIDE_flag (int): the flag to send, see send_SEASIDE.
+        data (str, bytearray or int array): the data to send, if any.
+    """
+    yield event_loop.sendall(socket, frame_SEASIDE(SEASIDE_flag, data))
+
+
+def _receive_exactly_coroutine(socket, view):
+    """Coroutine version of _receive_exactly."""
+    received = 0
+    while received < len(view):
+        n = yield event_loop.recv_into(socket, view[received:])
+        if n == 0:
+            raise EOFError('SEASIDE connection closed by the C-side')
+        received += n
+
+
+def request_SEASIDE_coroutine(socket, socket_lock, SEASIDE_flag, data=None):
+    """Coroutine version of request_SEASIDE, see shared_files/event_loop.py.
+
+    Args:
+        socket (socket object): a non-blocking socket, e.g. one from
+                                event_loop.open_unix_connection.
+        socket_lock (event_loop.Lock object): the lock associated with the
+                                              socket, so that coroutines
+                                              sharing it take turns.
+        SEASIDE_flag (int): the request flag, see request_SEASIDE.
+        data (str): the data of the request, if any.
+
+    Returns:
+        str: The data of the C-side's response, without the SEASIDE header.
+    """
+    header = bytearray(SEASIDE_HEADER.size)
+    yield socket_lock.acquire()
+    try:
+        yield event_loop.sendall(socket, frame_SEASIDE(SEASIDE_flag, data))
+        yield _receive_exactly_coroutine(socket, memoryview(header))
+        flag, size = SEASIDE_HEADER.unpack_from(header)
+        if size == EXTENDED_SIZE:
+            length = bytearray(EXTENDED_LENGTH.size)
+            yield _receive_exactly_coroutine(socket, memoryview(length))
+            size = EXTENDED_LENGTH.unpack_from(length)[0]
+        data = bytearray(size)
+        yield _receive_exactly_coroutine(socket, memoryview(data))
+    finally:
+        socket_lock.release()
+    yield event_loop.Return(str(data))
+
+
+class SEASIDE_Pool(object):
+    """A bounded pool of SEASIDE connections to one C-side socket.
+
+    The C-side serves every connection from its own thread, so spreading
+    callers over a few connections keeps one slow caller (e.g. a pcap upload)
+    from holding up the rest. A connection that has been idle for a while is
+    health checked before it is handed out, and a connection that breaks
+    while borrowed is thrown away, so a restarted C-side is reconnected to
+    instead of wedging every caller.
+
+    Example:
+        pool = SEASIDE_Pool('/tmp/send_socket')
+        with pool.connection() as client:
+            bandwidth = client.request(SEASIDE_FLAGS.GET_BANDWIDTH.value)
+    """
+
+    # Errors that mean a borrowed connection can't be trusted anymore.
+    CONNECTION_ERRORS = (socket_module.error, EOFError, RuntimeError)
+
+    def __init__(self, address, size=4, timeout=2.0,
+                 health_check_interval=5.0):
+        """Creates the pool. Connections are only opened as needed.
+
+        Args:
+            address (str): the path of the C-side's UNIX socket.
+            size (int): the most connections that can be open at once.
+            timeout (float): seconds to wait for a response before giving up
+                             on a connection.
+            health_check_interval (float): connections idle for longer than
+                                           this many seconds are checked before
+                                           being handed out.
+        """
+        self.address = address
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = []
+        self._idle_lock = threading.Lock()
+
+    def connect(self):
+        """Opens a new connection to the C-side, outside of the pool.
+
+        Returns:
+            SEASIDE_Client: The connected client.
+
+        Raises:
+            socket.error: if the C-side isn't accepting connections.
+        """
+        c_socket = socket_module.socket(socket_module.AF_UNIX,
+                                        socket_module.SOCK_STREAM)
+        try:
+            c_socket.connect(self.address)
+        except socket_module.error:
+            c_socket.close()
+            raise
+        return SEASIDE_Client(c_socket, self.timeout)
+
+    @contextlib.contextmanager
+    def connection(self):
+        """Borrows a connection for the duration of a with block.
+
+        Blocks while all the pool's connections are borrowed.
+
+        Yields:
+            SEASIDE_Client: a healthy connection to the C-side.
+        """
+        with self._slots:
+            client = self._checkout()
+            try:
+                yield client
+            except self.CONNECTION_ERRORS:
+                client.close()
+                raise
+            else:
+                if client.closed:
+                    client.close()
+                else:
+                    with self._idle_lock:
+                        self._idle.append((client, time.time()))
+
+    def close(self):
+        """Closes all the idle connections."""
+        with self._idle_lock:
+            idle, self._idle = self._idle, []
+        for client, last_used in idle:
+            client.close()
+
+    def _checkout(self):
+        """Returns the most recently used healthy connection, or a new one."""
+        while True:
+            with self._idle_lock:
+                if not self._idle:
+                    break
+                client, last_used = self._idle.pop()
+
+            if client.closed:
+                client.close()
+            elif (time.time() - last_used > self.health_check_interval
+                  and not self._is_healthy(client)):
+                client.close()
+            else:
+                return client
+        return self.connect()
+
+    def _is_healthy(self, client):
+        """Checks that the C-side still answers on a connection."""
+        try:
+            client.request(SEASIDE_FLAGS.GET_PACKET_SIZE.value)
+        except self.CONNECTION_ERRORS:
+            return False
+        return True
@@ -0,0 +1,86 @@
+"""Benchmarks getting a packet onto a SEASIDE socket, old path against new.
+
+The old path hex-encoded the packet into a list of ints (the way
+convert_packet_int_array used to), which send_SEASIDE turned back into a
+bytearray. The new one sends the packet's raw bytes as they are
+(convert_packet_bytes). Both are timed for frame sizes from 64 bytes to jumbo
+frames, with the frames written to a socketpair that a thread keeps draining,
+like the C-side would. Scapy isn't needed; building the packet itself costs
+the same on both paths, so it is left out.
+
+Run from the project root:
+
+python -m shared_files.benchmark_conversions
+"""
+import socket
+import threading
+import timeit
+
+from shared_files import SEASIDE
+from shared_files import conversions
+
+FRAME_SIZES = (64, 128, 512, 1500, 4096, 9000)
+
+
+class FakePacket(object):
+    """Stands in for a scapy packet, which str() turns into its bytes."""
+
+    def __init__(self, size):
+        self.raw = ''.join(chr(i % 256) for i in xrange(size))
+
+    def __str__(self):
+        return self.raw
+
+
+def old_convert_packet_int_array(pac):
+    """convert_packet_int_array, as it was."""
+    tmp = str(pac).encode('hex')
+    tmp = [x + y for x, y in zip(tmp[0::2], tmp[1::2])]
+    return map(lambda x: int(x, 16), tmp)
+
+
+def old_send_SEASIDE(sock, SEASIDE_flag, data):
+    """send_SEASIDE, as it was."""
+    SEASIDE_header = SEASIDE.SEASIDE_HEADER.pack(SEASIDE_flag, len(data))
+    SEASIDE_packet = bytearray(data)
+    sock.sendall(SEASIDE_header + SEASIDE_packet)
+
+
+def drain(sock):
+    while sock.recv(1 << 16):
+        pass
+
+
+def main():
+    writer, reader = socket.socketpair(socket.AF_UNIX, socket.SOCK_STREAM)
+    drainer = threading.Thread(target=drain, args=(reader,))
+    drainer.daemon = True
+    drainer.start()
+    lock = threading.Lock()
+    flag = SEASIDE.SEASIDE_FLAGS.PACKET.value
+
+    def old(packet):
+        old_send_SEASIDE(writer, flag,
+                         old_convert_packet_int_array(packet))
+
+    def new(packet):
+        SEASIDE.send_SEASIDE(writer, lock, flag,
+                             conversions.convert_packet_bytes(packet))
+
+    print '%8s %14s %14s %9s' % ('bytes', 'old (us/pkt)', 'new (us/pkt)',
+                                 'speedup')
+    for size in FRAME_SIZES:
+        packet = FakePacket(size)
+        number = max(50, 200000 // size)
+        old_time = min(timeit.repeat(lambda: old(packet), number=number,
+                                     repeat=3)) / number
+        new_time = min(timeit.repeat(lambda: new(packet), number=number,
+                                     repeat=3)) / number
+        print '%8d %14.2f %14.2f %8.1fx' % (size, old_time * 1e6,
+                                            new_time * 1e6,
+                                            old_time / new_time)
+    writer.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -24,6 +24,8 @@ import psutil
 import netifaces
 import scapy.all as scapy
 
+import pcap_reader
+
 PACKET_DIR = '/home/pi/Pi_Packet_Project/sender_files/packet_files/'
 
 
@@ -66,14 +68,24 @@ def read_cpu_usage():
 def read_pcap_file(fname):
     """Reads a pcap file and returns the first packet in the file.
 
+    Only the first packet is dissected, so this takes the same time no
+    matter how big the file is.
+
     Args:
         fname (str): Name of the file located in packet_files/.
 
     Returns:
-        Packet: The first packet found in the file, as a scapy packet.
+        Packet: The first packet found in the file, as a scapy packet, or
+        None if the file has no packets.
+
+    Raises:
+        IOError: if the file can't be opened, or isn't a pcap or pcapng file.
     """
-    p = scapy.rdpcap(PACKET_DIR + '%s' % fname)
-    return p[0]
+    with pcap_reader.PcapReader(PACKET_DIR + '%s' % fname) as reader:
+        for record in reader:
+            layer = scapy.conf.l2types.get(reader.linktype, scapy.Raw)
+            return layer(record.data.tobytes())
+    return None
 
 
 def read_MAC(interface):
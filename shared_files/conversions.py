@@ -3,18 +3,33 @@
 These functions convert the parameter to a different type or convert
 units.
 
+convert_packet_bytes: Converts a Scapy packet to its raw bytes.
 convert_packet_int_array: Converts a Scapy packet to an array of ints.
 convert_bandwidth_units: Calculate the unit for a given bps.
+convert_time_units: Calculate the unit for a given number of nanoseconds.
 convert_delay_bytes: Converts time in seconds and microseconds to a bytearray.
 """
 import struct
 
 
+def convert_packet_bytes(pac):
+    """Converts a Scapy packet into its raw bytes, ready for SEASIDE.
+
+    Bytes and buffers (e.g. a frame read straight out of a pcap file) are
+    returned as they are, so they can be sent without any copying.
+    """
+    if isinstance(pac, (str, bytearray, memoryview, buffer)):
+        return pac
+    return str(pac)
+
+
 def convert_packet_int_array(pac):
-    """Converts a Scapy packet into an array of integers."""
-    tmp = str(pac).encode('hex')
-    tmp = [x + y for x, y in zip(tmp[0::2], tmp[1::2])]
-    return map(lambda x: int(x, 16), tmp)
+    """Converts a Scapy packet into an array of integers.
+
+    Only kept for compatibility; convert_packet_bytes is much faster, and
+    SEASIDE sends its result as is.
+    """
+    return list(bytearray(convert_packet_bytes(pac)))
 
 
 # TODO Remove, unused
@@ -76,6 +91,24 @@ def convert_bandwidth_units(bandwidth):
     return (bandwidth, BDWTH_ABBRS[bw_unit])
 
 
+def convert_time_units(nanoseconds):
+    """Calculate the most appropriate unit for a given number of ns.
+
+    Args:
+        nanoseconds: A length of time in nanoseconds.
+
+    Returns:
+        tuple(float, str): The adjusted number and unit as a tuple.
+    """
+    TIME_ABBRS = ('ns', 'us', 'ms', 's')
+
+    time_unit = 0
+    while nanoseconds >= 1000 and time_unit < len(TIME_ABBRS) - 1:
+        nanoseconds /= 1000.0
+        time_unit += 1
+    return (nanoseconds, TIME_ABBRS[time_unit])
+
+
 def convert_delay_bytes(delay_seconds, delay_useconds):
     """Takes in the delay, and returns it in SEASIDE compatible form.
 
@@ -0,0 +1,264 @@
+"""A small cooperative event loop, for running several loops on one thread.
+
+Python 2.7 has no asyncio, so this provides the little that the UI programs
+need from it. A task is a generator that yields whatever it is waiting for:
+
+    Sleep(seconds): resume after the given number of seconds.
+    SleepUntil(deadline): resume at an absolute time.time() deadline. Loops
+        that tick at a fixed rate should use this, so the time spent working
+        doesn't stretch out every cycle.
+    Readable(socket) / Writable(socket): resume once the socket is ready.
+    another generator: run it as a sub-coroutine, and resume with its result.
+    Return(value): finish, handing value back to the calling coroutine.
+
+Example:
+    def blink(lcd):
+        deadline = time.time()
+        while True:
+            toggle_led(lcd)
+            deadline += 0.5
+            yield event_loop.SleepUntil(deadline)
+
+    loop = event_loop.EventLoop()
+    loop.spawn(blink(lcd))
+    loop.run()
+
+EventLoop: runs tasks until none are left.
+Lock: a lock for coroutines on the same loop.
+sendall: coroutine that sends all the data on a non-blocking socket.
+recv_into: coroutine that receives into a buffer from a non-blocking socket.
+open_unix_connection: coroutine that connects to a UNIX socket.
+"""
+import collections
+import errno
+import heapq
+import itertools
+import select
+import socket
+import sys
+import time
+import traceback
+import types
+
+# Errors that just mean a non-blocking socket isn't ready yet.
+_WOULD_BLOCK = (errno.EAGAIN, errno.EWOULDBLOCK, errno.EINPROGRESS)
+
+
+class Sleep(object):
+    def __init__(self, seconds):
+        self.seconds = seconds
+
+    def _schedule(self, loop, task):
+        loop._add_timer(time.time() + self.seconds, task)
+
+
+class SleepUntil(object):
+    def __init__(self, deadline):
+        self.deadline = deadline
+
+    def _schedule(self, loop, task):
+        loop._add_timer(self.deadline, task)
+
+
+class Readable(object):
+    def __init__(self, socket):
+        self.fd = socket.fileno()
+
+    def _schedule(self, loop, task):
+        loop._readers[self.fd] = task
+
+
+class Writable(object):
+    def __init__(self, socket):
+        self.fd = socket.fileno()
+
+    def _schedule(self, loop, task):
+        loop._writers[self.fd] = task
+
+
+class Return(object):
+    """Yielded by a coroutine to finish with a value for its caller."""
+
+    def __init__(self, value=None):
+        self.value = value
+
+
+class Lock(object):
+    """A lock for coroutines running on the same EventLoop.
+
+    Example:
+        yield lock.acquire()
+        try:
+            ...
+        finally:
+            lock.release()
+    """
+
+    def __init__(self):
+        self._loop = None
+        self._locked = False
+        self._waiters = collections.deque()
+
+    def acquire(self):
+        return _Acquire(self)
+
+    def release(self):
+        if self._waiters:
+            # Hand the lock straight to the next waiter.
+            self._loop._ready.append((self._waiters.popleft(), None))
+        else:
+            self._locked = False
+
+
+class _Acquire(object):
+    def __init__(self, lock):
+        self.lock = lock
+
+    def _schedule(self, loop, task):
+        self.lock._loop = loop
+        if self.lock._locked:
+            self.lock._waiters.append(task)
+        else:
+            self.lock._locked = True
+            loop._ready.append((task, None))
+
+
+class _Task(object):
+    """A spawned coroutine, along with the sub-coroutines it is running."""
+
+    def __init__(self, coroutine):
+        self.stack = [coroutine]
+
+
+class EventLoop(object):
+    """Runs coroutines cooperatively on the calling thread."""
+
+    def __init__(self):
+        self._ready = collections.deque()
+        self._timers = []
+        self._timer_order = itertools.count()
+        self._readers = {}
+        self._writers = {}
+
+    def spawn(self, coroutine):
+        """Schedules a generator to start running on the next loop pass."""
+        self._ready.append((_Task(coroutine), None))
+
+    def run(self):
+        """Runs until every task has finished."""
+        while self._ready or self._timers or self._readers or self._writers:
+            # Only run the tasks that were ready at the start of this pass,
+            # so a task that keeps rescheduling itself can't starve the rest.
+            for _ in xrange(len(self._ready)):
+                task, value = self._ready.popleft()
+                self._step(task, value)
+
+            if self._ready:
+                timeout = 0
+            elif self._timers:
+                timeout = max(0, self._timers[0][0] - time.time())
+            else:
+                timeout = None
+
+            if self._readers or self._writers:
+                readable, writable, _ = select.select(self._readers.keys(),
+                                                      self._writers.keys(),
+                                                      [], timeout)
+                for fd in readable:
+                    self._ready.append((self._readers.pop(fd), None))
+                for fd in writable:
+                    self._ready.append((self._writers.pop(fd), None))
+            elif timeout:
+                time.sleep(timeout)
+
+            now = time.time()
+            while self._timers and self._timers[0][0] <= now:
+                self._ready.append((heapq.heappop(self._timers)[2], None))
+
+    def _add_timer(self, deadline, task):
+        heapq.heappush(self._timers,
+                       (deadline, next(self._timer_order), task))
+
+    def _step(self, task, value, exc_info=None):
+        """Runs a task until it yields something to wait for, or finishes."""
+        while True:
+            coroutine = task.stack[-1]
+            try:
+                if exc_info is not None:
+                    command = coroutine.throw(*exc_info)
+                    exc_info = None
+                else:
+                    command = coroutine.send(value)
+            except StopIteration:
+                command = Return()
+            except Exception:
+                task.stack.pop()
+                if not task.stack:
+                    print 'Task died:'
+                    traceback.print_exc()
+                    return
+                # Raise the error in the calling coroutine instead.
+                exc_info = sys.exc_info()
+                continue
+
+            if isinstance(command, types.GeneratorType):
+                task.stack.append(command)
+                value = None
+            elif isinstance(command, Return):
+                task.stack.pop()
+                coroutine.close()
+                if not task.stack:
+                    return
+                value = command.value
+            else:
+                command._schedule(self, task)
+                return
+
+
+def sendall(sock, data):
+    """Coroutine that sends all of data on a non-blocking socket."""
+    view = memoryview(data)
+    while len(view):
+        try:
+            view = view[sock.send(view):]
+        except socket.error as error:
+            if error.errno not in _WOULD_BLOCK:
+                raise
+            yield Writable(sock)
+
+
+def recv_into(sock, view):
+    """Coroutine that receives into view, once some data is available.
+
+    Returns:
+        int: The number of bytes received, 0 if the other side closed.
+    """
+    while True:
+        try:
+            yield Return(sock.recv_into(view))
+        except socket.error as error:
+            if error.errno not in _WOULD_BLOCK:
+                raise
+            yield Readable(sock)
+
+
+def open_unix_connection(path, retry_interval=1):
+    """Coroutine that connects a non-blocking socket to a UNIX socket path.
+
+    Keeps retrying every retry_interval seconds until the other side is up,
+    the same way the UI programs wait for the C-side to start.
+
+    Returns:
+        socket object: The connected, non-blocking socket.
+    """
+    while True:
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.connect(path)
+        except socket.error:
+            sock.close()
+            print 'Trying to connect...'
+            yield Sleep(retry_interval)
+            continue
+        sock.setblocking(False)
+        yield Return(sock)
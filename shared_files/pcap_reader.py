@@ -0,0 +1,303 @@
+"""Reads pcap and pcapng files without parsing them into scapy packets.
+
+The file is memory-mapped, and only the record headers are parsed; each
+packet comes back as a memoryview into the mapping, so nothing is copied and
+nothing past the packets that are actually used is read from disk. Getting
+the first packet of a capture takes the same time no matter how big the
+capture is, and the file's pages can always be dropped from memory again,
+which matters on a Pi.
+
+Supports pcap files in either byte order, with microsecond or nanosecond
+timestamps, and pcapng files (enhanced, simple and the obsolete packet
+blocks, with each interface's timestamp resolution).
+
+PcapRecord: a packet in a capture, along with where it is and when it was
+            captured.
+PcapReader: iterates over the records of a capture.
+first_packet: returns the raw bytes of the first packet of a capture.
+"""
+import collections
+import ctypes
+import mmap
+import struct
+
+PCAP_MAGIC = 0xa1b2c3d4
+PCAP_MAGIC_NANOSECONDS = 0xa1b23c4d
+
+# The pcap global header after the magic: version major and minor, the
+# timezone offset, timestamp accuracy, snaplen and link type. Then the header
+# of every record: seconds, fractions of a second, captured and original
+# length.
+PCAP_GLOBAL_HEADER_SIZE = 24
+PCAP_GLOBAL_HEADER = 'HHiIII'
+PCAP_RECORD_HEADER = 'IIII'
+
+# pcapng blocks start with their type and total length, and end with the
+# length again. The byte order of each section is found from the magic in
+# its section header block.
+PCAPNG_SECTION_HEADER = 0x0A0D0D0A
+PCAPNG_BYTE_ORDER_MAGIC = 0x1A2B3C4D
+PCAPNG_INTERFACE = 1
+PCAPNG_PACKET = 2
+PCAPNG_SIMPLE_PACKET = 3
+PCAPNG_ENHANCED_PACKET = 6
+PCAPNG_OPTION_TSRESOL = 9
+
+# The link type of Ethernet, the default if a capture doesn't say.
+LINKTYPE_ETHERNET = 1
+
+# offset is where the record's header starts in the file (see
+# PcapReader.records), timestamp is in seconds (None if the record doesn't
+# have one), length is the packet's length on the wire, and data is a
+# memoryview of the part that was captured.
+PcapRecord = collections.namedtuple('PcapRecord',
+                                    'offset timestamp length data')
+
+
+def _memoryview(mapping):
+    """Returns a memoryview of a whole mmap."""
+    try:
+        return memoryview(mapping)
+    except TypeError:
+        # Python 2's mmap doesn't have the buffer interface memoryview needs,
+        # so go through a ctypes array over the same memory instead.
+        return memoryview((ctypes.c_char * len(mapping)).from_buffer(mapping))
+
+
+class PcapReader(object):
+    """Iterates over the records of a pcap or pcapng file.
+
+    Iterating gives a PcapRecord for every packet, in order. The records'
+    data points into the mapped file, so it is only valid until the reader
+    is closed; copy it (e.g. with tobytes()) to keep it. Can be used as a
+    context manager, to close it when done.
+
+    Args:
+        source (str or file): the path of the capture, or a file object
+                              holding it. The file object doesn't need to be
+                              a real file, but then it is read into memory.
+
+    Attributes:
+        linktype (int): the link type of the capture (of its first
+                        interface, for pcapng).
+
+    Raises:
+        IOError: if the capture can't be opened, or isn't a pcap or pcapng
+                 file.
+    """
+
+    def __init__(self, source):
+        self._file = None
+        self._map = None
+        if isinstance(source, basestring):
+            self._file = open(source, 'rb')
+            source = self._file
+
+        try:
+            fileno = source.fileno()
+        except (AttributeError, IOError):
+            fileno = None
+        if fileno is not None:
+            try:
+                # Copy-on-write, since ctypes only takes writable memory
+                # (see _memoryview). Nothing is ever written to it, so it
+                # costs the same as a read-only mapping.
+                self._map = mmap.mmap(fileno, 0, access=mmap.ACCESS_COPY)
+            except (ValueError, mmap.error):
+                # An empty file can't be mapped, and isn't a capture anyway.
+                self.close()
+                raise IOError('Not a pcap or pcapng file')
+            self._buffer = self._map
+            self._view = _memoryview(self._map)
+        else:
+            source.seek(0)
+            self._buffer = source.read()
+            self._view = memoryview(self._buffer)
+
+        if len(self._buffer) >= 4:
+            magic = struct.unpack_from('=I', self._buffer)[0]
+        else:
+            magic = None
+        try:
+            if magic == PCAPNG_SECTION_HEADER:
+                self._records = self._pcapng_records
+                self._read_pcapng_header()
+            else:
+                self._records = self._pcap_records
+                self._read_pcap_header()
+        except (IOError, struct.error):
+            self.close()
+            raise IOError('Not a pcap or pcapng file')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __iter__(self):
+        return self.records()
+
+    def records(self, offset=None):
+        """Iterates over the records, starting at the one whose header is at
+        offset (as given in an earlier PcapRecord), or at the first one.
+
+        With pcapng, the byte order and the interfaces (which set the
+        resolution of the timestamps) come from earlier blocks, so starting
+        part way into the file assumes those of the first section, which is
+        all there is in most captures.
+
+        Yields:
+            PcapRecord: each record in turn. A record cut short (e.g. a
+            capture that is still being written) ends the iteration.
+        """
+        return self._records(offset)
+
+    def close(self):
+        """Unmaps and closes the file. Any records' data becomes invalid."""
+        self._view = None
+        self._buffer = None
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _read_pcap_header(self):
+        if len(self._buffer) < PCAP_GLOBAL_HEADER_SIZE:
+            raise IOError('Truncated pcap header')
+        for order in '<>':
+            magic = struct.unpack_from(order + 'I', self._buffer)[0]
+            if magic in (PCAP_MAGIC, PCAP_MAGIC_NANOSECONDS):
+                break
+        else:
+            raise IOError('Bad pcap magic')
+        self._order = order
+        self._fraction = 1e9 if magic == PCAP_MAGIC_NANOSECONDS else 1e6
+        self.linktype = struct.unpack_from(order + PCAP_GLOBAL_HEADER,
+                                           self._buffer, 4)[5]
+
+    def _pcap_records(self, offset):
+        record_header = struct.Struct(self._order + PCAP_RECORD_HEADER)
+        buffer_len = len(self._buffer)
+        pos = PCAP_GLOBAL_HEADER_SIZE if offset is None else offset
+        while pos + record_header.size <= buffer_len:
+            seconds, fractions, caplen, length = record_header.unpack_from(
+                self._buffer, pos)
+            start = pos + record_header.size
+            if start + caplen > buffer_len:
+                return
+            yield PcapRecord(pos, seconds + fractions / self._fraction,
+                             length, self._view[start:start + caplen])
+            pos = start + caplen
+
+    def _pcapng_blocks(self, offset, order):
+        """Yields (offset, byte order, type, body start, body end) of every
+        block from offset on, following the byte order of each section."""
+        buffer_len = len(self._buffer)
+        pos = offset
+        while pos + 12 <= buffer_len:
+            block_type = struct.unpack_from(order + 'I', self._buffer, pos)[0]
+            if block_type == PCAPNG_SECTION_HEADER:
+                magic = struct.unpack_from('<I', self._buffer, pos + 8)[0]
+                order = '<' if magic == PCAPNG_BYTE_ORDER_MAGIC else '>'
+            length = struct.unpack_from(order + 'I', self._buffer, pos + 4)[0]
+            if length < 12 or length % 4 or pos + length > buffer_len:
+                return
+            yield pos, order, block_type, pos + 8, pos + length - 4
+            pos += length
+
+    def _pcapng_tsresol(self, order, start, end):
+        """Returns the timestamp units per second, from the options of an
+        interface description block."""
+        pos = start + 8
+        while pos + 4 <= end:
+            code, length = struct.unpack_from(order + 'HH', self._buffer, pos)
+            if code == 0:
+                break
+            if code == PCAPNG_OPTION_TSRESOL and length >= 1:
+                resolution = ord(self._buffer[pos + 4])
+                if resolution & 0x80:
+                    return 2.0 ** (resolution & 0x7F)
+                return 10.0 ** resolution
+            pos += 4 + (length + 3) // 4 * 4
+        return 1e6
+
+    def _read_pcapng_header(self):
+        """Reads the byte order and the interfaces of the first section, up
+        to its first packet."""
+        blocks = self._pcapng_blocks(0, '<')
+        header = next(blocks, None)
+        if header is None or header[2] != PCAPNG_SECTION_HEADER:
+            raise IOError('Bad pcapng section header')
+        self._order = header[1]
+        self._resolutions = []
+        self.linktype = None
+        for _, order, block_type, start, end in blocks:
+            if block_type == PCAPNG_INTERFACE:
+                if self.linktype is None:
+                    self.linktype = struct.unpack_from(order + 'H',
+                                                       self._buffer, start)[0]
+                self._resolutions.append(
+                    self._pcapng_tsresol(order, start, end))
+            elif block_type in (PCAPNG_ENHANCED_PACKET, PCAPNG_PACKET,
+                                PCAPNG_SIMPLE_PACKET):
+                break
+        if self.linktype is None:
+            self.linktype = LINKTYPE_ETHERNET
+
+    def _pcapng_records(self, offset):
+        if offset is None:
+            offset, order, resolutions = 0, '<', []
+        else:
+            order, resolutions = self._order, list(self._resolutions)
+        for pos, order, block_type, start, end in self._pcapng_blocks(
+                offset, order):
+            if block_type == PCAPNG_SECTION_HEADER:
+                # Interface IDs start over in every section.
+                resolutions = []
+            elif block_type == PCAPNG_INTERFACE:
+                resolutions.append(self._pcapng_tsresol(order, start, end))
+            elif block_type in (PCAPNG_ENHANCED_PACKET, PCAPNG_PACKET):
+                if block_type == PCAPNG_ENHANCED_PACKET:
+                    interface, high, low, caplen, length = struct.unpack_from(
+                        order + 'IIIII', self._buffer, start)
+                else:
+                    interface, _, high, low, caplen, length = \
+                        struct.unpack_from(order + 'HHIIII', self._buffer,
+                                           start)
+                data = start + 20
+                if data + caplen > end:
+                    return
+                resolution = (resolutions[interface]
+                              if interface < len(resolutions) else 1e6)
+                yield PcapRecord(pos, ((high << 32) | low) / resolution,
+                                 length, self._view[data:data + caplen])
+            elif block_type == PCAPNG_SIMPLE_PACKET:
+                length = struct.unpack_from(order + 'I', self._buffer,
+                                            start)[0]
+                data = start + 4
+                caplen = min(length, end - data)
+                yield PcapRecord(pos, None, length,
+                                 self._view[data:data + caplen])
+
+
+def first_packet(source):
+    """Returns the raw bytes of the first packet of a capture.
+
+    Args:
+        source (str or file): the path of the capture, or a file object
+                              holding it, see PcapReader.
+
+    Returns:
+        str: The first packet, or None if the capture has no packets.
+
+    Raises:
+        IOError: if the capture can't be opened, or isn't a pcap or pcapng
+                 file.
+    """
+    with PcapReader(source) as reader:
+        for record in reader:
+            return record.data.tobytes()
+    return None
@@ -0,0 +1,1049 @@
+"""A pure-Python stand-in for the C-side SEASIDE daemons.
+
+Implements the same SEASIDE flags as sender_files/c_files/send.c, on the same
+UNIX socket, but instead of injecting packets onto a NIC, it "transmits" them
+to a sink at the configured delay: either a pcap file, or memory (which only
+keeps counters and the last frame). Optionally, it also serves the receiving
+side's socket from the same sink, as if every transmitted frame had looped
+back to a receiving Pi.
+
+This makes it possible to run, load test, and measure the control-plane
+overhead of the web server, send.py and receive.py on any Linux machine,
+without root or a Raspberry Pi. For example, from the project root:
+
+python -m shared_files.reference_daemon --pcap /tmp/sent.pcap --loopback
+
+On exit (Ctrl-C), it prints how many SEASIDE messages it handled.
+
+MemorySink: keeps counters and the last transmitted frame.
+PcapSink: also writes every transmitted frame to a pcap file.
+Transmitter: the thread that sends the packet to the sink at the set delay.
+Mutator: a field mutator on the packet, like send.c's.
+ReferenceDaemon: serves the SEASIDE sockets.
+"""
+import argparse
+import collections
+import ctypes
+import ctypes.util
+import math
+import os
+import select
+import signal
+import socket
+import SocketServer
+import struct
+import threading
+import time
+
+from shared_files import SEASIDE
+from shared_files import pcap_reader
+from shared_files.SEASIDE import SEASIDE_FLAGS
+
+SEND_SOCKET = '/tmp/send_socket'
+RECEIVE_SOCKET = '/tmp/receive_socket'
+
+# The C-side sends back size_t's as is, so match the platform's size.
+SIZE_T = struct.Struct('=Q' if struct.calcsize('P') == 8 else '=I')
+
+# The delay, as encoded by conversions.convert_delay_bytes.
+DELAY = struct.Struct('=BI')
+
+# Python 2 has no monotonic clock, so the timestamps of STATS pushes come
+# from clock_gettime, like the C-side's.
+CLOCK_MONOTONIC = 1
+_libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+
+
+class _Timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+def _monotonic_ns():
+    """Returns the CLOCK_MONOTONIC time, in nanoseconds."""
+    now = _Timespec()
+    if _libc.clock_gettime(CLOCK_MONOTONIC, ctypes.byref(now)):
+        raise OSError(ctypes.get_errno(), 'clock_gettime failed')
+    return now.tv_sec * 1000000000 + now.tv_nsec
+
+
+# A pcap global header (microsecond timestamps, Ethernet), and the header
+# that goes before every record.
+PCAP_GLOBAL_HEADER = struct.Struct('=IHHiIII')
+PCAP_RECORD_HEADER = struct.Struct('=IIII')
+PCAP_MAGIC = 0xa1b2c3d4
+LINKTYPE_ETHERNET = 1
+
+# Same as the C-side.
+MIN_STATS_INTERVAL = 0.01
+
+# The achieved rate is averaged over this many buckets of this many seconds,
+# like send.c's.
+ACHIEVED_BUCKETS = 10
+ACHIEVED_BUCKET = 0.1
+
+# The most data in a response to GET_PACKETS, like receive.c's.
+PACKETS_MAX_RESPONSE = 256 * 1024
+
+# The most flows kept for GET_FLOWS, and how long one lasts without packets
+# before it is no longer active, like receive.c's.
+FLOW_TABLE_SIZE = 4096
+FLOW_IDLE = 60
+FLOW_DEFAULT_TOP = 10
+ETHERTYPE_VLAN = (0x8100, 0x88a8)
+ETHERTYPE_IPV4 = 0x0800
+ETHERTYPE_IPV6 = 0x86DD
+PORT_PROTOCOLS = (6, 17, 132)
+
+
+def _gap_bucket(gap):
+    """Returns the bucket of a GET_GAPS histogram that a gap (in
+    nanoseconds) falls in, like receive.c's gap_bucket."""
+    if gap < 2 * SEASIDE.GAP_SUB_BUCKETS:
+        return gap
+    shift = gap.bit_length() - SEASIDE.GAP_SUB_BUCKETS.bit_length()
+    return min(shift * SEASIDE.GAP_SUB_BUCKETS + (gap >> shift),
+               SEASIDE.GAP_BUCKETS - 1)
+
+
+def _flow_key(frame):
+    """Returns the flow a frame belongs to, like receive.c's
+    parse_flow_key: (VLAN, ethertype, protocol, source port, destination
+    port, source address, destination address), with the addresses as 16
+    bytes."""
+    vlan = ethertype = protocol = src_port = dst_port = 0
+    src = dst = '\x00' * 16
+    if len(frame) < 14:
+        return (vlan, ethertype, protocol, src_port, dst_port, src, dst)
+    pos = 14
+    ethertype = struct.unpack_from('!H', frame, 12)[0]
+    if ethertype in ETHERTYPE_VLAN and len(frame) >= pos + 4:
+        vlan = struct.unpack_from('!H', frame, pos)[0] & 0x0FFF
+    while ethertype in ETHERTYPE_VLAN and len(frame) >= pos + 4:
+        ethertype = struct.unpack_from('!H', frame, pos + 2)[0]
+        pos += 4
+
+    l4 = None
+    if ethertype == ETHERTYPE_IPV4 and len(frame) >= pos + 20:
+        protocol = ord(frame[pos + 9])
+        src = frame[pos + 12:pos + 16].ljust(16, '\x00')
+        dst = frame[pos + 16:pos + 20].ljust(16, '\x00')
+        if struct.unpack_from('!H', frame, pos + 6)[0] & 0x1FFF == 0:
+            l4 = pos + (ord(frame[pos]) & 0x0F) * 4
+    elif ethertype == ETHERTYPE_IPV6 and len(frame) >= pos + 40:
+        protocol = ord(frame[pos + 6])
+        src = frame[pos + 8:pos + 24]
+        dst = frame[pos + 24:pos + 40]
+        l4 = pos + 40
+    if (l4 is not None and len(frame) >= l4 + 4
+            and protocol in PORT_PROTOCOLS):
+        src_port, dst_port = struct.unpack_from('!HH', frame, l4)
+    return (vlan, ethertype, protocol, src_port, dst_port, src, dst)
+
+
+class MemorySink(object):
+    """Keeps counters and the last frame of everything transmitted to it."""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.packets = 0
+        self.bytes = 0
+        self.last_frame = ''
+        # The time and size of every frame over the longest window of
+        # rx_rates.
+        self._arrivals = collections.deque()
+        # (sequence number, time, frame) of the last frames, for
+        # GET_PACKETS.
+        self._recent = collections.deque(maxlen=SEASIDE.PACKETS_KEPT)
+        # [packets, bytes, first, last, max gap] of each flow, for
+        # GET_FLOWS, in nanoseconds.
+        self._flows = {}
+        self.flows_evicted = 0
+        self._reset_gaps()
+
+    def write(self, frame):
+        now = time.time()
+        with self.lock:
+            self.packets += 1
+            self.bytes += len(frame)
+            self.last_frame = frame
+            self._arrivals.append((now, len(frame)))
+            self._recent.append((self.packets, now, frame))
+            while now - self._arrivals[0][0] > SEASIDE.RX_RATE_MAX_WINDOW:
+                self._arrivals.popleft()
+            self._count_gap(int(now * 1e9))
+            self._count_flow(frame, int(now * 1e9))
+        return now
+
+    def _count_flow(self, frame, arrival):
+        key = _flow_key(frame)
+        flow = self._flows.get(key)
+        if flow is None:
+            if len(self._flows) >= FLOW_TABLE_SIZE:
+                # The whole table is searched, rather than a few slots like
+                # receive.c's, so only the oldest flow is ever evicted.
+                oldest = min(self._flows, key=lambda k: self._flows[k][3])
+                del self._flows[oldest]
+                self.flows_evicted += 1
+            flow = self._flows[key] = [0, 0, arrival, arrival, 0]
+        if flow[0]:
+            flow[4] = max(flow[4], arrival - flow[3])
+        flow[0] += 1
+        flow[1] += len(frame)
+        flow[3] = max(flow[3], arrival)
+
+    def get_flows(self, order, count):
+        """Returns the response to a GET_FLOWS: the top count flows by
+        bytes, or by packets if order is FLOW_ORDER.PACKETS."""
+        count = min(count, SEASIDE.FLOWS_MAX_TOP)
+        by = 0 if order == SEASIDE.FLOW_ORDER.PACKETS.value else 1
+        idle_since = (time.time() - FLOW_IDLE) * 1e9
+        with self.lock:
+            active = sum(1 for flow in self._flows.itervalues()
+                         if flow[3] >= idle_since)
+            top = sorted(self._flows.iteritems(),
+                         key=lambda item: item[1][by], reverse=True)[:count]
+            evicted = self.flows_evicted
+        return (SEASIDE.FLOWS_HEADER.pack(active, evicted, len(top))
+                + ''.join(SEASIDE.FLOW_RECORD.pack(*(key + tuple(flow)))
+                          for key, flow in top))
+
+    def gaps(self, reset=False):
+        """Returns the response to a GET_GAPS, the histogram of the gaps
+        between the frames written, and starts it over if reset is set."""
+        with self.lock:
+            count = self.gap_count
+            if count:
+                stats = (self.gap_min, self.gap_max, self.gap_sum // count,
+                         self._gap_percentile(0.5),
+                         self._gap_percentile(0.99),
+                         self._gap_percentile(0.999))
+            else:
+                stats = (0,) * 6
+            data = SEASIDE.GAPS.pack(count, *(stats + tuple(self.gap_buckets)))
+            if reset:
+                self._reset_gaps()
+        return data
+
+    def _reset_gaps(self):
+        self.gap_buckets = [0] * SEASIDE.GAP_BUCKETS
+        self.gap_count = 0
+        self.gap_sum = 0
+        self.gap_min = None
+        self.gap_max = 0
+        self.last_arrival = None
+
+    def _count_gap(self, arrival):
+        if self.last_arrival is not None and arrival >= self.last_arrival:
+            gap = arrival - self.last_arrival
+            self.gap_buckets[_gap_bucket(gap)] += 1
+            self.gap_count += 1
+            self.gap_sum += gap
+            self.gap_min = gap if self.gap_min is None else min(self.gap_min,
+                                                                gap)
+            self.gap_max = max(self.gap_max, gap)
+        self.last_arrival = arrival
+
+    def _gap_percentile(self, fraction):
+        """Interpolated within its bucket, like receive.c's."""
+        rank = max(1, int(math.ceil(fraction * self.gap_count)))
+        seen = 0
+        bucket = 0
+        while (bucket < SEASIDE.GAP_BUCKETS - 1
+               and seen + self.gap_buckets[bucket] < rank):
+            seen += self.gap_buckets[bucket]
+            bucket += 1
+        lowest, end = SEASIDE.gap_bucket_bounds(bucket)
+        gap = lowest
+        if bucket < SEASIDE.GAP_BUCKETS - 1 and self.gap_buckets[bucket]:
+            gap += (end - lowest) * (rank - seen) // self.gap_buckets[bucket]
+        return min(max(gap, self.gap_min), self.gap_max)
+
+    def get_packets(self, since, max_packets):
+        """Returns the response to a GET_PACKETS: the frames after the one
+        numbered since, up to max_packets of them or 256 KB, like the
+        C-side's."""
+        with self.lock:
+            last = self.packets
+            recent = [entry for entry in self._recent if entry[0] > since]
+        records = []
+        size = SEASIDE.PACKETS_HEADER.size
+        for seq, when, frame in recent[:max_packets]:
+            kept = frame[:SEASIDE.PACKETS_SNAPLEN]
+            size += SEASIDE.PACKET_RECORD.size + SEASIDE.PACKETS_SNAPLEN
+            if size > PACKETS_MAX_RESPONSE:
+                break
+            records.append(SEASIDE.PACKET_RECORD.pack(
+                seq, int(when * 1e9), len(frame), len(kept)) + kept)
+        return (SEASIDE.PACKETS_HEADER.pack(last, len(records))
+                + ''.join(records))
+
+    def bandwidth(self):
+        """The bandwidth in bits/s over the last second, like the
+        C-side's."""
+        return self.rx_rates([1])[0].bps
+
+    def rx_rates(self, windows):
+        """Returns the rate over each window (in seconds), like the
+        C-side's GET_RX_RATES, as a list of SEASIDE.SEASIDE_RX_Rate."""
+        now = time.time()
+        with self.lock:
+            arrivals = list(self._arrivals)
+        rates = []
+        for window in windows:
+            window = max(min(window, SEASIDE.RX_RATE_MAX_WINDOW), 0.001)
+            sizes = [size for when, size in arrivals if now - when <= window]
+            rates.append(SEASIDE.SEASIDE_RX_Rate(
+                window, int(sum(sizes) * 8 / window), int(len(sizes) / window)))
+        return rates
+
+    def close(self):
+        pass
+
+
+class PcapSink(MemorySink):
+    """A MemorySink that also writes every frame to a pcap file."""
+
+    def __init__(self, filename):
+        MemorySink.__init__(self)
+        self.file = open(filename, 'wb')
+        self.file.write(PCAP_GLOBAL_HEADER.pack(PCAP_MAGIC, 2, 4, 0, 0,
+                                                0xffff, LINKTYPE_ETHERNET))
+
+    def write(self, frame):
+        now = MemorySink.write(self, frame)
+        seconds = int(now)
+        with self.lock:
+            self.file.write(PCAP_RECORD_HEADER.pack(
+                seconds, int((now - seconds) * 1000000), len(frame),
+                len(frame)))
+            self.file.write(frame)
+        return now
+
+    def close(self):
+        with self.lock:
+            self.file.close()
+
+
+def _checksum_update(packet, at, old_word, new_word):
+    """Updates the checksum at packet[at] for one of the 16-bit words it
+    covers changing, like checksum_update in send.c (RFC 1624, eq. 3)."""
+    csum = packet[at] << 8 | packet[at + 1]
+    total = (~csum & 0xFFFF) + (~old_word & 0xFFFF) + new_word
+    total = (total & 0xFFFF) + (total >> 16)
+    total = (total & 0xFFFF) + (total >> 16)
+    csum = ~total & 0xFFFF
+    packet[at], packet[at + 1] = csum >> 8, csum & 0xFF
+
+
+class Mutator(object):
+    """A field mutator on a packet, see SEASIDE.pack_SEASIDE_mutators.
+
+    Finds the checksums that cover the field the same way as find_checksums
+    in send.c, and fixes them up incrementally as the field changes.
+
+    Raises:
+        ValueError: if the field doesn't fit in the packet, or overlaps a
+                    checksum that covers it.
+    """
+
+    def __init__(self, packet, offset, width, step, minimum, maximum):
+        end = offset + width
+        if width not in (1, 2, 4) or end > len(packet) or minimum > maximum:
+            raise ValueError('Mutator does not fit the packet')
+        self.offset = offset
+        self.width = width
+        self.step = step
+        self.min = minimum
+        self.max = maximum
+        self.value = minimum
+        self.ip_checksum = None
+        self.l4_checksum = None
+        self.l4_is_udp = False
+        self._find_checksums(packet, offset, end)
+        for at in (self.ip_checksum, self.l4_checksum):
+            if at is not None and at < end and at + 2 > offset:
+                raise ValueError('Mutator overlaps a checksum')
+
+    def _find_checksums(self, packet, start, end):
+        pos = 12
+        while (pos + 4 <= len(packet)
+               and packet[pos:pos + 2] in ('\x81\x00', '\x88\xa8')):
+            pos += 4
+        if pos + 22 > len(packet) or packet[pos:pos + 2] != '\x08\x00':
+            return
+
+        ip = pos + 2
+        ihl = (packet[ip] & 0x0F) * 4
+        ip_end = min(ip + (packet[ip + 2] << 8 | packet[ip + 3]),
+                     len(packet))
+        proto = packet[ip + 9]
+        l4 = ip + ihl
+        if start < ip + ihl and end > ip:
+            self.ip_checksum = ip + 10
+
+        if proto == socket.IPPROTO_UDP and l4 + 8 <= ip_end:
+            l4_checksum = l4 + 6
+            # A UDP checksum of 0 means there is none, so leave it that way.
+            if packet[l4_checksum:l4_checksum + 2] == '\x00\x00':
+                return
+            self.l4_is_udp = True
+        elif proto == socket.IPPROTO_TCP and l4 + 20 <= ip_end:
+            l4_checksum = l4 + 16
+        else:
+            return
+        if (start < ip + 20 and end > ip + 12) or (start < ip_end
+                                                   and end > l4):
+            self.l4_checksum = l4_checksum
+
+    def _words(self, packet):
+        first = self.offset & ~1
+        return [packet[i] << 8 | (packet[i + 1] if i + 1 < len(packet) else 0)
+                for i in xrange(first, self.offset + self.width, 2)]
+
+    def apply(self, packet):
+        """Writes the current value into packet (a bytearray), and fixes up
+        the checksums that cover it."""
+        old_words = self._words(packet)
+        for i in xrange(self.width):
+            packet[self.offset + i] = (
+                self.value >> (8 * (self.width - 1 - i)) & 0xFF)
+        for old_word, new_word in zip(old_words, self._words(packet)):
+            for at in (self.ip_checksum, self.l4_checksum):
+                if at is not None:
+                    _checksum_update(packet, at, old_word, new_word)
+        # A UDP checksum of 0 means there is none, so send it as all ones.
+        at = self.l4_checksum
+        if self.l4_is_udp and packet[at:at + 2] == '\x00\x00':
+            packet[at:at + 2] = '\xff\xff'
+
+    def advance(self, packet):
+        """Moves on to the next value, wrapping around, and applies it."""
+        self.value = self.min + ((self.value - self.min + self.step)
+                                 % (self.max - self.min + 1))
+        self.apply(packet)
+
+
+def unpack_mutators(data, packet):
+    """Unpacks the data of a SET_MUTATORS, and applies their starting values
+    to packet (a bytearray).
+
+    Returns:
+        list of Mutator: The mutators, or None if the data is malformed or
+        one doesn't fit the packet, in which case packet is left as is.
+    """
+    size = SEASIDE.MUTATOR.size
+    if len(data) % size or len(data) // size > SEASIDE.MAX_MUTATORS:
+        return None
+    try:
+        mutators = [Mutator(packet, *SEASIDE.MUTATOR.unpack_from(data, pos))
+                    for pos in xrange(0, len(data), size)]
+    except ValueError:
+        return None
+    for mutator in mutators:
+        mutator.apply(packet)
+    return mutators
+
+
+class Transmitter(object):
+    """Transmits the configured packet to the sink at the configured delay.
+
+    Mirrors the sending thread of send.c: nothing is sent until START, and
+    the default delay is one second. If a rate is set, it keeps to that
+    instead of the delay. If a sequence is set, it cycles through that
+    instead of sending the packet. Any mutators change the packet after
+    every time it is sent. If a replay is set, it replays that instead of
+    either, and stops sending once it's done.
+    """
+
+    def __init__(self, sink):
+        self.sink = sink
+        self.packet = ''
+        self.mutators = []
+        self.sequence = []
+        self.sequence_next = 0
+        self.replay = None
+        self.delay = 1.0
+        self.rate = None
+        self.sending = False
+        self.sent = 0
+        self.sent_bytes = 0
+
+        # The frames and bytes sent in each of the last ACHIEVED_BUCKETS
+        # buckets ([number, frames, bytes]), and when sending last started.
+        self._achieved = [[0, 0, 0] for _ in xrange(ACHIEVED_BUCKETS)]
+        self._achieved_since = 0
+
+        # Bumped on every change, so a replay knows to start over.
+        self._generation = 0
+        self._changed = threading.Condition()
+        self._thread = threading.Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def configure(self, packet=None, delay=None, sending=None,
+                  sequence=None, rate=None):
+        """Changes any of the packet, delay, sending state, sequence (an
+        empty sequence goes back to sending the packet) or rate (a (unit,
+        rate) tuple, see SEASIDE.pack_SEASIDE_rate; a rate of 0 goes back to
+        the delay). A new packet drops the mutators, and a new delay drops
+        the rate."""
+        with self._changed:
+            if packet is not None:
+                self.packet = packet
+                self.mutators = []
+            if sequence is not None:
+                self.sequence = sequence
+                self.sequence_next = 0
+            if delay is not None:
+                self.delay = delay
+                self.rate = None
+            if rate is not None:
+                self.rate = rate if rate[1] > 0 else None
+            if sending is not None:
+                if sending and not self.sending:
+                    self._achieved_since = time.time()
+                self.sending = sending
+            self._generation += 1
+            self._changed.notify()
+
+    def set_replay(self, replay):
+        """Replays a capture file instead of sending the packet, starting
+        right away, or stops replaying if replay is None.
+
+        Args:
+            replay (tuple): (path, timing, loops, scale), see
+                            SEASIDE.pack_SEASIDE_replay.
+        """
+        with self._changed:
+            self.replay = replay
+            self.sending = replay is not None
+            self._achieved_since = time.time()
+            self._generation += 1
+            self._changed.notify()
+
+    def set_mutators(self, data):
+        """Replaces the mutators with the ones in the data of a SET_MUTATORS.
+
+        Returns:
+            bool: False if the data is malformed, which removes them all.
+        """
+        with self._changed:
+            packet = bytearray(self.packet)
+            mutators = unpack_mutators(data, packet)
+            self.mutators = mutators or []
+            self.packet = str(packet)
+        return mutators is not None
+
+    def send_burst(self, count, gap):
+        """Stops sending, and sends count packets each gap seconds after
+        the one before, from the calling thread. Anything that changes the
+        transmitter (e.g. a STOP) ends the burst early.
+
+        Returns:
+            tuple (int, float): The packets sent, and the seconds that took.
+        """
+        with self._changed:
+            self.sending = False
+            self._generation += 1
+            self._changed.notify()
+            generation = self._generation
+            self._achieved_since = time.time()
+        sent = 0
+        start = time.time()
+        while sent < count:
+            with self._changed:
+                deadline = start + sent * gap
+                while (self._generation == generation
+                       and time.time() < deadline):
+                    self._changed.wait(deadline - time.time())
+                if self._generation != generation:
+                    break
+                packet = self._next_packet()
+            self._send(packet)
+            sent += 1
+        return sent, time.time() - start
+
+    def send_single(self):
+        with self._changed:
+            packet = self._next_packet()
+        if packet:
+            self._send(packet)
+
+    def tx_stats(self):
+        """Returns the transmit counters, like send.c's GET_TX_STATS: the
+        achieved rate is over the last second, or since sending started if
+        that is shorter. Nothing ever fails to send here.
+
+        Returns:
+            SEASIDE.SEASIDE_TX_Stats: the counters.
+        """
+        now = time.time()
+        number = int(now / ACHIEVED_BUCKET)
+        with self._changed:
+            frames = sum(bucket[1] for bucket in self._achieved
+                         if number - bucket[0] < ACHIEVED_BUCKETS)
+            sent_bytes = sum(bucket[2] for bucket in self._achieved
+                             if number - bucket[0] < ACHIEVED_BUCKETS)
+            start = max((number - ACHIEVED_BUCKETS + 1) * ACHIEVED_BUCKET,
+                        self._achieved_since)
+            pps = bps = 0
+            if now > start:
+                pps = int(frames / (now - start))
+                bps = int(sent_bytes * 8 / (now - start))
+            return SEASIDE.SEASIDE_TX_Stats(self.sent, self.sent_bytes, 0, 0,
+                                            pps, bps)
+
+    def _send(self, frame):
+        """Transmits a frame to the sink, and counts it."""
+        now = self.sink.write(frame)
+        number = int(now / ACHIEVED_BUCKET)
+        with self._changed:
+            self.sent += 1
+            self.sent_bytes += len(frame)
+            bucket = self._achieved[number % ACHIEVED_BUCKETS]
+            if bucket[0] != number:
+                bucket[:] = [number, 0, 0]
+            bucket[1] += 1
+            bucket[2] += len(frame)
+
+    def _gap(self):
+        """Returns the time to wait before sending the next packet. Must hold
+        self._changed."""
+        if self.rate is None:
+            return self.delay
+        unit, rate = self.rate
+        if unit == SEASIDE.RATE_UNIT.BPS.value:
+            if self.sequence:
+                return len(self.sequence[self.sequence_next]) * 8 / rate
+            return len(self.packet) * 8 / rate
+        return 1 / rate
+
+    def _next_packet(self):
+        """Returns the packet to send next. Must hold self._changed."""
+        if not self.sequence:
+            packet = self.packet
+            if self.mutators:
+                mutated = bytearray(packet)
+                for mutator in self.mutators:
+                    mutator.advance(mutated)
+                self.packet = str(mutated)
+            return packet
+        packet = self.sequence[self.sequence_next]
+        self.sequence_next = (self.sequence_next + 1) % len(self.sequence)
+        return packet
+
+    def _replay(self, replay, generation):
+        """Replays a capture file, until done or anything changes."""
+        path, timing, loops, scale = replay
+        if timing != SEASIDE.REPLAY_TIMING.SCALED.value:
+            scale = 1.0
+        loop = 0
+        while loops == 0 or loop < loops:
+            start = time.time()
+            first = timestamp = None
+            with pcap_reader.PcapReader(path) as reader:
+                for record in reader:
+                    # Records without a timestamp go out with the one
+                    # before them.
+                    if record.timestamp is not None:
+                        timestamp = record.timestamp
+                        if first is None:
+                            first = timestamp
+                    deadline = 0
+                    if (timing != SEASIDE.REPLAY_TIMING.MAX_RATE.value
+                            and first is not None):
+                        deadline = start + max(timestamp - first, 0) * scale
+                    with self._changed:
+                        while (self._generation == generation
+                               and time.time() < deadline):
+                            self._changed.wait(deadline - time.time())
+                        if self._generation != generation:
+                            return
+
+                    self._send(record.data.tobytes())
+            loop += 1
+
+        with self._changed:
+            if self._generation == generation:
+                print 'Replay of %s finished' % path
+                self.sending = False
+
+    def _run(self):
+        next_send = time.time()
+        while True:
+            with self._changed:
+                while not (self.sending and (self.packet or self.sequence
+                                             or self.replay)):
+                    self._changed.wait()
+                    next_send = time.time()
+                replay, generation = self.replay, self._generation
+            if replay is not None:
+                self._replay(replay, generation)
+                continue
+
+            with self._changed:
+                if self._generation != generation:
+                    continue
+                delay = self._gap()
+
+                # Wait for the deadline, waking up early on any change.
+                next_send += delay
+                left = next_send - time.time()
+                if left > 0:
+                    self._changed.wait(left)
+                    if time.time() < next_send:
+                        # Something changed, start the interval over.
+                        next_send = time.time()
+                        continue
+                elif left < -1:
+                    # Fell far behind, don't try to catch up all at once.
+                    next_send = time.time()
+                packet = self._next_packet()
+
+            self._send(packet)
+
+
+def unpack_sequence(data):
+    """Unpacks the data of a START_SEQUENCE, see
+    SEASIDE.pack_SEASIDE_sequence.
+
+    Returns:
+        list of str: The packets, or None if the data is malformed.
+    """
+    packets = []
+    pos = 0
+    length_size = SEASIDE.SEQUENCE_LENGTH.size
+    while pos < len(data):
+        if (len(data) - pos < length_size
+                or len(packets) == SEASIDE.MAX_SEQUENCE_PACKETS):
+            return None
+        length = SEASIDE.SEQUENCE_LENGTH.unpack_from(data, pos)[0]
+        pos += length_size
+        if length == 0 or length > len(data) - pos:
+            return None
+        packets.append(data[pos:pos + length])
+        pos += length
+    return packets or None
+
+
+def unpack_rate(data):
+    """Unpacks the data of a SET_RATE, see SEASIDE.pack_SEASIDE_rate.
+
+    Returns:
+        tuple: (unit, rate), or None if the data is malformed.
+    """
+    if len(data) != SEASIDE.RATE.size:
+        return None
+    unit, rate = SEASIDE.RATE.unpack(data)
+    if (unit > SEASIDE.RATE_UNIT.BPS.value or not 0 <= rate < float('inf')):
+        return None
+    return unit, rate
+
+
+def unpack_burst(data):
+    """Unpacks the data of a SEND_BURST, see SEASIDE.pack_SEASIDE_burst.
+
+    Returns:
+        tuple: (count, gap in seconds), or None if the data is malformed.
+    """
+    if len(data) == SEASIDE.BURST.size:
+        count, gap = SEASIDE.BURST.unpack(data)
+    elif len(data) == struct.calcsize('=Q'):
+        count, gap = struct.unpack('=Q', data)[0], 0
+    else:
+        return None
+    if count == 0:
+        return None
+    return count, gap / 1e9
+
+
+def unpack_replay(data):
+    """Unpacks the data of a START_REPLAY, see SEASIDE.pack_SEASIDE_replay.
+
+    Returns:
+        tuple: (path, timing, loops, scale), or None if the data is malformed
+        or the file isn't a capture.
+    """
+    if len(data) <= SEASIDE.REPLAY.size:
+        return None
+    timing, loops, scale = SEASIDE.REPLAY.unpack_from(data)
+    path = data[SEASIDE.REPLAY.size:]
+    if timing > SEASIDE.REPLAY_TIMING.MAX_RATE.value or not scale >= 0:
+        return None
+    try:
+        pcap_reader.PcapReader(path).close()
+    except IOError as error:
+        print error
+        return None
+    return path, timing, loops, scale
+
+
+class _Handler(SocketServer.BaseRequestHandler):
+    """Serves one UI connection, the same way listen_packet_info does."""
+
+    def handle(self):
+        daemon = self.server.daemon
+        self.stats_interval = 0
+        self.next_stats = 0
+
+        while True:
+            try:
+                if not self._wait_for_message():
+                    return
+                flag, request_id, data = SEASIDE.read_SEASIDE_frame(
+                    self.request)
+            except EOFError:
+                return
+            except ValueError as error:
+                print error
+                return
+            daemon.count_message()
+            data = data.tobytes()
+
+            if flag == SEASIDE_FLAGS.SUBSCRIBE_STATS.value:
+                interval = 0
+                if len(data) >= SEASIDE.STATS_INTERVAL.size:
+                    interval = SEASIDE.STATS_INTERVAL.unpack_from(data)[0]
+                interval /= 1000.0
+                if interval:
+                    interval = max(interval, MIN_STATS_INTERVAL)
+                self.stats_interval = interval
+                self.next_stats = time.time() + interval
+                continue
+
+            response = self.server.serve(flag, data)
+            if response is not None:
+                self._send(SEASIDE_FLAGS.RESPONSE.value, response, request_id)
+
+    def _wait_for_message(self):
+        """Pushes statistics until a message arrives, if subscribed.
+
+        Returns:
+            bool: False if the connection was closed.
+        """
+        while self.stats_interval:
+            timeout = max(0, self.next_stats - time.time())
+            readable, _, _ = select.select([self.request], [], [], timeout)
+            if readable:
+                return True
+            bandwidth, packets = self.server.stats()
+            self._send(SEASIDE_FLAGS.STATS.value, SEASIDE.STATS_RECORD.pack(
+                _monotonic_ns(), bandwidth, packets))
+            self.next_stats += self.stats_interval
+            if self.next_stats < time.time():
+                self.next_stats = time.time() + self.stats_interval
+        return True
+
+    def _send(self, flag, data, request_id=None):
+        self.request.sendall(SEASIDE.pack_SEASIDE_header(flag, len(data),
+                                                         request_id) + data)
+
+
+class _Server(SocketServer.ThreadingMixIn, SocketServer.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, address, daemon, serve, stats):
+        if os.path.exists(address):
+            os.unlink(address)
+        SocketServer.UnixStreamServer.__init__(self, address, _Handler)
+        self.daemon = daemon
+        self.serve = serve
+        self.stats = stats
+
+
+class ReferenceDaemon(object):
+    """Serves the sending side's socket, and optionally the receiving side's.
+
+    Args:
+        sink (MemorySink or PcapSink): where transmitted frames go.
+        send_socket (str): the path to serve the sending side on.
+        receive_socket (str): the path to serve the receiving side on, from
+                              the same sink, or None not to.
+    """
+
+    def __init__(self, sink, send_socket=SEND_SOCKET, receive_socket=None):
+        self.sink = sink
+        self.transmitter = Transmitter(sink)
+        self.messages = 0
+        self._messages_lock = threading.Lock()
+
+        self.servers = [_Server(send_socket, self, self.serve_send,
+                                self.send_stats)]
+        if receive_socket is not None:
+            self.servers.append(_Server(receive_socket, self,
+                                        self.serve_receive,
+                                        self.receive_stats))
+
+    def count_message(self):
+        with self._messages_lock:
+            self.messages += 1
+
+    def serve_forever(self):
+        for server in self.servers[1:]:
+            thread = threading.Thread(target=server.serve_forever)
+            thread.daemon = True
+            thread.start()
+        self.servers[0].serve_forever()
+
+    def close(self):
+        for server in self.servers:
+            server.server_close()
+            os.unlink(server.server_address)
+        self.sink.close()
+
+    def serve_send(self, flag, data):
+        """Handles a message to the sending side, like send.c does.
+
+        Returns:
+            str: The data of the response, or None if there is none.
+        """
+        transmitter = self.transmitter
+        if flag == SEASIDE_FLAGS.PACKET.value:
+            if len(data) > SEASIDE.MAX_PACKET_SIZE:
+                print 'Packet of %d bytes is too big, ignoring it.' % len(data)
+            else:
+                transmitter.configure(packet=data)
+        elif flag == SEASIDE_FLAGS.START.value:
+            transmitter.configure(sending=True)
+        elif flag == SEASIDE_FLAGS.STOP.value:
+            transmitter.configure(sending=False)
+        elif flag == SEASIDE_FLAGS.DELAY.value:
+            seconds, useconds = DELAY.unpack_from(data)
+            transmitter.configure(delay=seconds + useconds / 1000000.0)
+        elif flag == SEASIDE_FLAGS.SET_RATE.value:
+            rate = unpack_rate(data)
+            if rate is None:
+                print 'Invalid rate, ignoring it.'
+            else:
+                transmitter.configure(rate=rate)
+        elif flag == SEASIDE_FLAGS.SEND_BURST.value:
+            burst = unpack_burst(data)
+            if burst is None or not (transmitter.packet
+                                     or transmitter.sequence):
+                print 'Invalid burst, ignoring it.'
+                return ''
+            sent, duration = transmitter.send_burst(*burst)
+            return SEASIDE.BURST_RESULT.pack(sent, int(duration * 1e9))
+        elif flag == SEASIDE_FLAGS.SINGLE_PACKET.value:
+            transmitter.send_single()
+        elif flag == SEASIDE_FLAGS.START_SEQUENCE.value:
+            sequence = unpack_sequence(data)
+            if sequence is None:
+                print 'Malformed packet sequence, ignoring it.'
+            else:
+                transmitter.configure(sequence=sequence)
+        elif flag == SEASIDE_FLAGS.STOP_SEQUENCE.value:
+            transmitter.configure(sequence=[])
+        elif flag == SEASIDE_FLAGS.START_REPLAY.value:
+            replay = unpack_replay(data)
+            if replay is None:
+                print 'Invalid replay, ignoring it.'
+            else:
+                transmitter.set_replay(replay)
+        elif flag == SEASIDE_FLAGS.STOP_REPLAY.value:
+            transmitter.set_replay(None)
+        elif flag == SEASIDE_FLAGS.SET_MUTATORS.value:
+            if not transmitter.set_mutators(data):
+                print 'Invalid field mutators, removed them.'
+        elif flag == SEASIDE_FLAGS.GET_PACKET.value:
+            return transmitter.packet
+        elif flag == SEASIDE_FLAGS.NUM_PACKETS.value:
+            return struct.pack('=Q', transmitter.sent)
+        elif flag == SEASIDE_FLAGS.GET_BANDWIDTH.value:
+            return struct.pack('=Q', transmitter.tx_stats().bps)
+        elif flag == SEASIDE_FLAGS.GET_PACKET_SIZE.value:
+            return SIZE_T.pack(len(transmitter.packet))
+        elif flag == SEASIDE_FLAGS.GET_TX_STATS.value:
+            return SEASIDE.TX_STATS.pack(*transmitter.tx_stats())
+        return None
+
+    def send_stats(self):
+        stats = self.transmitter.tx_stats()
+        return stats.bps, stats.packets
+
+    def serve_receive(self, flag, data):
+        """Handles a message to the receiving side, like receive.c does,
+        treating every transmitted frame as received.
+
+        Returns:
+            str: The data of the response, or None if there is none.
+        """
+        sink = self.sink
+        if flag == SEASIDE_FLAGS.NUM_PACKETS.value:
+            return struct.pack('=I', sink.packets & 0xFFFFFFFF)
+        elif flag == SEASIDE_FLAGS.GET_PACKET.value:
+            return sink.last_frame
+        elif flag == SEASIDE_FLAGS.GET_BANDWIDTH.value:
+            return struct.pack('=Q', sink.bandwidth())
+        elif flag == SEASIDE_FLAGS.GET_PACKETS.value:
+            since, max_packets = 0, 0xFFFFFFFF
+            if len(data) >= SEASIDE.PACKETS_REQUEST.size:
+                since, max_packets = SEASIDE.PACKETS_REQUEST.unpack_from(data)
+            elif len(data) >= 8:
+                since = struct.unpack_from('=Q', data)[0]
+            return sink.get_packets(since, max_packets)
+        elif flag == SEASIDE_FLAGS.GET_RX_RATES.value:
+            count = min(len(data) // SEASIDE.RX_RATE_WINDOW.size,
+                        SEASIDE.RX_RATE_MAX_WINDOWS)
+            windows = [SEASIDE.RX_RATE_WINDOW.unpack_from(data, i * 4)[0]
+                       / 1000.0 for i in xrange(count)]
+            return ''.join(
+                SEASIDE.RX_RATE.pack(int(round(rate.window * 1000)),
+                                     rate.bps, rate.pps)
+                for rate in sink.rx_rates(windows
+                                          or SEASIDE.RX_RATE_DEFAULT_WINDOWS))
+        elif flag == SEASIDE_FLAGS.GET_PACKET_SIZE.value:
+            return SIZE_T.pack(len(sink.last_frame))
+        elif flag == SEASIDE_FLAGS.GET_GAPS.value:
+            return sink.gaps(reset=data[:1] not in ('', '\x00'))
+        elif flag == SEASIDE_FLAGS.GET_FLOWS.value:
+            order = SEASIDE.FLOW_ORDER.BYTES.value
+            count = FLOW_DEFAULT_TOP
+            if len(data) >= SEASIDE.FLOWS_REQUEST.size:
+                order, count = SEASIDE.FLOWS_REQUEST.unpack_from(data)
+            elif data:
+                order = ord(data[0])
+            return sink.get_flows(order, count)
+        return None
+
+    def receive_stats(self):
+        return self.sink.bandwidth(), self.sink.packets
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description='Pure-Python stand-in for the SEASIDE daemons.')
+    parser.add_argument('--pcap', help='write transmitted frames to this '
+                        'pcap file, instead of only keeping counters')
+    parser.add_argument('--send-socket', default=SEND_SOCKET)
+    parser.add_argument('--loopback', action='store_true',
+                        help='also serve the receiving side, as if every '
+                        'transmitted frame were received')
+    parser.add_argument('--receive-socket', default=RECEIVE_SOCKET)
+    args = parser.parse_args()
+
+    sink = PcapSink(args.pcap) if args.pcap else MemorySink()
+    daemon = ReferenceDaemon(
+        sink, args.send_socket,
+        args.receive_socket if args.loopback else None)
+
+    print 'Serving SEASIDE on', ', '.join(s.server_address
+                                          for s in daemon.servers)
+    # Exit the same way on kill as on Ctrl-C, so the pcap file is complete.
+    signal.signal(signal.SIGTERM, signal.default_int_handler)
+    start = time.time()
+    try:
+        daemon.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        elapsed = time.time() - start
+        print 'Handled %d SEASIDE messages in %.1f s (%.1f/s), ' \
+              'transmitted %d packets.' % (daemon.messages, elapsed,
+                                           daemon.messages / elapsed,
+                                           sink.packets)
+        daemon.close()
+
+
+if __name__ == '__main__':
+    main()